@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
+from broadcaster import Broadcaster
+
+
+class SlowSocket(object):
+    '''blocks in send until released'''
+    def __init__(self):
+        self.sent = []
+        self.release = threading.Event()
+        self.closed = False
+
+    def send(self, message):
+        self.release.wait(5)
+        self.sent.append(message)
+
+    def close(self):
+        self.closed = True
+
+
+class BrokenSocket(object):
+    def send(self, message):
+        raise IOError("gone")
+
+
+def wait_for(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_slow_client_does_not_hold_up_others():
+    broadcaster = Broadcaster(size=3, policy="drop")
+    slow = SlowSocket()
+    fast = SlowSocket()
+    fast.release.set()
+    broadcaster.add(slow, "backlog")
+    broadcaster.add(fast, "backlog")
+
+    started = time.time()
+    for n in range(20):
+        broadcaster.broadcast(str(n))
+        # like the watcher, which sends one state per tick
+        time.sleep(0.01)
+    assert time.time() - started < 1
+
+    assert wait_for(lambda: len(fast.sent) == 21)
+    assert fast.sent == ["backlog"] + [str(n) for n in range(20)]
+
+    slow.release.set()
+    assert wait_for(lambda: broadcaster.stats()[0]['queued'] == 0)
+    stats = broadcaster.stats()[0]
+    # the backlog is in flight, 3 more fit in the queue, the rest dropped
+    assert slow.sent[0] == "backlog"
+    assert stats['sent'] + stats['dropped'] == 21
+    assert stats['dropped'] >= 16
+    assert stats['max_latency'] > 0
+
+
+def test_coalesce_skips_to_latest():
+    broadcaster = Broadcaster(size=2, policy="coalesce")
+    slow = SlowSocket()
+    broadcaster.add(slow, "backlog")
+    for n in range(10):
+        broadcaster.broadcast(str(n))
+    slow.release.set()
+    assert wait_for(lambda: broadcaster.stats()[0]['queued'] == 0)
+    assert slow.sent[0] == "backlog"
+    assert slow.sent[-1] == "9"
+    assert len(slow.sent) < 11
+
+
+def test_disconnect_slow_and_broken_clients():
+    broadcaster = Broadcaster(size=1, policy="disconnect")
+    slow = SlowSocket()
+    broadcaster.add(slow)
+    broadcaster.add(BrokenSocket())
+    for n in range(5):
+        broadcaster.broadcast(str(n))
+    slow.release.set()
+    assert wait_for(lambda: len(broadcaster) == 0)
+    assert slow.closed
+
+
+def test_client_that_fails_on_its_backlog_is_removed(monkeypatch):
+    import broadcaster as module
+
+    class WaitingClientQueue(module.ClientQueue):
+        # the sender gives up on the broken socket before put returns
+        def put(self, message, droppable=True):
+            queued = super().put(message, droppable)
+            self.join(5)
+            return queued
+
+    monkeypatch.setattr(module, "ClientQueue", WaitingClientQueue)
+    broadcaster = Broadcaster(size=10, policy="drop")
+    broadcaster.add(BrokenSocket(), "backlog")
+    assert len(broadcaster) == 0
+    assert broadcaster.stats() == []
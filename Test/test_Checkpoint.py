@@ -0,0 +1,100 @@
+import os
+import sys
+import json
+import time
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
+import config
+from checkpoint import Checkpoint
+from oven import SimulatedOven, VirtualClock
+from test_Profile import get_profile
+
+
+def test_write_is_atomic_and_compact(tmp_path):
+    filename = str(tmp_path / "state.json")
+    checkpoint = Checkpoint(filename, interval=0, fsync="always")
+    assert checkpoint.write({"state": "RUNNING", "runtime": 10})
+    assert os.listdir(str(tmp_path)) == ["state.json"]
+    with open(filename) as f:
+        text = f.read()
+    assert json.loads(text) == {"state": "RUNNING", "runtime": 10}
+    assert "\n" not in text
+    assert checkpoint.read() == {"state": "RUNNING", "runtime": 10}
+
+    stats = checkpoint.stats()
+    assert stats["writes"] == 1
+    assert stats["bytes"] == len(text)
+    assert stats["last_latency"] >= 0
+
+
+def test_unchanged_and_early_writes_are_skipped(tmp_path):
+    filename = str(tmp_path / "state.json")
+    checkpoint = Checkpoint(filename, interval=3600, fsync="never")
+    assert checkpoint.write({"runtime": 1})
+    # too soon
+    assert not checkpoint.write({"runtime": 2})
+    assert checkpoint.read() == {"runtime": 1}
+    # forced
+    assert checkpoint.write({"runtime": 2}, force=True)
+    # nothing changed, not even forced
+    assert not checkpoint.write({"runtime": 2}, force=True)
+
+    checkpoint.interval = 0.01
+    time.sleep(0.02)
+    assert checkpoint.write({"runtime": 3})
+    stats = checkpoint.stats()
+    assert (stats["writes"], stats["skipped"]) == (3, 2)
+
+
+def test_broken_file_reads_as_none(tmp_path):
+    filename = str(tmp_path / "state.json")
+    checkpoint = Checkpoint(filename, interval=0, fsync="never")
+    assert checkpoint.read() is None
+    with open(filename, "w") as f:
+        f.write('{"state": "RUNN')
+    assert checkpoint.read() is None
+    # older, indented state files still load
+    with open(filename, "w") as f:
+        json.dump({"state": "RUNNING"}, f, indent=4)
+    assert checkpoint.read() == {"state": "RUNNING"}
+
+
+def test_resume_from_control_state():
+    profile = get_profile()
+    oven = SimulatedOven(clock=VirtualClock(), headless=True)
+    oven.run_profile(profile)
+    for i in range(300):
+        oven.step()
+    # through json like the state file
+    checkpoint = json.loads(json.dumps(oven.control_state()))
+
+    # power comes back hours later, the kiln is as hot as it was
+    restarted = SimulatedOven(clock=VirtualClock(oven.clock.now().replace(hour=9)), headless=True)
+    (restarted.t, restarted.t_h) = (oven.t, oven.t_h)
+    restarted.board.temp_sensor.simulated_temperature = oven.t
+    resumed = restarted.checkpointed_profile(checkpoint)
+    assert resumed.data == profile.data
+    restarted.resume(checkpoint, resumed)
+    assert restarted.pid.iterm == oven.pid.iterm
+    assert restarted.heat_rate_temps == [tuple(p) for p in oven.heat_rate_temps]
+
+    for i in range(20):
+        oven.step()
+        restarted.step()
+        assert restarted.pid.pidstats['out'] == pytest.approx(oven.pid.pidstats['out'], abs=1e-9)
+        assert restarted.t == pytest.approx(oven.t, abs=1e-9)
+
+    # a damaged copy is not used, the profile is read from disk instead
+    checkpoint['schedule']['data'][1][1] += 1
+    assert restarted.checkpointed_profile(checkpoint).data != checkpoint['schedule']['data']
+
+
+def test_no_automatic_restart_from_state_file_without_state(tmp_path, monkeypatch):
+    filename = str(tmp_path / "state.json")
+    with open(filename, "w") as f:
+        json.dump({"runtime": 600}, f)
+    monkeypatch.setattr(config, "automatic_restarts", True)
+    monkeypatch.setattr(config, "automatic_restart_state_file", filename)
+    oven = SimulatedOven(clock=VirtualClock(), headless=True)
+    assert oven.should_i_automatic_restart() is False
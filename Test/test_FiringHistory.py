@@ -0,0 +1,148 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
+from firingHistory import FiringHistory, COLUMNS
+
+
+def state(n):
+    return {
+        'runtime': n * 2.0,
+        'temperature': 100.0 + n,
+        'target': 100.0,
+        'heat': 1.0,
+        'heat_rate': 5.0,
+        'cost': n * 0.01,
+        'catching_up': n % 2 == 0,
+        'state': "RUNNING",
+        'totaltime': 3600,
+        'profile': "test",
+        'pidstats': {'time': 1000.0 + n * 2, 'err': -float(n), 'out': 0.5},
+    }
+
+
+def all_states(history):
+    return [history.as_state(row) for row in history.rows()]
+
+
+def column(history, name):
+    c = COLUMNS.index(name)
+    return [row[c] for row in history.rows()]
+
+
+def nbytes(history):
+    return sum(len(column) * column.itemsize for (ring, factor) in history.tiers
+        for column in ring.data)
+
+
+def test_keeps_states_as_they_were():
+    history = FiringHistory(samples=10, archive=[(2, 4)])
+    for n in range(5):
+        history.append(state(n))
+
+    states = all_states(history)
+    assert len(history) == 5
+    assert states[3]['temperature'] == 103.0
+    assert states[3]['catching_up'] is False
+    assert states[3]['profile'] == "test"
+    # pidstats only has the fields that were there
+    assert states[3]['pidstats'] == {'time': 1006.0, 'err': -3.0, 'out': 0.5}
+    assert column(history, 'runtime') == [0.0, 2.0, 4.0, 6.0, 8.0]
+
+
+def test_memory_is_bounded():
+    history = FiringHistory(samples=10, archive=[(2, 4), (3, 2)])
+    size = nbytes(history)
+    assert size == (10 + 4 + 2) * len(COLUMNS) * 8
+
+    for n in range(1000):
+        history.append(state(n))
+
+    assert nbytes(history) == size
+    assert len(history) <= 16
+    runtimes = column(history, 'runtime')
+    # oldest first, newest at full resolution
+    assert runtimes == sorted(runtimes)
+    assert runtimes[-10:] == [n * 2.0 for n in range(990, 1000)]
+
+
+def test_archive_averages_blocks():
+    history = FiringHistory(samples=4, archive=[(2, 10)])
+    for n in range(6):
+        history.append(state(n))
+
+    # 0 and 1 were averaged into one archived row when the ring filled
+    assert column(history, 'temperature') == [100.5, 102.0, 103.0, 104.0, 105.0]
+    assert all_states(history)[0]['pidstats']['err'] == -0.5
+
+
+def test_clear():
+    history = FiringHistory(samples=4, archive=[(2, 10)])
+    for n in range(20):
+        history.append(state(n))
+    history.clear()
+    assert len(history) == 0
+    assert all_states(history) == []
+
+
+def test_downsampled_keeps_spikes():
+    history = FiringHistory(samples=5000, archive=[])
+    for n in range(3000):
+        s = state(n)
+        s['temperature'] = 500.0
+        if n == 1234:
+            s['temperature'] = 550.0
+        if n == 2345:
+            s['temperature'] = 450.0
+        history.append(s)
+
+    states = history.downsampled(50)
+    assert len(states) <= 50
+    temps = [s['temperature'] for s in states]
+    assert 550.0 in temps and 450.0 in temps
+    runtimes = [s['runtime'] for s in states]
+    assert runtimes == sorted(runtimes)
+    # the newest state is always there for a continuous graph
+    assert runtimes[-1] == 2999 * 2.0
+
+
+def test_downsampled_updates_incrementally():
+    history = FiringHistory(samples=5000, archive=[])
+    for n in range(100):
+        history.append(state(n))
+    first = history.downsampled(20)
+    assert len(first) <= 20
+
+    for n in range(100, 1000):
+        history.append(state(n))
+    # same as building the series from scratch
+    fresh = FiringHistory(samples=5000, archive=[])
+    for n in range(1000):
+        fresh.append(state(n))
+    assert history.downsampled(20) == fresh.downsampled(20)
+    assert history.downsampled(20)[-1]['runtime'] == 999 * 2.0
+
+
+def test_downsampled_json_matches_states():
+    import json
+    history = FiringHistory(samples=5000, archive=[])
+    for n in range(10):
+        history.append(state(n))
+    history.downsampled_json(8)
+    for n in range(10, 500):
+        history.append(state(n))
+    assert history.downsampled_json(8) == json.dumps(history.downsampled(8))
+
+
+def test_since_only_replays_full_resolution_states():
+    history = FiringHistory(samples=4, archive=[(2, 10)])
+    for n in range(10):
+        s = state(n)
+        s['seq'] = n + 1
+        history.append(s)
+
+    assert [s['seq'] for s in history.since(7)] == [8, 9, 10]
+    assert [s['seq'] for s in history.since(6)] == [7, 8, 9, 10]
+    assert history.since(10) == []
+    # 6 and older were averaged into the archive
+    assert history.since(5) is None
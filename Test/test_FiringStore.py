@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
+from firingStore import FiringStore
+
+
+def state(n):
+    return {
+        'state': "RUNNING",
+        'runtime': n * 2.0,
+        'server_time': 1000.0 + n * 2,
+        'temperature': 20.0 + n,
+        'target': 21.0 + n,
+        'heat': 1.0,
+        'heat_rate': 1800.0,
+        'cost': n * 0.01,
+        'catching_up': False,
+        'pidstats': {'out': 0.5, 'p': 1.0, 'i': 2.0, 'd': 0.0},
+    }
+
+
+def test_runs_and_range_queries(tmp_path):
+    path = str(tmp_path / "history.sqlite3")
+    store = FiringStore(path, commit_interval=3600)
+    profile = json.dumps({"name": "test", "data": [[0, 20], [3600, 1000]], "type": "profile"})
+    run = store.start_run(profile, "test")
+    for n in range(1000):
+        store.add(state(n))
+    # nothing written yet, but buffered states are found
+    assert len(list(store.samples(run, 100, 199, ['runtime']))) == 50
+    store.flush()
+    store.add(state(1000))
+
+    rows = list(store.samples(run, 100, 199, ['runtime', 'temperature', 'pid_out']))
+    assert rows[0] == [100.0, 70.0, 0.5]
+    assert len(rows) == 50
+    assert len(list(store.samples(run))) == 1001
+    store.end_run("IDLE")
+
+    (meta,) = store.runs()
+    assert meta['id'] == run and meta['profile'] == "test"
+    assert meta['samples'] == 1001
+    assert meta['max_temperature'] == 1020.0
+    assert meta['end_state'] == "IDLE" and meta['ended'] >= meta['started']
+    assert store.get_run(run)['schedule']['name'] == "test"
+
+    # a second store on the same file sees everything, in WAL mode
+    again = FiringStore(path)
+    assert again.connect().execute('PRAGMA journal_mode').fetchone()[0] == "wal"
+    assert len(list(again.samples(run, 0, 1e9))) == 1001
+
+
+def test_range_queries_use_the_index(tmp_path):
+    store = FiringStore(str(tmp_path / "history.sqlite3"))
+    plan = store.connect().execute('EXPLAIN QUERY PLAN SELECT runtime FROM samples '
+        'WHERE run = 1 AND runtime BETWEEN 10 AND 20 ORDER BY runtime').fetchall()
+    assert "samples_run_runtime" in " ".join(str(tuple(row)) for row in plan)
+
+
+def firing(store, states, flush=True):
+    run = store.start_run("null", "test")
+    for n in range(states):
+        store.add(state(n))
+    if flush:
+        store.flush()
+    return run
+
+
+def test_rollups_keep_min_max_mean_and_replace_old_states(tmp_path):
+    store = FiringStore(str(tmp_path / "history.sqlite3"))
+    # two hours
+    run = firing(store, 3600)
+    store.end_run()
+    store.compact()
+
+    (width, rows) = store.window(run, points=100, columns=['count', 'runtime',
+        'temperature', 'temperature_min', 'temperature_max'])
+    rows = list(rows)
+    assert width == 60
+    assert len(rows) == 120
+    assert rows[0] == [30, 29.0, 34.5, 20.0, 49.0]
+    (width, rows) = store.window(run, points=10)
+    assert (width, len(list(rows))) == (600, 12)
+    # a short span is read state by state
+    (width, rows) = store.window(run, 600, 700, points=100)
+    assert width == 0
+    assert len(list(rows)) == 51
+
+    # a year later only the 10 minute rows are left
+    (meta,) = store.runs()
+    store.compact(now=meta['ended'] + 365 * 86400 + 1)
+    db = store.connect()
+    assert db.execute('SELECT count(*) FROM samples').fetchone()[0] == 0
+    assert db.execute('SELECT count(*) FROM rollup_60').fetchone()[0] == 0
+    (width, rows) = store.window(run, 600, 700, points=100)
+    assert width == 600
+    assert [r[0] for r in rows] == [300]
+
+
+def test_running_firing_is_rolled_up_as_far_as_it_can(tmp_path):
+    store = FiringStore(str(tmp_path / "history.sqlite3"))
+    run = firing(store, 1000)
+    store.compact()
+    (meta,) = store.runs()
+    assert store.get_run(run)['rolled_up'] == 1800
+    # rolled up rows and the rest aggregated on the fly look the same
+    (width, rows) = store.window(run, points=20, columns=['runtime', 'temperature_max'])
+    rows = list(rows)
+    assert width == 60
+    assert len(rows) == 34
+    assert rows[-1] == [1989.0, 1019.0]
+
+
+class RunningOven(object):
+    '''a firing that is already going when the watcher starts'''
+    time_step = 0.01
+
+    def __init__(self):
+        self.n = 0
+
+    def get_state(self):
+        self.n += 1
+        return state(self.n)
+
+
+def test_watcher_stores_nothing_before_record(tmp_path, monkeypatch):
+    import time
+    import config
+    from ovenWatcher import OvenWatcher
+    from oven import Profile
+
+    monkeypatch.setattr(config, "history_db", str(tmp_path / "history.sqlite3"))
+    oven = RunningOven()
+    watcher = OvenWatcher(oven)
+    store = watcher.store
+    time.sleep(0.1)
+    assert store.run is None and store.runs() == []
+
+    watcher.record(Profile(json.dumps({"name": "test", "data": [[0, 20], [3600, 1000]]})))
+    first = watcher.history.as_state(next(watcher.history.rows()))
+    time.sleep(0.1)
+    store.flush()
+    (meta,) = store.runs()
+    assert meta['samples'] > 1
+    # the first state stored is the one record took
+    rows = list(store.samples(meta['id'], columns=['runtime']))
+    assert rows[0] == [first['runtime']]
+
+    # starting another firing, the first one gets none of its states
+    watcher.stop_recording()
+    samples = store.get_run(meta['id'])['samples']
+    time.sleep(0.1)
+    assert store.get_run(meta['id'])['samples'] == samples
+    assert store.run is None
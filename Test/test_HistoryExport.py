@@ -0,0 +1,79 @@
+import os
+import sys
+import csv
+import json
+import gzip
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
+import pytest
+from downsample import minmax_buckets
+from firingStore import FiringStore
+from historyExport import HistoryExport
+from test_FiringStore import state
+
+
+def firing(tmp_path, states):
+    store = FiringStore(str(tmp_path / "history.sqlite3"))
+    run = store.start_run("null", "test")
+    for n in range(states):
+        s = state(n)
+        if n == 1234:
+            s['temperature'] = 5000.0
+        store.add(s)
+    store.flush()
+    return (store, run)
+
+
+def test_minmax_buckets_keep_extremes_and_the_last_row():
+    rows = [[t, (t * 37) % 101] for t in range(1000)]
+    kept = list(minmax_buckets(iter(rows), 0, 1000, 10))
+    assert len(kept) == 21
+    assert kept[-1] == rows[-1]
+    assert [r[0] for r in kept] == sorted(r[0] for r in kept)
+    for b in range(10):
+        bucket = rows[b * 100:(b + 1) * 100]
+        assert min(bucket, key=lambda r: r[1]) in kept
+        assert max(bucket, key=lambda r: r[1]) in kept
+
+
+def test_ndjson_is_downsampled_and_keeps_spikes(tmp_path):
+    (store, run) = firing(tmp_path, 3600)
+    export = HistoryExport(store, points=200)
+    lines = [json.loads(l) for l in b"".join(export.chunks()).decode().splitlines()]
+    (header, rows) = (lines[0], lines[1:])
+    assert header['type'] == "run" and header['id'] == run
+    # two hours in 200 points are read as 1 minute rows, aggregated on
+    # the fly as this firing is not rolled up yet
+    assert header['tier'] == 60
+    assert 100 <= len(rows) <= 201
+    assert max(r['temperature_max'] for r in rows) == 5000.0
+    assert rows[-1]['runtime'] == 7169.0
+
+    # hours are seconds of runtime
+    export = HistoryExport(store, run, 3600, 3700, points=1000)
+    rows = [json.loads(l) for l in b"".join(export.chunks()).decode().splitlines()[1:]]
+    assert [r['runtime'] for r in rows] == [3600.0 + 2 * n for n in range(51)]
+
+
+def test_csv_gzip_and_etag(tmp_path):
+    (store, run) = firing(tmp_path, 600)
+    query = {'run': str(run), 'format': 'csv', 'columns': 'runtime,temperature', 'points': '100'}
+    export = HistoryExport.from_query(store, query)
+    plain = b"".join(export.chunks())
+    assert gzip.decompress(b"".join(HistoryExport.from_query(store, query).chunks(gzip=True))) == plain
+    rows = list(csv.reader(plain.decode().splitlines()))
+    assert rows[0] == ['runtime', 'temperature']
+    assert len(rows) <= 102
+
+    etag = export.etag()
+    assert HistoryExport.from_query(store, query).etag() == etag
+    assert export.etag(gzip=True) != etag
+    store.add(state(600))
+    assert HistoryExport.from_query(store, query).etag() != etag
+
+    with pytest.raises(LookupError):
+        HistoryExport(store, run + 1)
+    with pytest.raises(ValueError):
+        HistoryExport.from_query(store, {'from': 'six'})
+    with pytest.raises(ValueError):
+        HistoryExport(store, columns=['oops'])
@@ -0,0 +1,72 @@
+import os
+import sys
+import json
+import importlib.util
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
+import config
+
+
+@pytest.fixture(scope="module")
+def controller():
+    pytest.importorskip("bottle")
+    pytest.importorskip("geventwebsocket")
+    # a simulated kiln, nothing stored and nothing restarted
+    saved = (config.simulate, config.history_db, config.automatic_restarts)
+    (config.simulate, config.history_db, config.automatic_restarts) = (True, None, False)
+    try:
+        path = os.path.join(os.path.dirname(__file__), '..', 'kiln-controller.py')
+        spec = importlib.util.spec_from_file_location("kiln_controller", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        (config.simulate, config.history_db, config.automatic_restarts) = saved
+    module.oven.automatic_restarts = False
+    yield module
+    module.oven.abort_run()
+
+
+def post(controller, body):
+    '''POST body to /api, returns the decoded response'''
+    import io
+    data = json.dumps(body).encode('utf-8')
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'PATH_INFO': '/api',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(data)),
+        'wsgi.input': io.BytesIO(data),
+        'wsgi.url_scheme': 'http',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '8081',
+    }
+    status = []
+    body = b"".join(controller.app(environ, lambda s, h, e=None: status.append(s)))
+    assert status[0].startswith("200")
+    return json.loads(body)
+
+
+def test_autotune_is_refused_while_firing(controller):
+    oven = controller.oven
+    assert post(controller, {"cmd": "run", "profile": "test-fast"})["success"]
+    try:
+        assert oven.state == "RUNNING"
+        response = post(controller, {"cmd": "autotune", "temperature": 400})
+        assert response["success"] is False
+        assert "RUNNING" in response["error"]
+        # the firing goes on
+        assert oven.state == "RUNNING" and oven.profile.name == "test-fast"
+    finally:
+        oven.abort_run()
+
+
+def test_autotune_temperature_is_checked(controller):
+    for temperature in (None, "hot", "nan", 0, config.emergency_shutoff_temp + 1):
+        body = {"cmd": "autotune"}
+        if temperature is not None:
+            body["temperature"] = temperature
+        response = post(controller, body)
+        assert response["success"] is False and response["error"]
+    assert controller.oven.state == "IDLE"
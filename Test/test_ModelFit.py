@@ -0,0 +1,53 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
+
+
+def test_fit_model_to_recorded_firing(tmp_path):
+    numpy = pytest.importorskip("numpy")
+    import modelFit
+
+    # a firing recorded the way kiln-tuner.py does it, full power up to
+    # the target then off
+    times = numpy.arange(0, 4000, 2.0)
+    duty = numpy.where(times <= 2000, 1.0, 0.0)
+    temps = modelFit.predict(modelFit.as_params(numpy.log([[400.0, 6000.0, 0.4, 0.12]])),
+        times, numpy.full(len(times), 65.0), duty, 65.0, 5450.0)[:, 0]
+    filename = tmp_path / "tuning.csv"
+    with open(filename, 'w') as f:
+        f.write("time,temperature\n")
+        for (t, temp) in zip(times, temps):
+            f.write("%s,%s\n" % (t + 1e9, temp))
+
+    (t, recorded, on) = modelFit.read_log(str(filename), target=temps[1000])
+    assert t[0] == 0
+    assert on[1000] == 1.0 and on[1002] == 0.0
+
+    (fitted, rms) = modelFit.fit(t, recorded, on, t_env=65.0, p_heat=5450.0,
+        population=32, rounds=4, seed=1)
+    assert rms < 0.5
+    assert fitted['sim_p_heat'] == 5450.0
+    assert fitted['sim_R_o_nocool'] == pytest.approx(0.4, rel=0.1)
+
+
+def test_logger_csv_needs_pid_out(tmp_path):
+    pytest.importorskip("numpy")
+    import modelFit
+
+    filename = str(tmp_path / "firing.csv")
+    with open(filename, 'w') as f:
+        f.write("stamp,state,temperature,heat\n")
+        f.write("1000,RUNNING,70,1.0\n")
+        f.write("1002,RUNNING,72,2.0\n")
+    with pytest.raises(ValueError, match="--pidstats"):
+        modelFit.read_log(filename)
+
+    with open(filename, 'w') as f:
+        f.write("stamp,state,temperature,heat,pid_out\n")
+        f.write("1000,RUNNING,70,1.0,0.25\n")
+        f.write("1002,RUNNING,72,2.0,\n")
+        f.write("1004,IDLE,72,0,0.5\n")
+    (times, temps, duty) = modelFit.read_log(filename)
+    assert list(times) == [0, 4] and list(duty) == [0.25, 0.0]
@@ -0,0 +1,25 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
+import config
+
+
+def test_optimize_gains(tmp_path):
+    pytest.importorskip("numpy")
+    import pidOptimizer
+
+    fragment = tmp_path / "model.txt"
+    fragment.write_text("# fitted\nsim_c_oven = 4000.0\nsim_p_heat = 6000 # watts\npid_kp = 3\n")
+    model = pidOptimizer.load_model(str(fragment))
+    assert model['sim_c_oven'] == 4000.0
+    assert model['sim_p_heat'] == 6000.0
+    assert model['sim_c_heat'] == config.sim_c_heat
+    assert 'pid_kp' not in model
+
+    profile = {"name": "short", "data": [[0, 100], [600, 200], [1200, 200]]}
+    ((kp, ki, kd), score) = pidOptimizer.optimize([profile], model,
+        population=8, rounds=2, keep=4, processes=1, seed=1)
+    assert kp > 0 and ki > 0 and kd > 0
+    assert score < float("inf")
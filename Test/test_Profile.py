@@ -1,7 +1,11 @@
-from lib.oven import Profile
 import os
+import sys
 import json
 
+# lib/oven.py imports its neighbours without the lib. prefix
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
+from lib.oven import Profile
+
 def get_profile(file = "test-fast.json"):
     profile_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Test', file))
     print(profile_path)
@@ -42,8 +46,15 @@ def test_find_time_odd_profile():
     time = profile.find_next_time_from_temperature(500)
     assert time == 4200
 
+    # the schedule crosses 2023 twice, seek uses the first crossing
     time = profile.find_next_time_from_temperature(2023)
-    assert time == 16676.0
+    assert time == 13933.028571428571
+
+    time = profile.find_next_time_from_temperature(200)
+    assert time == 0
+
+    time = profile.find_next_time_from_temperature(2251)
+    assert time == 0
 
 
 def test_find_x_given_y_on_line_from_two_points():
@@ -78,3 +89,79 @@ def test_find_x_given_y_on_line_from_two_points():
     assert time == 0
 
 
+
+
+def test_get_target_temperature_end_of_schedule():
+    profile = get_profile()
+
+    assert profile.get_duration() == 19400
+    assert profile.get_target_temperature(19400) == 700
+    assert profile.get_target_temperature(19401) == 0
+    assert profile.get_target_temperature(0) == 200
+
+
+def test_get_target_temperature_sequential_matches_random():
+    profile = get_profile("test-cases.json")
+    times = list(range(0, 19400, 7))
+
+    sequential = [profile.get_target_temperature(t) for t in times]
+    shuffled = list(reversed(times))
+    backwards = [profile.get_target_temperature(t) for t in shuffled]
+
+    assert sequential == list(reversed(backwards))
+    assert profile.get_target_temperature(14400) == 2250
+    assert profile.get_target_temperature(15400) == 2125
+
+
+def test_vertical_step_in_the_middle():
+    profile = Profile(json.dumps({"name": "step",
+        "data": [[0, 100], [100, 200], [100, 500], [200, 600]]}))
+
+    assert profile.get_target_temperature(50) == 150
+    # at the step the target is already the top of it
+    assert profile.get_target_temperature(100) == 500
+    assert profile.get_target_temperature(150) == 550
+    assert profile.get_surrounding_points(100) == ([100, 500], [200, 600])
+
+
+def test_cursor_is_per_thread():
+    import threading
+    profile = get_profile("test-cases.json")
+    profile.get_target_temperature(15400)
+    mine = profile.cursors.i
+
+    seen = []
+    other = threading.Thread(target=lambda: seen.append(profile.get_target_temperature(14400)))
+    other.start()
+    other.join()
+    assert seen == [2250]
+    # the other thread moved its own cursor, not this one
+    assert profile.cursors.i == mine
+
+
+def test_get_surrounding_points():
+    profile = get_profile()
+
+    assert profile.get_surrounding_points(3600) == ([3600, 200], [10800, 2000])
+    assert profile.get_surrounding_points(3599) == ([0, 200], [3600, 200])
+    assert profile.get_surrounding_points(20000) == (None, None)
+
+
+def test_sample_matches_get_target_temperature():
+    profile = get_profile("test-cases.json")
+    times = [-10, 0, 1800, 3600, 3900, 10800, 15400, 19399.5, 19400, 19401]
+
+    expected = [profile.get_target_temperature(t) for t in times]
+    sampled = [float(t) for t in profile.sample(times)]
+
+    assert sampled == expected
+
+
+def test_sample_units():
+    profile = get_profile()
+    profile.temp_units = "c"
+
+    (start, hold, after) = profile.sample([0, 3000, 20000], units="f")
+    assert start == 392
+    assert hold == 392
+    assert after == 0
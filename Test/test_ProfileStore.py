@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
+from profileStore import ProfileStore
+
+
+def write_profile(path, name, data, mtime=None):
+    filepath = os.path.join(path, name + ".json")
+    with open(filepath, 'w') as f:
+        json.dump({"name": name, "data": data, "type": "profile"}, f)
+    if mtime:
+        os.utime(filepath, ns=(mtime, mtime))
+
+
+def test_scan_reports_changes(tmp_path):
+    store = ProfileStore(str(tmp_path))
+    write_profile(str(tmp_path), "a", [[0, 100], [60, 200]])
+    write_profile(str(tmp_path), "b", [[0, 100], [60, 300]])
+
+    assert store.scan() == (["a.json", "b.json"], [], [])
+    assert store.scan() == ([], [], [])
+
+    write_profile(str(tmp_path), "a", [[0, 100], [120, 200]], mtime=1)
+    os.remove(os.path.join(str(tmp_path), "b.json"))
+    assert store.scan() == ([], ["a.json"], ["b.json"])
+
+
+def test_cached_until_file_changes(tmp_path):
+    store = ProfileStore(str(tmp_path))
+    write_profile(str(tmp_path), "a", [[0, 100], [60, 200]])
+
+    first = store.get_profiles_json()
+    assert store.get_profiles_json() is first
+    compiled = store.get_compiled("a")
+    assert store.get_compiled("a") is compiled
+    assert compiled.get_duration() == 60
+
+    write_profile(str(tmp_path), "a", [[0, 100], [90, 200]], mtime=1)
+    assert store.get_profiles_json() != first
+    assert store.get_compiled("a").get_duration() == 90
+    assert store.get_compiled("missing") is None
+
+
+def test_callers_get_copies(tmp_path):
+    store = ProfileStore(str(tmp_path))
+    write_profile(str(tmp_path), "a", [[0, 100], [60, 200]])
+    first = store.get_profiles_json()
+
+    store.get_profile("a")["data"].append([120, 300])
+    store.get_profiles()[0]["name"] = "b"
+    store.get_by_filename("a.json")["data"] = []
+    assert store.get_profile("a")["data"] == [[0, 100], [60, 200]]
+    assert store.get_profiles_json() is first
+    assert json.loads(first)[0]["data"] == [[0, 100], [60, 200]]
+
+
+class FakeSocket(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+def test_watcher_pushes_only_changes(tmp_path):
+    from profileWatcher import ProfileWatcher
+
+    store = ProfileStore(str(tmp_path))
+    write_profile(str(tmp_path), "a", [[0, 100], [60, 200]])
+    write_profile(str(tmp_path), "b", [[0, 100], [60, 300]])
+    store.scan()
+
+    watcher = ProfileWatcher(store)
+    wsock = FakeSocket()
+    watcher.add_observer(wsock)
+
+    store.save({"name": "a", "data": [[0, 100], [90, 200]], "temp_units": "f"}, force=True)
+    store.delete({"name": "b"})
+    # sent from the watcher's own thread
+    deadline = time.time() + 5
+    while len(sum([m["changed"] + m["deleted"] for m in wsock.sent], [])) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+
+    # the watcher thread may have picked up part of it first
+    assert all(m["type"] == "profiles" for m in wsock.sent)
+    assert sum([m["added"] for m in wsock.sent], []) == []
+    assert [p["name"] for m in wsock.sent for p in m["changed"]] == ["a"]
+    assert sum([m["deleted"] for m in wsock.sent], []) == ["b"]
+
+
+def test_watched_store_reads_from_cache(tmp_path):
+    store = ProfileStore(str(tmp_path))
+    write_profile(str(tmp_path), "a", [[0, 100], [60, 200]])
+    store.scan()
+    # what a ProfileWatcher does
+    store.watched = True
+
+    # reads do not look at the directory, the watcher's scans do
+    os.remove(os.path.join(str(tmp_path), "a.json"))
+    assert [p["name"] for p in store.get_profiles()] == ["a"]
+    store.scan()
+    assert store.get_profiles() == []
+
+
+def test_watcher_deletes_by_profile_name(tmp_path):
+    from profileWatcher import ProfileWatcher
+
+    store = ProfileStore(str(tmp_path))
+    # the file name does not have to be the profile name
+    with open(os.path.join(str(tmp_path), "cone6.json"), 'w') as f:
+        json.dump({"name": "Cone 6 glaze", "data": [[0, 100], [60, 200]], "type": "profile"}, f)
+    watcher = ProfileWatcher(store)
+    wsock = FakeSocket()
+    watcher.add_observer(wsock)
+    assert store.watched
+
+    os.remove(os.path.join(str(tmp_path), "cone6.json"))
+    store.scan()
+    deadline = time.time() + 5
+    while not wsock.sent and time.time() < deadline:
+        time.sleep(0.01)
+    assert wsock.sent[0]["deleted"] == ["Cone 6 glaze"]
@@ -0,0 +1,23 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
+import config
+from oven import SimulatedOven, VirtualClock
+
+
+def test_relay_autotune():
+    oven = SimulatedOven(clock=VirtualClock(), headless=True)
+    oven.run_autotune(200)
+    steps = 0
+    while oven.state == "AUTOTUNE" and steps < 100000:
+        oven.autotune_step()
+        steps += 1
+
+    assert oven.state == "IDLE"
+    result = oven.get_state()['autotune']
+    assert result == oven.autotune_result
+    assert result['pu'] > 0
+    assert result['kp'] > 0 and result['ki'] > 0 and result['kd'] > 0
+    # the oscillation is at least as wide as the relay hysteresis
+    assert result['amplitude'] >= config.autotune_hysteresis
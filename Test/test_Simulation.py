@@ -0,0 +1,97 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
+import config
+from oven import SimulatedOven, VirtualClock
+from test_Profile import get_profile
+
+
+def test_virtual_clock():
+    clock = VirtualClock()
+    start = clock.now()
+    clock.sleep(2.5)
+    assert (clock.now() - start).total_seconds() == 2.5
+
+
+def test_headless_run_is_deterministic():
+    profile = get_profile()
+
+    oven = SimulatedOven(clock=VirtualClock(), headless=True)
+    trace = oven.run_headless(profile)
+    again = SimulatedOven(clock=VirtualClock(), headless=True).run_headless(profile)
+
+    assert trace == again
+    assert oven.state == "IDLE"
+    assert trace[-1]['runtime'] >= profile.get_duration() - oven.time_step
+    assert all(s['state'] == "RUNNING" for s in trace)
+
+
+def test_batch_combinations_and_summary():
+    from batchSimulator import combinations, simulate
+
+    runs = combinations({"pid_kp": [10, 20], "pid_ki": [80]})
+    assert runs == [{"pid_ki": 80, "pid_kp": 10}, {"pid_ki": 80, "pid_kp": 20}]
+
+    profile = {"name": "short", "data": [[0, 100], [600, 200], [1200, 200]]}
+    (summary, trace) = simulate((profile, {}))
+    assert summary['runtime'] == len(trace) * 2
+    assert summary['max_overshoot'] >= 0
+    assert summary['cost'] > 0
+
+    # overrides only last for their own run
+    kp = config.pid_kp
+    (overridden, trace) = simulate((profile, {"pid_kp": kp * 4}))
+    assert config.pid_kp == kp
+    assert simulate((profile, {}))[0] == summary
+    assert overridden != summary
+
+
+def test_vectorized_model_matches_simulated_oven():
+    numpy = pytest.importorskip("numpy")
+    from thermalModel import simulate_many, PIDArray
+
+    profile = get_profile()
+    trace = SimulatedOven(clock=VirtualClock(), headless=True).run_headless(profile)
+    scalar = numpy.array([s['temperature'] for s in trace[1:]])
+
+    result = simulate_many(profile, 3, pid=PIDArray(3, kp=[config.pid_kp, 5, 40]), record=True)
+    vector = result['temperature'][:, 0]
+    vector = vector[~numpy.isnan(vector)]
+
+    assert len(vector) == len(scalar)
+    assert numpy.allclose(vector, scalar)
+    assert result['max_overshoot'][1] != result['max_overshoot'][2]
+
+
+def run_integrator(method, time_step, seconds=3600, power=2000.0):
+    from oven import Integrator
+    integrator = Integrator(method, tolerance=0.001)
+    (t_h, t) = (65.0, 65.0)
+    for i in range(int(seconds / time_step)):
+        (t_h, t) = integrator.step(t_h, t, power, time_step,
+            500.0, 5000.0, 0.1, 0.5, 65.0)
+    return t
+
+
+def test_integrators_do_not_depend_on_step_size():
+    exact = run_integrator("exact", 2)
+    assert abs(run_integrator("exact", 0.5) - exact) < 1e-6
+    assert abs(run_integrator("exact", 10) - exact) < 1e-6
+    assert abs(run_integrator("rk4", 2) - exact) < 0.01
+    assert abs(run_integrator("rk4", 30) - exact) < 0.01
+    assert abs(run_integrator("substep", 30) - exact) < 0.1
+    # the original single step drifts with the step size
+    assert abs(run_integrator("euler", 30) - exact) > 1
+
+
+def test_integrator_handles_arrays():
+    numpy = pytest.importorskip("numpy")
+    from oven import Integrator
+
+    integrator = Integrator("exact")
+    (t_h, t) = integrator.step(numpy.array([65.0, 65.0]), numpy.array([65.0, 65.0]),
+        numpy.array([0.0, 2000.0]), 2, 500.0, 5000.0, 0.1, 0.5, 65.0)
+    assert t[0] == pytest.approx(65.0)
+    assert t[1] == pytest.approx(run_integrator("exact", 2, seconds=2))
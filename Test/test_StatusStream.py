@@ -0,0 +1,292 @@
+import os
+import sys
+import json
+import time
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
+from statusStream import Frame, Encoder, diff
+
+
+def apply(state, message):
+    '''what picoreflow.js and state.js do with a version 2 message'''
+    if message['type'] == "snapshot":
+        return message['state']
+    state = dict(state)
+    for key in message['removed']:
+        del state[key]
+    for (key, value) in message['changed'].items():
+        if isinstance(value, dict) and isinstance(state.get(key), dict):
+            state[key] = dict(state[key], **value)
+        else:
+            state[key] = value
+    return state
+
+
+def states(n):
+    for i in range(n):
+        yield {
+            'runtime': i * 2.0,
+            'temperature': 100 + i * 0.123456,
+            'target': 100 + i * 0.1,
+            'state': "RUNNING",
+            'totaltime': 36000,
+            'kwh_rate': 0.1319,
+            'currency_type': "$",
+            'profile': "cone-05-long-bisque",
+            'pidstats': {'time': 1000 + i * 2, 'err': 0.5, 'kp': 25, 'ki': 10,
+                'kd': 200, 'out': 0.25} if i != 3 else {},
+        }
+
+
+def frames(n):
+    previous = None
+    for (seq, state) in enumerate(states(n)):
+        previous = Frame(seq, state, previous)
+        yield previous
+
+
+def test_diff_nested_and_removed():
+    (changed, removed) = diff({'a': 1, 'b': {'x': 1, 'y': 2}, 'c': 3},
+        {'a': 1, 'b': {'x': 1, 'y': 5}, 'd': 4})
+    assert changed == {'b': {'y': 5}, 'd': 4}
+    assert removed == ['c']
+
+
+def test_version_1_is_unchanged():
+    encoder = Encoder()
+    for frame in frames(3):
+        assert json.loads(encoder(frame)) == frame.state
+
+
+def test_deltas_rebuild_every_state():
+    encoder = Encoder(version=2)
+    client = {}
+    kinds = []
+    for frame in frames(10):
+        message = json.loads(encoder(frame))
+        kinds.append(message['type'])
+        client = apply(client, message)
+        assert client == frame.state
+    assert kinds == ["snapshot"] + ["delta"] * 9
+
+
+def test_missed_frame_gets_snapshot():
+    encoder = Encoder(version=2)
+    sent = [json.loads(encoder(frame))['type'] for (i, frame) in
+        enumerate(frames(6)) if i != 2]
+    assert sent == ["snapshot", "delta", "snapshot", "delta", "delta"]
+
+
+def test_compact_is_much_smaller():
+    from oven import SimulatedOven, VirtualClock
+    from test_Profile import get_profile
+    trace = SimulatedOven(clock=VirtualClock(), headless=True).run_headless(get_profile())
+
+    full = 0
+    compact = 0
+    encoders = (Encoder(version=1), Encoder(version=2, compact=True))
+    client = {}
+    previous = None
+    for (seq, state) in enumerate(trace[:300]):
+        previous = Frame(seq, state, previous)
+        full += len(encoders[0](previous))
+        message = encoders[1](previous)
+        compact += len(message)
+        client = apply(client, json.loads(message))
+    assert compact * 3 < full
+    assert client['temperature'] == round(trace[299]['temperature'], 2)
+
+
+def test_encoding_is_shared():
+    frame = list(frames(2))[1]
+    assert Encoder(version=2)(frame) is Encoder(version=2)(frame)
+    a = Encoder(version=2)
+    b = Encoder(version=2)
+    first = list(frames(2))
+    a(first[0])
+    b(first[0])
+    assert a(first[1]) is b(first[1])
+
+
+def test_encoding_is_shared_between_threads():
+    frame = list(frames(2))[1]
+    builds = []
+    build = frame.build
+    def slow_build(*args):
+        builds.append(args)
+        time.sleep(0.01)
+        return build(*args)
+    frame.build = slow_build
+
+    sent = []
+    senders = [threading.Thread(target=lambda: sent.append(Encoder(version=2)(frame)))
+        for n in range(8)]
+    for sender in senders:
+        sender.start()
+    for sender in senders:
+        sender.join()
+    assert len(builds) == 1
+    assert all(message is sent[0] for message in sent)
+
+
+def test_negotiation():
+    assert Encoder.from_query({}).version == 1
+    assert Encoder.from_query({'v': '2', 'compact': '1'}).compact
+    assert Encoder.from_query({'v': '99'}).version == 1
+
+
+def test_topics():
+    state = next(states(1))
+    frame = Frame(1, state)
+    core = json.loads(Encoder(topics="core")(frame))
+    assert set(core) == set(['runtime', 'temperature', 'target', 'state',
+        'totaltime', 'profile'])
+    both = json.loads(Encoder(topics=["cost", "output", "nonsense"])(frame))
+    assert both == {'kwh_rate': 0.1319, 'currency_type': "$",
+        'pidstats': {'out': 0.25}}
+    # pid has all of pidstats, output adds nothing to it
+    assert json.loads(Encoder(topics="pid,output")(frame)) == {'pidstats': state['pidstats']}
+
+
+def test_one_encoding_per_subscription():
+    frame = Frame(1, next(states(1)))
+    calls = []
+    build = frame.build
+    frame.build = lambda *args: calls.append(args) or build(*args)
+    for n in range(10):
+        Encoder(topics="core")(frame)
+        Encoder(version=2, topics="pid")(frame)
+        Encoder(version=2, topics="core")(frame)
+    assert len(calls) == 3
+
+
+class FakeSocket(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+
+class FakeOven(object):
+    '''the test sends the states, keep the watcher thread out of it'''
+    time_step = 2
+
+    def get_state(self):
+        threading.Event().wait()
+
+
+def test_slower_rate_gets_deltas_between_its_own_messages():
+    from ovenWatcher import OvenWatcher
+    from broadcaster import Broadcaster
+    watcher = OvenWatcher(FakeOven())
+    watcher.broadcaster = Broadcaster(size=100)
+    fast = FakeSocket()
+    slow = FakeSocket()
+    watcher.add_observer(fast, encoder=Encoder(version=2))
+    watcher.add_observer(slow, encoder=Encoder(version=2, topics="core", interval=10))
+
+    for state in states(20):
+        watcher.notify_all(state)
+    deadline = time.time() + 5
+    while (len(fast.sent) < 21 or len(slow.sent) < 5) and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert len(fast.sent) == 21
+    messages = [json.loads(m) for m in slow.sent[1:]]
+    assert len(messages) == 4
+    assert [m['type'] for m in messages] == ["snapshot", "delta", "delta", "delta"]
+    client = {}
+    for m in messages:
+        client = apply(client, m)
+    assert client['runtime'] == 19 * 2.0
+    assert 'pidstats' not in client
+
+
+def test_every_state_is_numbered_and_resume_replays_the_gap():
+    from ovenWatcher import OvenWatcher
+    from broadcaster import Broadcaster
+    watcher = OvenWatcher(FakeOven())
+    watcher.broadcaster = Broadcaster(size=100)
+    logger = FakeSocket()
+    watcher.add_observer(logger, encoder=Encoder(topics="pid"))
+
+    def tick(state):
+        # what OvenWatcher.run does with each state
+        with watcher.lock:
+            watcher.notify_all(state)
+            watcher.history.append(state)
+
+    all_states = list(states(30))
+    for state in all_states[:10]:
+        tick(state)
+    deadline = time.time() + 5
+    while len(logger.sent) < 11 and time.time() < deadline:
+        time.sleep(0.01)
+    received = [json.loads(m) for m in logger.sent[1:]]
+    assert [m['seq'] for m in received] == list(range(1, 11))
+    assert all(m['server_time'] > 0 for m in received)
+
+    # the logger drops off, misses ten states and comes back
+    watcher.remove_observer(logger)
+    for state in all_states[10:20]:
+        tick(state)
+    again = FakeSocket()
+    watcher.add_observer(again, resume=received[-1]['seq'])
+    for state in all_states[20:]:
+        tick(state)
+    while len(again.sent) < 11 and time.time() < deadline:
+        time.sleep(0.01)
+
+    replay = json.loads(again.sent[0])
+    assert replay['type'] == "replay"
+    assert [s['seq'] for s in replay['log']] == list(range(11, 21))
+    assert [s['runtime'] for s in replay['log']] == [s['runtime'] for s in all_states[10:20]]
+    assert [json.loads(m)['seq'] for m in again.sent[1:]] == list(range(21, 31))
+
+
+def test_resume_from_archived_states_gets_a_backlog():
+    from ovenWatcher import OvenWatcher
+    from broadcaster import Broadcaster
+    from firingHistory import FiringHistory
+    watcher = OvenWatcher(FakeOven())
+    watcher.broadcaster = Broadcaster(size=100)
+    watcher.history = FiringHistory(samples=10, archive=[(2, 10)])
+    for state in states(30):
+        with watcher.lock:
+            watcher.notify_all(state)
+            watcher.history.append(state)
+
+    recent = FakeSocket()
+    watcher.add_observer(recent, resume=25)
+    old = FakeSocket()
+    watcher.add_observer(old, resume=5)
+    deadline = time.time() + 5
+    while (not recent.sent or not old.sent) and time.time() < deadline:
+        time.sleep(0.01)
+    replay = json.loads(recent.sent[0])
+    assert [s['seq'] for s in replay['log']] == list(range(26, 31))
+    # states 6 to 20 are only left as archive averages
+    assert json.loads(old.sent[0])['type'] == "backlog"
+
+
+def test_backlog_is_serialized_once_per_state():
+    from ovenWatcher import OvenWatcher
+    watcher = OvenWatcher(FakeOven())
+    for state in states(50):
+        with watcher.lock:
+            watcher.notify_all(state)
+            watcher.history.append(state)
+
+    first = watcher.backlog_json(20)
+    assert watcher.backlog_json(20) is first
+    backlog = json.loads(first)
+    assert backlog['type'] == "backlog" and backlog['profile'] is None
+    assert backlog['log'] == json.loads(json.dumps(watcher.lastlog_subset(20)))
+
+    state = next(states(1))
+    with watcher.lock:
+        watcher.notify_all(state)
+        watcher.history.append(state)
+    assert watcher.backlog_json(20) is not first
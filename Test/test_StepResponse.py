@@ -0,0 +1,62 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib')))
+
+
+def test_fopdt_fit_of_tuning_log(tmp_path):
+    numpy = pytest.importorskip("numpy")
+    import stepResponse
+
+    true = [70, 0.5, 120, 3000]
+    times = numpy.arange(0, 3600, 1.0)
+    temps = stepResponse.fopdt(true, times)
+    temps = temps + numpy.random.default_rng(1).normal(0, 0.5, len(times))
+    filename = str(tmp_path / "tuning.csv")
+    with open(filename, 'w') as f:
+        f.write("time,temperature\n")
+        f.write("bad,row\n")
+        for (t, temp) in zip(times + 1700000000, temps):
+            f.write("%s,%s\n" % (t, temp))
+
+    (read_times, read_temps) = stepResponse.read_tuning_log(filename)
+    assert len(read_times) == len(times) and read_times[0] == 0
+
+    fit = stepResponse.fit_fopdt(read_times, read_temps)
+    errors = numpy.sqrt(numpy.diag(fit['covariance']))
+    for (name, value, error) in zip(stepResponse.FOPDT, true, errors):
+        assert abs(fit[name] - value) < 5 * error + 1e-6 * abs(value)
+    assert fit['rms'] == pytest.approx(0.5, rel=0.1)
+
+    gains = stepResponse.ziegler_nichols(fit, stepResponse.rise(fit, read_times[-1]))
+    assert gains['pid_kp'] > 0 and gains['kp_error'] < 0.05
+    # pid_kd = 0.6 span / R only depends on the slope
+    assert gains['kd_error'] == pytest.approx(errors[1] / fit['R'])
+
+
+def test_spike_in_tuning_log_does_not_move_the_gains(tmp_path):
+    numpy = pytest.importorskip("numpy")
+    import stepResponse
+
+    times = numpy.arange(0, 3600, 1.0)
+    temps = stepResponse.fopdt([70, 0.5, 120, 3000], times)
+    temps = temps + numpy.random.default_rng(1).normal(0, 0.5, len(times))
+
+    def gains(temps):
+        filename = str(tmp_path / "tuning.csv")
+        with open(filename, 'w') as f:
+            f.write("time,temperature\n")
+            for (t, temp) in zip(times + 1700000000, temps):
+                f.write("%s,%s\n" % (t, temp))
+        (heat_times, heat_temps) = stepResponse.heating_part(*stepResponse.read_tuning_log(filename))
+        fit = stepResponse.fit_fopdt(heat_times, heat_temps)
+        return (len(heat_times), stepResponse.ziegler_nichols(fit, stepResponse.rise(fit, heat_times[-1])))
+
+    (samples, clean) = gains(temps)
+    # one bad reading, far hotter than anything else in the log
+    temps[1500] += 1000
+    (spiked_samples, spiked) = gains(temps)
+    assert spiked_samples == samples
+    for gain in ('pid_kp', 'pid_ki', 'pid_kd'):
+        assert spiked[gain] == pytest.approx(clean[gain], rel=0.02)
@@ -144,6 +144,17 @@ pid_kp = 10   # Proportional 25,200,200
 pid_ki = 80   # Integral
 pid_kd = 220.83497910261562 # Derivative
 
+########################################################################
+#
+#   Relay autotune
+#
+# The autotune (see docs/ziegler_tuning.md) holds the kiln at a set
+# temperature by switching the elements fully on below it and fully off
+# above it, and works out PID parameters from the swings.
+autotune_hysteresis = 2  # degrees either side of the set temperature
+autotune_cycles = 3      # swings to measure after the first heat up
+autotune_timeout = 120   # minutes before giving up
+
 ########################################################################
 #
 # Initial heating and Integral Windup
@@ -165,6 +176,15 @@ sim_R_o_cool   = 0.05   # K/W  " with cooling
 sim_R_ho_noair = 0.1    # K/W  thermal resistance heat element -> oven
 sim_R_ho_air   = 0.05   # K/W  " with internal air circulation
 
+# how the simulated kiln temperatures are advanced each time step
+#   exact   - closed form solution, the same no matter the time step (default)
+#   rk4     - Runge-Kutta, sub-steps until within sim_integrator_tolerance
+#   substep - simple steps, sub-steps until within sim_integrator_tolerance
+#   euler   - one simple step per time step, how older versions simulated.
+#             results change with sensor_time_wait.
+sim_integrator = "exact"
+sim_integrator_tolerance = 0.01 # deg
+
 # if you want simulations to happen faster than real time, this can be
 # set as high as 1000 to speed simulations up by 1000 times.
 sim_speedup_factor = 1
@@ -253,11 +273,75 @@ ignore_tc_too_many_errors = False
 # automatically on boot-up for this to work.
 # DO NOT put automatic_restart_state_file anywhere in /tmp. It could be
 # cleaned up (deleted) by the OS on boot.
-# The state file is written to disk every sensor_time_wait seconds (2s by default)
-# and is written in the same directory as config.py.
+# The state file holds the running profile and the pid state too, so a
+# restarted firing carries on with the same element power even if the
+# profile file was edited or deleted in the meantime.
+# The state file is written in the same directory as config.py. It is
+# replaced atomically (written to a temporary file, then renamed), so a
+# power cut never leaves a broken one behind. While firing it is written
+# at most every automatic_restart_interval seconds, which must be well
+# below automatic_restart_window, and not at all if nothing changed. The
+# start and end of a firing are written right away.
+# automatic_restart_fsync flushes the file to the SD card before it
+# replaces the old one: "always", only for the start and end of a firing
+# ("changes"), or "never" (least wear, the last few writes may be lost).
 automatic_restarts = True
 automatic_restart_window = 15 # max minutes since power outage
 automatic_restart_state_file = os.path.abspath(os.path.join(os.path.dirname( __file__ ),'state.json'))
+automatic_restart_interval = 30 # seconds between writes while firing
+automatic_restart_fsync = "always"
+
+########################################################################
+# firing history kept in memory for the graph of new browsers. The last
+# history_samples states (one every sensor_time_wait seconds) are kept
+# as they are. Older ones are averaged into archives, each a list of
+# (states of the previous level per entry, entries). The defaults keep
+# an hour of full detail, 8 hours of 30 second averages and 40 hours of
+# 4 minute averages in about 600KB, however long the firing is.
+history_samples = 1800
+history_archive = [(15, 960), (8, 600)]
+
+# every firing is also stored in an sqlite database, so it survives a
+# restart and old firings can be looked at. states are written in one
+# transaction every history_commit_interval seconds, a power cut loses
+# at most that much. set history_db = None to not store firings.
+history_db = os.path.abspath(os.path.join(os.path.dirname( __file__ ),'storage','history.sqlite3'))
+history_commit_interval = 30
+
+# every history_compact_interval seconds the stored firings are rolled up
+# into 1 minute and 10 minute rows (lowest, highest and mean values), and
+# the history api reads those for long spans. the states themselves are
+# deleted history_raw_days after a firing, the 1 minute rows after
+# history_minute_days. the 10 minute rows (about 100 per firing) are kept
+# forever. None keeps a tier forever.
+history_compact_interval = 600
+history_raw_days = 30
+history_minute_days = 365
+
+# /api/history sends about history_points rows of a firing unless the
+# client asks for up to history_max_points with points=N
+history_points = 1000
+history_max_points = 10000
+
+# points of history sent to a browser when it connects. the hottest and
+# coolest states of each stretch of the firing are picked, so spikes
+# stay on the graph. clients can ask for up to backlog_max_points with
+# /status?points=N
+backlog_points = 200
+backlog_max_points = 2000
+
+# every status client has its own queue of at most status_queue_size
+# messages, so a browser on a slow network can not hold up the others.
+# when a queue is full, status_slow_policy decides what happens:
+#   "drop"        the newest state is not sent to that client
+#   "coalesce"    the client skips the queued states and gets the newest
+#   "disconnect"  the client is dropped, browsers reconnect on reload
+status_queue_size = 10
+status_slow_policy = "coalesce"
+
+# status clients that ask for compact messages (/status?v=2&compact=1)
+# get temperatures, costs and pid values rounded to this many decimals
+status_compact_digits = 2
 
 ########################################################################
 # load kiln profiles from this directory
@@ -267,6 +351,12 @@ automatic_restart_state_file = os.path.abspath(os.path.join(os.path.dirname( __f
 kiln_profiles_directory = os.path.abspath(os.path.join(os.path.dirname( __file__ ),"storage", "profiles")) 
 #kiln_profiles_directory = os.path.abspath(os.path.join(os.path.dirname( __file__ ),'..','kiln-profiles','pottery')) 
 
+# profiles added, changed or deleted in kiln_profiles_directory (for
+# instance by rsync) are pushed to every open browser. If inotify_simple
+# is installed changes show up immediately, otherwise the directory is
+# checked every profile_poll_interval seconds.
+profile_poll_interval = 5
+
 
 ########################################################################
 # low temperature throttling of elements
@@ -27,6 +27,11 @@ profile_path = config.kiln_profiles_directory
 
 from oven import SimulatedOven, RealOven, Profile
 from ovenWatcher import OvenWatcher
+from statusStream import Encoder
+from profileStore import ProfileStore
+from profileWatcher import ProfileWatcher
+from firingStore import Compactor
+from historyExport import HistoryExport
 
 app = bottle.Bottle()
 
@@ -39,6 +44,10 @@ else:
 ovenWatcher = OvenWatcher(oven)
 # this ovenwatcher is used in the oven class for restarts
 oven.set_ovenwatcher(ovenWatcher)
+# rolls up and prunes the stored firings in the background
+compactor = Compactor(ovenWatcher.store) if ovenWatcher.store else None
+profiles = ProfileStore(profile_path)
+profileWatcher = ProfileWatcher(profiles)
 
 @app.route('/')
 def index():
@@ -56,6 +65,59 @@ def handle_api():
             return json.dumps(oven.pid.pidstats)
 
 
+@app.get('/api/runs')
+def handle_runs():
+    '''the stored firings, newest first'''
+    if not ovenWatcher.store:
+        return json.dumps([])
+    limit = bottle.request.query.get('limit')
+    return json.dumps(ovenWatcher.store.runs(int(limit) if limit and limit.isdigit() else None))
+
+
+@app.get('/api/history')
+def handle_history():
+    '''a stored firing, downsampled on the server and streamed as ndjson
+    or csv. /api/history?run=3&from=21600&to=28800&points=500 is hours 6
+    to 8 of firing 3 in about 500 rows, see historyExport.py'''
+    if not ovenWatcher.store:
+        bottle.response.status = 404
+        return json.dumps({"success": False, "error": "firings are not stored, see history_db"})
+    try:
+        export = HistoryExport.from_query(ovenWatcher.store, bottle.request.query)
+    except ValueError as e:
+        bottle.response.status = 400
+        return json.dumps({"success": False, "error": str(e)})
+    except LookupError as e:
+        bottle.response.status = 404
+        return json.dumps({"success": False, "error": str(e)})
+
+    gzip = 'gzip' in bottle.request.headers.get('Accept-Encoding', '')
+    etag = export.etag(gzip)
+    headers = {'ETag': etag, 'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache',
+        'X-History-Tier': str(export.tier)}
+    if bottle.request.headers.get('If-None-Match') == etag:
+        return bottle.HTTPResponse(status=304, headers=headers)
+    for (name, value) in headers.items():
+        bottle.response.set_header(name, value)
+    bottle.response.content_type = export.content_type
+    if gzip:
+        bottle.response.set_header('Content-Encoding', 'gzip')
+    # no content length, so the server sends it chunked as it is read
+    return export.chunks(gzip)
+
+
+@app.get('/api/clients')
+def handle_clients():
+    '''queue, latency and drop counts of every status client'''
+    return json.dumps(ovenWatcher.client_stats())
+
+
+@app.get('/api/checkpoint')
+def handle_checkpoint():
+    '''writes, bytes and write latency of the automatic restart file'''
+    return json.dumps(oven.checkpoint.stats())
+
+
 @app.post('/api')
 def handle_api():
     log.info("/api is alive")
@@ -78,13 +140,12 @@ def handle_api():
             allow_seek = False
 
         # get the wanted profile/kiln schedule
-        profile = find_profile(wanted)
+        profile = profiles.get_compiled(wanted)
         if profile is None:
             return { "success" : False, "error" : "profile %s not found" % wanted }
 
-        # FIXME juggling of json should happen in the Profile class
-        profile_json = json.dumps(profile)
-        profile = Profile(profile_json)
+        # states of the new firing are only stored once record opened its run
+        ovenWatcher.stop_recording()
         oven.run_profile(profile, startat=startat, allow_seek=allow_seek)
         ovenWatcher.record(profile)
 
@@ -105,6 +166,27 @@ def handle_api():
         memo = bottle.request.json['memo']
         log.info("memo=%s" % (memo))
 
+    # when will a schedule reach a given temperature
+    if bottle.request.json['cmd'] == 'time_at_temperature':
+        wanted = bottle.request.json['profile']
+        temperature = float(bottle.request.json['temperature'])
+        log.info("api time_at_temperature command received")
+        profile = profiles.get_compiled(wanted)
+        if profile is None:
+            return { "success" : False, "error" : "profile %s not found" % wanted }
+        seconds = profile.find_next_time_from_temperature(temperature)
+        return { "success" : True, "seconds" : seconds }
+
+    # tune the pid by oscillating around a temperature
+    if bottle.request.json['cmd'] == 'autotune':
+        log.info("api autotune command received")
+        try:
+            # refused unless the kiln is idle, a firing is never cut short
+            oven.run_autotune(bottle.request.json.get('temperature'))
+        except ValueError as e:
+            log.error("autotune refused: %s" % e)
+            return { "success" : False, "error" : str(e) }
+
     # get stats during a run
     if bottle.request.json['cmd'] == 'stats':
         log.info("api stats command received")
@@ -114,21 +196,6 @@ def handle_api():
 
     return { "success" : True }
 
-def find_profile(wanted):
-    '''
-    given a wanted profile name, find it and return the parsed
-    json profile object or None.
-    '''
-    #load all profiles from disk
-    profiles = get_profiles()
-    json_profiles = json.loads(profiles)
-
-    # find the wanted profile
-    for profile in json_profiles:
-        if profile['name'] == wanted:
-            return profile
-    return None
-
 @app.route('/picoreflow/:filename#.*#')
 def send_static(filename):
     log.debug("serving %s" % filename)
@@ -186,6 +253,7 @@ def handle_control():
 def handle_storage():
     wsock = get_websocket_from_request()
     log.info("websocket (storage) opened")
+    profileWatcher.add_observer(wsock)
     while True:
         try:
             message = wsock.receive()
@@ -226,6 +294,7 @@ def handle_storage():
             time.sleep(1) 
         except WebSocketError:
             break
+    profileWatcher.remove_observer(wsock)
     log.info("websocket (storage) closed")
 
 
@@ -246,92 +315,47 @@ def handle_config():
 @app.route('/status')
 def handle_status():
     wsock = get_websocket_from_request()
-    ovenWatcher.add_observer(wsock)
+    # /status?points=N asks for about N points of backlog,
+    # /status?v=2&compact=1 for the delta protocol and
+    # /status?topics=core,cost&interval=60 for part of the state at a
+    # slower rate, see statusStream.py. /status?resume=N replays the
+    # states after seq N instead of sending a backlog
+    resume = bottle.request.query.get('resume')
+    ovenWatcher.add_observer(wsock, bottle.request.query.get('points'),
+        Encoder.from_query(bottle.request.query),
+        int(resume) if resume and resume.isdigit() else None)
     log.info("websocket (status) opened")
     while True:
         try:
             message = wsock.receive()
-            wsock.send("Your message was: %r" % message)
+            if message is None:
+                break
+            try:
+                msgdict = json.loads(message)
+            except ValueError:
+                msgdict = None
+            if isinstance(msgdict, dict) and msgdict.get("cmd") == "subscribe":
+                log.info("status subscribe: %s" % message)
+                ovenWatcher.subscribe(wsock, msgdict.get("topics"),
+                    msgdict.get("interval", 0))
+            else:
+                wsock.send("Your message was: %r" % message)
         except WebSocketError:
             break
         time.sleep(1)
+    ovenWatcher.remove_observer(wsock)
     log.info("websocket (status) closed")
 
 
 def get_profiles():
-    try:
-        profile_files = os.listdir(profile_path)
-    except:
-        profile_files = []
-    profiles = []
-    for filename in profile_files:
-        with open(os.path.join(profile_path, filename), 'r') as f:
-            profiles.append(json.load(f))
-    profiles = normalize_temp_units(profiles)
-    return json.dumps(profiles)
+    return profiles.get_profiles_json()
 
 
 def save_profile(profile, force=False):
-    profile=add_temp_units(profile)
-    profile_json = json.dumps(profile)
-    filename = profile['name']+".json"
-    filepath = os.path.join(profile_path, filename)
-    if not force and os.path.exists(filepath):
-        log.error("Could not write, %s already exists" % filepath)
-        return False
-    with open(filepath, 'w+') as f:
-        f.write(profile_json)
-        f.close()
-    log.info("Wrote %s" % filepath)
-    return True
-
-def add_temp_units(profile):
-    """
-    always store the temperature in degrees c
-    this way folks can share profiles
-    """
-    if "temp_units" in profile:
-        return profile
-    profile['temp_units']="c"
-    if config.temp_scale=="c":
-        return profile
-    if config.temp_scale=="f":
-        profile=convert_to_c(profile);
-        return profile
-
-def convert_to_c(profile):
-    newdata=[]
-    for (secs,temp) in profile["data"]:
-        temp = (5/9)*(temp-32)
-        newdata.append((secs,temp))
-    profile["data"]=newdata
-    return profile
-
-def convert_to_f(profile):
-    newdata=[]
-    for (secs,temp) in profile["data"]:
-        temp = ((9/5)*temp)+32
-        newdata.append((secs,temp))
-    profile["data"]=newdata
-    return profile
-
-def normalize_temp_units(profiles):
-    normalized = []
-    for profile in profiles:
-        if "temp_units" in profile:
-            if config.temp_scale == "f" and profile["temp_units"] == "c": 
-                profile = convert_to_f(profile)
-                profile["temp_units"] = "f"
-        normalized.append(profile)
-    return normalized
+    return profiles.save(profile, force)
 
 def delete_profile(profile):
-    profile_json = json.dumps(profile)
-    filename = profile['name']+".json"
-    filepath = os.path.join(profile_path, filename)
-    os.remove(filepath)
-    log.info("Deleted %s" % filepath)
-    return True
+    return profiles.delete(profile)
 
 def get_config():
     return json.dumps({"temp_scale": config.temp_scale,
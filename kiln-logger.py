@@ -10,6 +10,7 @@ import sys
 
 STD_HEADER = [
     'stamp',
+    'seq',
     'runtime',
     'temperature',
     'target',
@@ -57,13 +58,29 @@ def logger(hostname, csvfile, noprofilestats, pidstats, stdout):
     else:
         csv_stdout = None
 
+    # only ask for the parts of the state that get logged
+    topics = []
+    if not noprofilestats:
+        topics += ['core']
+    if pidstats:
+        topics += ['pid']
+    topics = ','.join(topics)
+
+    # seq of the last state logged. after a reconnect the server replays
+    # the states we missed while it still has each of them, otherwise it
+    # sends a backlog and the gap stays
+    last_seq = None
+
     while True:
         try:
             msg = json.loads(status_ws.recv())
 
         except websocket.WebSocketException:
+            url = f'ws://{hostname}/status?topics={topics}'
+            if last_seq is not None:
+                url += f'&resume={last_seq}'
             try:
-                status_ws.connect(f'ws://{hostname}/status')
+                status_ws.connect(url)
             except Exception:
                 time.sleep(5)
 
@@ -72,22 +89,35 @@ def logger(hostname, csvfile, noprofilestats, pidstats, stdout):
         if msg.get('type') == 'backlog':
             continue
 
-        if not noprofilestats:
-            msg['stamp'] = time.time()
-        if pidstats and 'pidstats' in msg:
-            for k, v in msg.get('pidstats', {}).items():
-                msg[f"pid_{k}"] = v
+        if msg.get('type') == 'replay':
+            states = msg['log']
+        else:
+            states = [msg]
 
-        csv_out.writerow(msg)
+        for state in states:
+            if 'seq' in state:
+                last_seq = state['seq']
+            write_row(state, csv_out, csv_stdout, noprofilestats, pidstats)
         out.flush()
 
-        if stdout:
-            for k in list(msg.keys()):
-                v = msg[k]
-                if isinstance(v, float):
-                    msg[k] = '{:5.3f}'.format(v)
-            csv_stdout.writerow(msg)
-            sys.stdout.flush()
+
+def write_row(msg, csv_out, csv_stdout, noprofilestats, pidstats):
+    if not noprofilestats:
+        # when the server sent it, so replayed states keep their time
+        msg['stamp'] = msg.get('server_time', time.time())
+    if pidstats and 'pidstats' in msg:
+        for k, v in msg.get('pidstats', {}).items():
+            msg[f"pid_{k}"] = v
+
+    csv_out.writerow(msg)
+
+    if csv_stdout:
+        for k in list(msg.keys()):
+            v = msg[k]
+            if isinstance(v, float):
+                msg[k] = '{:5.3f}'.format(v)
+        csv_stdout.writerow(msg)
+        sys.stdout.flush()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import logging
+import argparse
+
+try:
+        sys.dont_write_bytecode = True
+        import config
+        sys.dont_write_bytecode = False
+
+except ImportError:
+        print("Could not import config file.")
+        print("Copy config.py.EXAMPLE to config.py and adapt it for your setup.")
+        exit(1)
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, script_dir + '/lib/')
+
+import modelFit
+
+
+def main(csvfile, target, watts, t_env, outfile):
+    try:
+        (times, temps, duty) = modelFit.read_log(csvfile, target)
+    except ValueError as e:
+        print(e)
+        exit(1)
+    if len(times) < 10:
+        print("not enough samples in %s" % csvfile)
+        exit(1)
+    print("fitting %d samples over %.1f hours" % (len(times), times[-1] / 3600))
+
+    (fitted, rms) = modelFit.fit(times, temps, duty, t_env=t_env, p_heat=watts)
+
+    # output to the user
+    print("rms error = %.2f degrees" % (rms))
+    lines = ["%s = %s" % (name, fitted[name]) for name in
+        ['sim_t_env', 'sim_c_heat', 'sim_c_oven', 'sim_p_heat', 'sim_R_o_nocool', 'sim_R_ho_noair']]
+    for line in lines:
+        print(line)
+
+    with open(outfile, 'w') as f:
+        f.write("# written by kiln-model.py from %s, rms error %.2f degrees\n" % (csvfile, rms))
+        f.write("# copy into config.py or pass to kiln-tuner.py --optimize --model\n")
+        for line in lines:
+            f.write(line + "\n")
+    print("model written to %s" % (outfile))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fit the simulated kiln to a recorded firing')
+    parser.add_argument('csvfile', nargs='?', default="tuning.csv", help="csv from kiln-logger.py (logged with --pidstats) or kiln-tuner.py (default tuning.csv)")
+    parser.add_argument('-t', '--target_temp', type=float, default=400, help="Target temperature kiln-tuner.py was run with (default 400)")
+    parser.add_argument('-w', '--watts', type=float, default=None, help="Power of the elements in watts (default kw_elements from config.py)")
+    parser.add_argument('-e', '--t_env', type=float, default=None, help="Temperature around the kiln (default sim_t_env from config.py)")
+    parser.add_argument('-o', '--outfile', type=str, default="kiln-model.txt", help="Where to write the fitted settings (default kiln-model.txt)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=config.log_format)
+    target = args.target_temp
+    if config.temp_scale.lower() == "c":
+        target = (target - 32)*5/9
+    main(args.csvfile, target, args.watts, args.t_env, args.outfile)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import csv
+import ast
+import time
+import logging
+import argparse
+
+try:
+        sys.dont_write_bytecode = True
+        import config
+        sys.dont_write_bytecode = False
+
+except ImportError:
+        print("Could not import config file.")
+        print("Copy config.py.EXAMPLE to config.py and adapt it for your setup.")
+        exit(1)
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, script_dir + '/lib/')
+
+from profileStore import ProfileStore
+from batchSimulator import simulate_all, TRACE_FIELDS
+
+
+def parse_override(setting):
+    '''turn "pid_kp=10,20" into ("pid_kp", [10, 20])'''
+    (name, values) = setting.split('=', 1)
+    parsed = []
+    for value in values.split(','):
+        try:
+            parsed.append(ast.literal_eval(value))
+        except (ValueError, SyntaxError):
+            parsed.append(value)
+    return (name.strip(), parsed)
+
+
+def hms(seconds):
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds / 3600, (seconds % 3600) / 60, seconds % 60)
+
+
+def write_trace(outdir, number, name, trace):
+    filename = os.path.join(outdir, "%s-%03d.csv" % (name, number))
+    with open(filename, 'w') as f:
+        csvout = csv.DictWriter(f, TRACE_FIELDS)
+        csvout.writeheader()
+        csvout.writerows(trace)
+    return filename
+
+
+def main(names, settings, processes, outdir):
+    store = ProfileStore(config.kiln_profiles_directory)
+    if names:
+        profiles = [store.get_profile(n) for n in names]
+        missing = [n for (n, p) in zip(names, profiles) if p is None]
+        if missing:
+            print("profiles not found: %s" % ", ".join(missing))
+            exit(1)
+    else:
+        profiles = store.get_profiles()
+
+    overrides = dict(parse_override(s) for s in settings)
+    if outdir:
+        os.makedirs(outdir, exist_ok=True)
+
+    header = "%4s  %-28s %-40s %9s %9s %9s %8s" % ("run", "profile", "overrides",
+        "overshoot", "catchup", "runtime", "cost")
+    print(header)
+    print("-" * len(header))
+
+    started = time.time()
+    results = simulate_all(profiles, overrides, processes)
+    for (number, (name, override, summary, trace)) in enumerate(results):
+        settings = " ".join("%s=%s" % (k, v) for (k, v) in sorted(override.items()))
+        cost = "%s%.2f" % (config.currency_type, summary['cost'])
+        print("%4d  %-28s %-40s %9.1f %9s %9s %8s" % (number, name[:28], settings[:40],
+            summary['max_overshoot'], hms(summary['catching_up']),
+            hms(summary['runtime']), cost))
+        sys.stdout.flush()
+        if outdir:
+            write_trace(outdir, number, name, trace)
+
+    print("simulated in %.1fs" % (time.time() - started))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run kiln schedules through the simulated oven, many at once.')
+    parser.add_argument('profiles', nargs='*', help="Names of profiles to run (default all in kiln_profiles_directory)")
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=V1,V2',
+        help="Override a config.py setting with one or more values. Every combination is run. May be repeated.")
+    parser.add_argument('-p', '--processes', type=int, default=None, help="Number of worker processes (default one per cpu)")
+    parser.add_argument('-o', '--outdir', type=str, default=None, help="Write the trace of every run as csv to this directory")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format=config.log_format)
+    main(args.profiles, args.set, args.processes, args.outdir)
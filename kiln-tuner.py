@@ -4,6 +4,7 @@ import os
 import sys
 import csv
 import time
+import socket
 import argparse
 
 try:
@@ -34,7 +35,7 @@ def recordprofile(csvfile, targettemp):
         oven = SimulatedOven()
         oven.target = targettemp * 2 # insures max heating for simulation
     else:
-        oven = RealOven()
+        oven = RealOven(automatic_restarts=False)
 
     # Main loop:
     #
@@ -85,121 +86,212 @@ def recordprofile(csvfile, targettemp):
             oven.output.cool(0)
 
 
-def line(a, b, x):
-    return a * x + b
+def plot(times, temps, fit, end):
+    from matplotlib import pyplot
+    import stepResponse
 
+    pyplot.scatter(times, temps, s=4)
+    heating = times[:end]
+    pyplot.plot(heating, stepResponse.fopdt([fit[p] for p in stepResponse.FOPDT], heating), color='red')
 
-def invline(a, b, y):
-    return (y - b) / a
+    # steepest slope of the fit, where the dead time ends
+    pyplot.plot([fit['L'], times[-1]], [fit['y0'], fit['y0'] + fit['R'] * (times[-1] - fit['L'])], '--', color='red')
+    pyplot.plot([fit['L'], fit['L']], [min(temps), max(temps)], '--', color='black')
 
+    pyplot.show()
 
-def plot(xdata, ydata,
-         tangent_min, tangent_max, tangent_slope, tangent_offset,
-         lower_crossing_x, upper_crossing_x):
-    from matplotlib import pyplot
 
-    minx = min(xdata)
-    maxx = max(xdata)
-    miny = min(ydata)
-    maxy = max(ydata)
+def calculate(filename, target, showplot):
+    '''fit the heating in filename and print pid gains. target is where
+    the elements were turned off, None for the hottest point of the log'''
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    sys.path.insert(0, script_dir + '/lib/')
 
-    pyplot.scatter(xdata, ydata)
+    import numpy
+    import stepResponse
 
-    pyplot.plot([minx, maxx], [miny, miny], '--', color='purple')
-    pyplot.plot([minx, maxx], [maxy, maxy], '--', color='purple')
+    (times, temps) = stepResponse.read_tuning_log(filename)
+    (heat_times, heat_temps) = stepResponse.heating_part(times, temps, target)
+    fit = stepResponse.fit_fopdt(heat_times, heat_temps)
+    gains = stepResponse.ziegler_nichols(fit, stepResponse.rise(fit, heat_times[-1]))
 
-    pyplot.plot(tangent_min[0], tangent_min[1], 'v', color='red')
-    pyplot.plot(tangent_max[0], tangent_max[1], 'v', color='red')
-    pyplot.plot([minx, maxx], [line(tangent_slope, tangent_offset, minx), line(tangent_slope, tangent_offset, maxx)], '--', color='red')
+    # confidence in the fit
+    errors = numpy.sqrt(numpy.diag(fit['covariance']))
+    print("fit of %d samples: rms error = %.2f degrees, r2 = %.4f" % (fit['samples'], fit['rms'], fit['r2']))
+    print("dead time = %.1f +- %.1f seconds" % (fit['L'], errors[2]))
+    print("time constant = %.1f +- %.1f seconds" % (fit['T'], errors[3]))
+    print("initial slope = %.4f +- %.4f degrees per second" % (fit['R'], errors[1]))
+    print("pid_kp uncertainty = %.1f%%, pid_ki uncertainty = %.1f%%, pid_kd uncertainty = %.1f%%" %
+        (gains['kp_error'] * 100, gains['ki_error'] * 100, gains['kd_error'] * 100))
 
-    pyplot.plot([lower_crossing_x, lower_crossing_x], [miny, maxy], '--', color='black')
-    pyplot.plot([upper_crossing_x, upper_crossing_x], [miny, maxy], '--', color='black')
+    # output to the user
+    print("pid_kp = %s" % (gains['pid_kp']))
+    print("pid_ki = %s" % (gains['pid_ki']))
+    print("pid_kd = %s" % (gains['pid_kd']))
 
-    pyplot.show()
+    if showplot:
+        plot(times, temps, fit, len(heat_times))
 
 
-def calculate(filename, tangentdivisor, showplot):
-    # parse the csv file
-    xdata = []
-    ydata = []
-    filemintime = None
-    with open(filename) as f:
-        for row in csv.DictReader(f):
-            try:
-                time = float(row['time'])
-                temp = float(row['temperature'])
-                if filemintime is None:
-                    filemintime = time
-
-                xdata.append(time - filemintime)
-                ydata.append(temp)
-            except ValueError:
-                continue  # just ignore bad values!
-
-    # gather points for tangent line
-    miny = min(ydata)
-    maxy = max(ydata)
-    midy = (maxy + miny) / 2
-    yoffset = int((maxy - miny) / tangentdivisor)
-    tangent_min = tangent_max = None
-    for i in range(0, len(xdata)):
-        rowx = xdata[i]
-        rowy = ydata[i]
-
-        if rowy >= (midy - yoffset) and tangent_min is None:
-            tangent_min = (rowx, rowy)
-        elif rowy >= (midy + yoffset) and tangent_max is None:
-            tangent_max = (rowx, rowy)
-
-    # calculate tangent line to the main temperature curve
-    tangent_slope = (tangent_max[1] - tangent_min[1]) / (tangent_max[0] - tangent_min[0])
-    tangent_offset = tangent_min[1] - line(tangent_slope, 0, tangent_min[0])
-
-    # determine the point at which the tangent line crosses the min/max temperaturess
-    lower_crossing_x = invline(tangent_slope, tangent_offset, miny)
-    upper_crossing_x = invline(tangent_slope, tangent_offset, maxy)
-
-    # compute parameters
-    L = lower_crossing_x - min(xdata)
-    T = upper_crossing_x - lower_crossing_x
-
-    # Magic Ziegler-Nicols constants ahead!
-    Kp = 1.2 * (T / L)
-    Ti = 2 * L
-    Td = 0.5 * L
-    Ki = Kp / Ti
-    Kd = Kp * Td
+def optimize(modelfile, names, population, rounds, overshoot_weight, gainsfile):
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    sys.path.insert(0, script_dir + '/lib/')
+
+    from profileStore import ProfileStore
+    import pidOptimizer
+
+    if modelfile:
+        model = pidOptimizer.load_model(modelfile)
+    else:
+        model = pidOptimizer.current_model()
+
+    store = ProfileStore(config.kiln_profiles_directory)
+    if names:
+        profiles = [store.get_profile(n) for n in names]
+        if None in profiles:
+            print("profiles not found: %s" % ", ".join(n for (n, p) in zip(names, profiles) if p is None))
+            exit(1)
+    else:
+        profiles = store.get_profiles()
+
+    print("optimizing against %s" % ", ".join(p['name'] for p in profiles))
+    print("model: %s" % ", ".join("%s = %s" % (k, v) for (k, v) in sorted(model.items())))
+    ((kp, ki, kd), score) = pidOptimizer.optimize(profiles, model,
+        population=population, rounds=rounds, overshoot_weight=overshoot_weight)
 
     # output to the user
-    print("pid_kp = %s" % (Kp))
-    print("pid_ki = %s" % (1 / Ki))
-    print("pid_kd = %s" % (Kd))
+    print("score = %s" % (score))
+    print("pid_kp = %s" % (kp))
+    print("pid_ki = %s" % (ki))
+    print("pid_kd = %s" % (kd))
+
+    with open(gainsfile, 'w') as f:
+        f.write("# written by kiln-tuner.py --optimize, copy into config.py\n")
+        f.write("pid_kp = %s\n" % (kp))
+        f.write("pid_ki = %s\n" % (ki))
+        f.write("pid_kd = %s\n" % (kd))
+    print("gains written to %s" % (gainsfile))
+
+
+def controller_running():
+    '''why the kiln looks like it is in use by kiln-controller.py, None if
+    it does not: something answers on its port, or its state file is
+    recent and says a firing is on.
+    inputs
+        config.listening_port
+        config.automatic_restart_state_file
+        config.automatic_restart_window
+    '''
+    from checkpoint import Checkpoint
+
+    try:
+        socket.create_connection(("127.0.0.1", config.listening_port), timeout=1).close()
+        return "something is listening on port %d" % config.listening_port
+    except OSError:
+        pass
+    filename = config.automatic_restart_state_file
+    if os.path.isfile(filename) and \
+            time.time() - os.path.getmtime(filename) <= config.automatic_restart_window * 60:
+        state = (Checkpoint(filename).read() or {}).get("state")
+        if state in ("RUNNING", "PAUSED"):
+            return "%s says a firing is %s" % (filename, state)
+    return None
+
+
+def relay(targettemp):
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    sys.path.insert(0, script_dir + '/lib/')
 
+    from oven import RealOven, SimulatedOven, VirtualClock
 
-    if showplot:
-        plot(xdata, ydata,
-             tangent_min, tangent_max, tangent_slope, tangent_offset,
-             lower_crossing_x, upper_crossing_x)
+    # a simulated kiln does not need to run in real time
+    if config.simulate:
+        oven = SimulatedOven(clock=VirtualClock(), headless=True)
+    else:
+        # both would drive the same relays
+        busy = controller_running()
+        if busy:
+            print("kiln-controller.py looks active, %s. stop it before tuning." % busy)
+            exit(1)
+        # the controller's state file is not ours to write or restart from
+        oven = RealOven(automatic_restarts=False)
+
+    try:
+        oven.run_autotune(targettemp)
+    except ValueError as e:
+        print("can not autotune: %s" % e)
+        exit(1)
+    try:
+        while oven.state == "AUTOTUNE":
+            if config.simulate:
+                oven.autotune_step()
+            else:
+                time.sleep(config.sensor_time_wait)
+    except KeyboardInterrupt:
+        oven.abort_run()
+        print("autotune aborted")
+        exit(1)
+
+    result = oven.autotune_result
+    if result is None:
+        print("autotune failed, see the log")
+        exit(1)
+
+    # output to the user
+    print("ultimate gain = %s" % (result['ku']))
+    print("ultimate period = %s seconds" % (result['pu']))
+    print("pid_kp = %s" % (result['kp']))
+    print("pid_ki = %s" % (result['ki']))
+    print("pid_kd = %s" % (result['kd']))
+    if not config.simulate:
+        oven.abort_run()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Kiln tuner')
     parser.add_argument('-c', '--calculate_only', action='store_true')
-    parser.add_argument('-t', '--target_temp', type=float, default=400, help="Target temperature")
-    parser.add_argument('-d', '--tangent_divisor', type=float, default=8, help="Adjust the tangent calculation to fit better. Must be >= 2 (default 8).")
-    parser.add_argument('-s', '--showplot', action='store_true', help="draw plot so you can see tanget line and possibly change")
+    parser.add_argument('-t', '--target_temp', type=float, default=None, help="Target temperature (default 400). with -c, the temperature tuning.csv was recorded to, by default its hottest point")
+    parser.add_argument('-s', '--showplot', action='store_true', help="draw plot so you can see how well the fit follows the data")
+    parser.add_argument('-r', '--relay', action='store_true', help="tune with a relay oscillation around target_temp instead of a single heat up")
+    parser.add_argument('-o', '--optimize', action='store_true', help="find gains with simulated firings instead of heating the kiln")
+    parser.add_argument('-m', '--model', type=str, default=None, help="with --optimize, thermal model settings to use (default the sim_ settings in config.py)")
+    parser.add_argument('-p', '--profiles', nargs='*', default=[], help="with --optimize, profiles to fire (default all)")
+    parser.add_argument('--population', type=int, default=256, help="with --optimize, simulated kilns per profile per round (default 256)")
+    parser.add_argument('--rounds', type=int, default=6, help="with --optimize, rounds of search (default 6)")
+    parser.add_argument('--overshoot_weight', type=float, default=1.0, help="with --optimize, how much worse a degree of overshoot is than a degree of average error (default 1)")
+    parser.add_argument('--gains_file', type=str, default="pid-gains.txt", help="with --optimize, where to write the gains (default pid-gains.txt)")
     args = parser.parse_args()
 
+    if args.optimize:
+        import logging
+        logging.basicConfig(level=logging.INFO, format=config.log_format)
+        optimize(args.model, args.profiles, args.population, args.rounds,
+            args.overshoot_weight, args.gains_file)
+        exit(0)
+
     csvfile = "tuning.csv"
     target = args.target_temp
-    if config.temp_scale.lower() == "c":
+    if target is not None and config.temp_scale.lower() == "c":
         target = (target - 32)*5/9
-    tangentdivisor = args.tangent_divisor 
+    # what a new recording heats to
+    recordtarget = target
+    if recordtarget is None:
+        recordtarget = 400
+        if config.temp_scale.lower() == "c":
+            recordtarget = (recordtarget - 32)*5/9
+
+    if args.relay:
+        import logging
+        logging.basicConfig(level=logging.INFO, format=config.log_format)
+        relay(recordtarget)
+        exit(0)
 
     # default behavior is to record profile to csv file tuning.csv
     # and then calculate pid values and print them
     if args.calculate_only:
-        calculate(csvfile, tangentdivisor, args.showplot)
+        # a log recorded to another target is cut where it peaked,
+        # unless -t says where the elements were turned off
+        calculate(csvfile, target, args.showplot)
     else:
-        recordprofile(csvfile, target)
-        calculate(csvfile, tangentdivisor, args.showplot)
+        recordprofile(csvfile, recordtarget)
+        calculate(csvfile, recordtarget, args.showplot)
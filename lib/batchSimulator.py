@@ -0,0 +1,77 @@
+import logging,json,itertools,multiprocessing
+import config
+from oven import SimulatedOven, VirtualClock, Profile
+log = logging.getLogger(__name__)
+
+# columns written for each step of a run
+TRACE_FIELDS = [
+    'runtime',
+    'temperature',
+    'target',
+    'heat',
+    'catching_up',
+    'cost',
+]
+
+def combinations(overrides):
+    '''overrides maps a config name to a list of values to try. returns
+    one dict per combination of values.
+    '''
+    names = sorted(overrides)
+    return [dict(zip(names, values)) for values in
+        itertools.product(*[overrides[n] for n in names])]
+
+def apply_overrides(overrides):
+    '''set the config settings in overrides. returns the values they
+    had before, apply_overrides of those puts config back.'''
+    for name in overrides:
+        if not hasattr(config, name):
+            raise AttributeError("config has no setting %s" % name)
+    saved = {name: getattr(config, name) for name in overrides}
+    for (name, value) in overrides.items():
+        setattr(config, name, value)
+    return saved
+
+def summarize(trace, time_step):
+    '''boil a trace from SimulatedOven.run_headless down to a few numbers'''
+    # the first state is recorded before any target is set
+    running = [s for s in trace if s['target']]
+    overshoot = max([s['temperature'] - s['target'] for s in running] or [0])
+    return {
+        'max_overshoot': max(overshoot, 0),
+        'catching_up': sum(time_step for s in running if s['catching_up']),
+        'runtime': len(trace) * time_step,
+        'cost': trace[-1]['cost'] if trace else 0,
+    }
+
+def simulate(run):
+    '''run one profile with one set of config overrides on a headless
+    simulated oven. run is (profile dict, overrides), so this can be
+    handed straight to a process pool. returns (summary, trace).
+    '''
+    (profile, overrides) = run
+    # pool workers run many of these one after the other, so the next
+    # run must not start from this one's settings
+    saved = apply_overrides(overrides)
+    try:
+        profile = Profile(json.dumps(profile))
+        oven = SimulatedOven(clock=VirtualClock(), headless=True)
+        trace = oven.run_headless(profile)
+    finally:
+        apply_overrides(saved)
+    trace = [{f: s[f] for f in TRACE_FIELDS} for s in trace]
+    return (summarize(trace, oven.time_step), trace)
+
+def quiet():
+    # one log line per step from every worker is more than anyone wants
+    logging.getLogger().setLevel(logging.WARNING)
+
+def simulate_all(profiles, overrides, processes=None):
+    '''run every profile against every combination of overrides across a
+    process pool. yields (profile name, overrides, summary, trace) as
+    runs finish, in the order profiles and combinations were given.
+    '''
+    runs = [(p, o) for p in profiles for o in combinations(overrides)]
+    with multiprocessing.Pool(processes, initializer=quiet) as pool:
+        for ((p, o), (summary, trace)) in zip(runs, pool.imap(simulate, runs)):
+            yield (p['name'], o, summary, trace)
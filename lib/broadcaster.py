@@ -0,0 +1,179 @@
+import threading,logging,time,collections
+import config
+log = logging.getLogger(__name__)
+
+POLICIES = ["drop", "coalesce", "disconnect"]
+
+class ClientQueue(threading.Thread):
+    '''Sends messages to one websocket from its own thread, so a slow
+    client only holds up itself. At most size messages wait in the
+    queue. When it is full the policy decides what happens:
+        drop        the new message is thrown away
+        coalesce    waiting messages that may be dropped are replaced
+                    by the new one, the client skips to the latest state
+        disconnect  the client is closed, it can reconnect and start
+                    over with a fresh backlog
+    messages put with droppable=False (the backlog) are always sent.
+    messages that are not strings are turned into one by encoder just
+    before they are sent, see statusStream.Encoder.
+    '''
+    def __init__(self, wsock, size, policy, on_close=None, encoder=None):
+        self.wsock = wsock
+        self.encoder = encoder
+        self.size = size
+        self.policy = policy
+        self.on_close = on_close
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.connected = time.time()
+        self.sent = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.start()
+
+    def put(self, message, droppable=True):
+        '''queue message, returns False once the client is closed'''
+        with self.cond:
+            if self.closed:
+                return False
+            if len(self.queue) >= self.size and droppable:
+                if self.policy == "disconnect":
+                    log.error("client %s is too slow, disconnecting" % self.name)
+                    self.dropped += len(self.queue) + 1
+                    self.queue.clear()
+                    self.closed = True
+                    self.cond.notify()
+                    return False
+                if self.policy == "coalesce":
+                    kept = collections.deque(m for m in self.queue if not m[2])
+                    self.dropped += len(self.queue) - len(kept)
+                    self.queue = kept
+                if len(self.queue) >= self.size:
+                    self.dropped += 1
+                    return True
+            self.queue.append((time.time(), message, droppable))
+            self.cond.notify()
+            return True
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.queue and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    break
+                (queued, message, droppable) = self.queue.popleft()
+            try:
+                if not isinstance(message, str):
+                    message = self.encoder(message)
+                self.wsock.send(message)
+            except Exception:
+                log.error("could not write to socket %s" % self.wsock)
+                with self.cond:
+                    self.closed = True
+                break
+            latency = time.time() - queued
+            with self.cond:
+                self.sent += 1
+                self.bytes += len(message)
+                self.last_latency = latency
+                self.max_latency = max(self.max_latency, latency)
+                self.total_latency += latency
+
+        if self.policy == "disconnect":
+            try:
+                self.wsock.close()
+            except Exception:
+                pass
+        if self.on_close:
+            self.on_close(self.wsock)
+
+    def stats(self):
+        with self.cond:
+            environ = getattr(self.wsock, 'environ', None) or {}
+            return {
+                'client': environ.get('REMOTE_ADDR', self.name),
+                'connected': self.connected,
+                'policy': self.policy,
+                'queued': len(self.queue),
+                'sent': self.sent,
+                'dropped': self.dropped,
+                'bytes': self.bytes,
+                'last_latency': self.last_latency,
+                'max_latency': self.max_latency,
+                'mean_latency': self.total_latency / self.sent if self.sent else 0.0,
+            }
+
+class Broadcaster(object):
+    '''Fans messages out to many websockets through a ClientQueue each.
+    broadcast only queues, so it takes the same short time however many
+    clients there are and however slow they are.
+    inputs
+        config.status_queue_size
+        config.status_slow_policy
+    '''
+    def __init__(self, size=None, policy=None):
+        self.size = config.status_queue_size if size is None else size
+        self.policy = config.status_slow_policy if policy is None else policy
+        if self.policy not in POLICIES:
+            raise ValueError("unknown slow client policy %s, use one of %s" %
+                (self.policy, ", ".join(POLICIES)))
+        self.lock = threading.Lock()
+        self.clients = {}
+
+    def __len__(self):
+        return len(self.clients)
+
+    def add(self, wsock, first=None, encoder=None):
+        '''start sending to wsock, first is queued ahead of anything else'''
+        client = ClientQueue(wsock, self.size, self.policy, on_close=self.remove,
+            encoder=encoder)
+        # registered before anything is sent, so if the first send fails
+        # on_close finds the client to remove
+        with self.lock:
+            self.clients[wsock] = client
+        if first is not None:
+            client.put(first, droppable=False)
+        return client
+
+    def remove(self, wsock):
+        with self.lock:
+            client = self.clients.pop(wsock, None)
+        if client:
+            client.close()
+
+    def encoder(self, wsock):
+        with self.lock:
+            client = self.clients.get(wsock)
+        return client.encoder if client else None
+
+    def encoders(self):
+        with self.lock:
+            return [client.encoder for client in self.clients.values()]
+
+    def broadcast(self, message, wants=None):
+        '''queue message for every client, or only the ones whose
+        encoder wants it'''
+        with self.lock:
+            clients = list(self.clients.values())
+        if wants:
+            clients = [client for client in clients if wants(client.encoder)]
+        log.debug("sending to %d clients" % len(clients))
+        for client in clients:
+            client.put(message)
+
+    def stats(self):
+        with self.lock:
+            clients = list(self.clients.values())
+        return [client.stats() for client in clients]
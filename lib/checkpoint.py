@@ -0,0 +1,143 @@
+import threading,logging,json,os,tempfile,time
+import config
+log = logging.getLogger(__name__)
+
+FSYNC_POLICIES = ["always", "changes", "never"]
+
+class Checkpoint(object):
+    '''Writes the automatic restart state file so that a power cut can
+    never leave a half written file behind. Every write goes to a
+    temporary file in the same directory which is then renamed over the
+    old one, so a reader sees either the old or the new checkpoint.
+    Writes are skipped when the data is the same as last time, and
+    otherwise made at most every interval seconds unless forced (the
+    start and end of a firing are always written right away). fsync
+    decides when the data is flushed to the card before the rename:
+        always   every write
+        changes  only forced writes
+        never    left to the os, the rename is still atomic
+    inputs
+        config.automatic_restart_state_file
+        config.automatic_restart_interval
+        config.automatic_restart_fsync
+    '''
+    def __init__(self, filename=None, interval=None, fsync=None):
+        self.filename = config.automatic_restart_state_file if filename is None else filename
+        self.interval = config.automatic_restart_interval if interval is None else interval
+        self.fsync = config.automatic_restart_fsync if fsync is None else fsync
+        if self.fsync not in FSYNC_POLICIES:
+            raise ValueError("unknown fsync policy %s, use one of %s" %
+                (self.fsync, ", ".join(FSYNC_POLICIES)))
+        self.lock = threading.Lock()
+        # the last data written and its serialized text
+        self.data = None
+        self.text = None
+        self.written = None
+        self.writes = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+        self.last_bytes = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    def serialize(self, data):
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+    def deserialize(self, text):
+        return json.loads(text)
+
+    def due(self):
+        return self.written is None or time.monotonic() - self.written >= self.interval
+
+    def write(self, data, force=False):
+        '''write data unless it is unchanged, or it is too soon since the
+        last write and force is not set. returns True if it was written.'''
+        with self.lock:
+            if not force and not self.due():
+                self.skipped += 1
+                return False
+            text = self.serialize(data)
+            if text == self.text:
+                self.skipped += 1
+                return False
+            content = text.encode('utf-8')
+            started = time.monotonic()
+            try:
+                self.replace(content, self.fsync == "always" or
+                    (self.fsync == "changes" and force))
+            except OSError as e:
+                log.error("could not write checkpoint %s: %s" % (self.filename, e))
+                self.failed += 1
+                return False
+            latency = time.monotonic() - started
+            self.data = data
+            self.text = text
+            self.written = started
+            self.writes += 1
+            self.bytes += len(content)
+            self.last_bytes = len(content)
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            self.total_latency += latency
+            log.debug("checkpoint of %d bytes written in %.1fms" % (len(content), latency * 1000))
+            return True
+
+    def replace(self, content, sync):
+        directory = os.path.dirname(self.filename) or '.'
+        (fd, tmp) = tempfile.mkstemp(dir=directory,
+            prefix=os.path.basename(self.filename) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp, self.filename)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        if sync:
+            # make the rename itself survive a power cut
+            try:
+                dirfd = os.open(directory, os.O_RDONLY)
+            except OSError:
+                return
+            try:
+                os.fsync(dirfd)
+            except OSError:
+                pass
+            finally:
+                os.close(dirfd)
+
+    def read(self):
+        '''the data in the checkpoint file, None if there is none or it
+        cannot be read'''
+        try:
+            with open(self.filename, 'rb') as f:
+                return self.deserialize(f.read().decode('utf-8'))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.error("could not read checkpoint %s: %s" % (self.filename, e))
+            return None
+
+    def stats(self):
+        with self.lock:
+            return {
+                'file': self.filename,
+                'interval': self.interval,
+                'fsync': self.fsync,
+                'writes': self.writes,
+                'skipped': self.skipped,
+                'failed': self.failed,
+                'bytes': self.bytes,
+                'last_bytes': self.last_bytes,
+                'last_latency': self.last_latency,
+                'max_latency': self.max_latency,
+                'mean_latency': self.total_latency / self.writes if self.writes else 0.0,
+            }
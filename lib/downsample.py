@@ -0,0 +1,98 @@
+import logging
+log = logging.getLogger(__name__)
+
+class MinMaxSeries(object):
+    '''Shape preserving downsampling of a growing series to at most
+    points rows. Rows are grouped into buckets of equal size and only
+    the coolest and the hottest row of every bucket are kept, so short
+    spikes and dips survive however far the series is thinned out.
+    When there are too many buckets, neighbours are merged in pairs and
+    the bucket size doubles, which makes adding a row O(1) on average
+    instead of redoing the whole series on every connect.
+    rows are lists, key is the position of the value to preserve and
+    x the position of the time.
+    '''
+    def __init__(self, points, key=1, x=0):
+        self.points = points
+        self.key = key
+        self.x = x
+        # [lowest row, highest row, number of rows]
+        self.buckets = []
+        self.width = 1
+        self.last = None
+
+    def add(self, row):
+        self.last = row
+        if not self.buckets or self.buckets[-1][2] >= self.width:
+            self.buckets.append([row, row, 1])
+            if len(self.buckets) > max((self.points - 1) // 2, 1):
+                self.merge()
+            return
+        bucket = self.buckets[-1]
+        if row[self.key] < bucket[0][self.key]:
+            bucket[0] = row
+        if row[self.key] > bucket[1][self.key]:
+            bucket[1] = row
+        bucket[2] += 1
+
+    def merge(self):
+        merged = []
+        for i in range(0, len(self.buckets), 2):
+            pair = self.buckets[i:i + 2]
+            low = min((b[0] for b in pair), key=lambda r: r[self.key])
+            high = max((b[1] for b in pair), key=lambda r: r[self.key])
+            merged.append([low, high, sum(b[2] for b in pair)])
+        self.buckets = merged
+        self.width *= 2
+
+    def rows(self):
+        '''the kept rows in time order, always ending with the newest'''
+        rows = []
+        for (low, high, count) in self.buckets:
+            if low is high:
+                rows.append(low)
+            elif low[self.x] <= high[self.x]:
+                rows += [low, high]
+            else:
+                rows += [high, low]
+        if self.last is not None and (not rows or rows[-1] is not self.last):
+            rows.append(self.last)
+        return rows
+
+def minmax_buckets(rows, start, end, buckets, x=0, low=1, high=None):
+    '''Shape preserving downsampling of rows in x order, as they are
+    read. The span from start to end is cut into buckets of equal width
+    and the lowest (by position low) and highest (by position high,
+    low by default) row of each bucket are yielded in x order as soon as
+    the bucket is complete, then the last row. At most 2 * buckets + 1
+    rows come out, however many go in, and only one bucket is held.
+    '''
+    high = low if high is None else high
+    width = (end - start) / buckets if end > start else 0
+    current = None
+    lowest = highest = last = None
+    for row in rows:
+        n = min(max(int((row[x] - start) / width), 0), buckets - 1) if width else 0
+        if n != current:
+            if current is not None:
+                for kept in ordered(lowest, highest, x):
+                    yield kept
+            current = n
+            lowest = highest = row
+        else:
+            if row[low] is not None and (lowest[low] is None or row[low] < lowest[low]):
+                lowest = row
+            if row[high] is not None and (highest[high] is None or row[high] > highest[high]):
+                highest = row
+        last = row
+    if current is None:
+        return
+    for kept in ordered(lowest, highest, x):
+        yield kept
+    if last is not lowest and last is not highest:
+        yield last
+
+def ordered(a, b, x):
+    if a is b:
+        return [a]
+    return [a, b] if a[x] <= b[x] else [b, a]
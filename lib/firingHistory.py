@@ -0,0 +1,173 @@
+import logging,math,json
+from array import array
+import config
+from downsample import MinMaxSeries
+log = logging.getLogger(__name__)
+
+# numeric fields of Oven.get_state kept for every sample, and the ones
+# nested in pidstats. everything else in a state is the same for the
+# whole firing and kept once.
+STATE_FIELDS = ['runtime', 'temperature', 'target', 'heat', 'heat_rate',
+    'cost', 'catching_up', 'seq', 'server_time']
+PID_FIELDS = ['time', 'timeDelta', 'setpoint', 'ispoint', 'err', 'errDelta',
+    'p', 'i', 'd', 'kp', 'ki', 'kd', 'pid', 'out']
+COLUMNS = STATE_FIELDS + ['pid_' + f for f in PID_FIELDS]
+
+class Ring(object):
+    '''fixed size columnar ring buffer, one array of doubles per column'''
+    def __init__(self, columns, capacity):
+        self.columns = columns
+        self.capacity = capacity
+        self.data = [array('d', [0.0]) * capacity for c in columns]
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def full(self):
+        return self.count == self.capacity
+
+    def append(self, row):
+        i = (self.start + self.count) % self.capacity
+        for (column, value) in zip(self.data, row):
+            column[i] = value
+        self.count += 1
+
+    def index(self, n):
+        '''position in the arrays of the n-th oldest row'''
+        return (self.start + n) % self.capacity
+
+    def row(self, n):
+        i = self.index(n)
+        return [column[i] for column in self.data]
+
+    def pop_mean(self, k):
+        '''remove the k oldest rows and return their mean'''
+        k = min(k, self.count)
+        sums = [0.0] * len(self.data)
+        for n in range(k):
+            i = self.index(n)
+            for (c, column) in enumerate(self.data):
+                sums[c] += column[i]
+        self.start = self.index(k)
+        self.count -= k
+        return [s / k for s in sums]
+
+class FiringHistory(object):
+    '''Bounded history of the states of one firing. The newest samples
+    are kept as they are in a ring buffer. When it fills up, the oldest
+    samples are averaged in blocks into a coarser archive ring, which in
+    turn is averaged into the next one. Memory is fixed by config, no
+    matter how long the firing runs: with the defaults, one hour at full
+    resolution, then 30 second averages for 8 hours, then 4 minute
+    averages for 40 hours. The oldest archive simply drops old rows.
+    inputs
+        config.history_samples
+        config.history_archive
+    '''
+    def __init__(self, samples=None, archive=None):
+        samples = config.history_samples if samples is None else samples
+        archive = config.history_archive if archive is None else archive
+        # newest first, each tier is (ring, rows of the previous tier per row)
+        self.tiers = [(Ring(COLUMNS, samples), 1)]
+        for (factor, capacity) in archive:
+            self.tiers.append((Ring(COLUMNS, capacity), factor))
+        # the non numeric part of the last state
+        self.meta = {}
+        # point budget -> MinMaxSeries kept up to date as rows arrive
+        self.series = {}
+
+    def clear(self):
+        for (ring, factor) in self.tiers:
+            ring.start = 0
+            ring.count = 0
+        self.meta = {}
+        self.series = {}
+
+    def __len__(self):
+        return sum(len(ring) for (ring, factor) in self.tiers)
+
+    def append(self, state):
+        pidstats = state.get('pidstats') or {}
+        row = [float(state.get(f) or 0) for f in STATE_FIELDS]
+        row += [float(pidstats.get(f, math.nan)) for f in PID_FIELDS]
+        self.meta = {k: v for (k, v) in state.items()
+            if k not in STATE_FIELDS and k != 'pidstats'}
+        self.push(0, row)
+        if self.series:
+            # serialized once, shared by every point budget
+            entry = self.encoded(row)
+            for series in self.series.values():
+                series.add(entry)
+
+    def encoded(self, row):
+        '''row with the json of its state added at the end, so a backlog
+        is a join of strings instead of a json.dumps of every state'''
+        return row + [json.dumps(self.as_state(row))]
+
+    def push(self, tier, row):
+        (ring, factor) = self.tiers[tier]
+        if ring.full():
+            if tier + 1 < len(self.tiers):
+                self.push(tier + 1, ring.pop_mean(self.tiers[tier + 1][1]))
+            else:
+                ring.pop_mean(1)
+        ring.append(row)
+
+    def rows(self):
+        '''every row as a list of values in COLUMNS order, oldest first'''
+        for (ring, factor) in reversed(self.tiers):
+            for n in range(len(ring)):
+                yield ring.row(n)
+
+    def as_state(self, row):
+        '''a row turned back into the dict Oven.get_state returned'''
+        state = dict(self.meta)
+        for (f, value) in zip(STATE_FIELDS, row):
+            state[f] = value
+        state['catching_up'] = state['catching_up'] >= 0.5
+        state['seq'] = int(round(state['seq']))
+        pidstats = {}
+        for (f, value) in zip(PID_FIELDS, row[len(STATE_FIELDS):]):
+            if not math.isnan(value):
+                pidstats[f] = value
+        state['pidstats'] = pidstats
+        return state
+
+    def downsampled(self, points):
+        '''about points states that keep the shape of the temperature
+        curve, see MinMaxSeries'''
+        return [self.as_state(entry) for entry in self.series_for(points).rows()]
+
+    def downsampled_json(self, points):
+        '''json list of the states downsampled returns'''
+        return "[" + ", ".join(entry[-1] for entry in self.series_for(points).rows()) + "]"
+
+    def series_for(self, points, budgets=8):
+        '''the first request for a budget goes through the whole history,
+        after that it is updated as states arrive. only the last budgets
+        budgets are kept up to date.'''
+        series = self.series.pop(points, None)
+        if series is None:
+            series = MinMaxSeries(points, key=COLUMNS.index('temperature'),
+                x=COLUMNS.index('runtime'))
+            for row in self.rows():
+                series.add(self.encoded(row))
+            while len(self.series) >= budgets:
+                del self.series[next(iter(self.series))]
+        # most recently used last
+        self.series[points] = series
+        return series
+
+    def since(self, seq):
+        '''the states after seq, oldest first, or None when the full
+        resolution ring no longer reaches back to seq + 1: those states
+        were averaged into the archive (or belong to an earlier firing)
+        and have no seq of their own to resume from.'''
+        c = COLUMNS.index('seq')
+        ring = self.tiers[0][0]
+        if len(ring) and ring.row(0)[c] > seq + 1:
+            return None
+        rows = (ring.row(n) for n in range(len(ring)))
+        return [self.as_state(row) for row in rows if row[c] > seq]
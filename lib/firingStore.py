@@ -0,0 +1,374 @@
+import threading,logging,json,time,sqlite3
+import config
+log = logging.getLogger(__name__)
+
+# numeric fields of Oven.get_state stored for every sample, then the
+# ones nested in pidstats (stored as pid_p and so on)
+SAMPLE_FIELDS = ['runtime', 'server_time', 'temperature', 'target', 'heat',
+    'heat_rate', 'cost', 'catching_up']
+PID_FIELDS = ['out', 'p', 'i', 'd']
+COLUMNS = SAMPLE_FIELDS + ['pid_' + f for f in PID_FIELDS]
+
+# seconds per row of the rollup tiers. each row has the number of states
+# it stands for, the mean of every column and the lowest and highest
+# value of the columns in RANGE_COLUMNS, as temperature_min and so on.
+ROLLUPS = [60, 600]
+RANGE_COLUMNS = ['temperature', 'target', 'heat', 'heat_rate', 'pid_out',
+    'pid_p', 'pid_i', 'pid_d']
+ROLLUP_COLUMNS = ['count'] + COLUMNS + [c + s for c in RANGE_COLUMNS for s in ('_min', '_max')]
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY,
+        profile TEXT,
+        schedule TEXT,
+        started REAL,
+        ended REAL,
+        end_state TEXT,
+        samples INTEGER NOT NULL DEFAULT 0,
+        max_temperature REAL,
+        runtime REAL,
+        cost REAL,
+        rolled_up REAL,
+        pruned INTEGER NOT NULL DEFAULT 0)''',
+    '''CREATE TABLE IF NOT EXISTS samples (
+        run INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+        %s)''' % ",\n        ".join("%s REAL" % c for c in COLUMNS),
+    'CREATE INDEX IF NOT EXISTS samples_run_runtime ON samples (run, runtime)',
+    'CREATE INDEX IF NOT EXISTS runs_started ON runs (started)',
+] + ['''CREATE TABLE IF NOT EXISTS rollup_%d (
+        run INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+        bucket REAL NOT NULL,
+        %s,
+        PRIMARY KEY (run, bucket)) WITHOUT ROWID''' % (width,
+    ",\n        ".join("%s REAL" % c for c in ROLLUP_COLUMNS)) for width in ROLLUPS]
+
+# columns added to runs since the first version of the database
+MIGRATIONS = [('rolled_up', 'REAL'), ('pruned', 'INTEGER NOT NULL DEFAULT 0')]
+
+def aggregate(width):
+    '''select the rollup rows of width seconds from samples of one run
+    with runtime in [?, ?)'''
+    columns = ['count(*)'] + ['avg(%s)' % c for c in COLUMNS]
+    columns += ['%s(%s)' % (f, c) for c in RANGE_COLUMNS for f in ('min', 'max')]
+    return ('SELECT run, CAST(runtime / %d AS INTEGER) * %d AS bucket, %s FROM samples '
+        'WHERE run = ? AND runtime >= ? AND runtime < ? GROUP BY bucket' %
+        (width, width, ", ".join("%s AS %s" % (e, c) for (e, c) in zip(columns, ROLLUP_COLUMNS))))
+
+class FiringStore(object):
+    '''Keeps every firing in an sqlite database, one row per run with
+    what it was and how it ended, and one row per state of the run in
+    samples, indexed by run and runtime so a window of a long firing is
+    read without going through the rest of it. The database is in WAL
+    mode, so reading history never blocks the recording. States are
+    buffered and written in one transaction every commit_interval
+    seconds instead of one per state, which saves the SD card. A power
+    cut loses at most the buffered states.
+    the database is opened on first use.
+    inputs
+        config.history_db
+        config.history_commit_interval
+    '''
+    def __init__(self, path=None, commit_interval=None):
+        self.path = config.history_db if path is None else path
+        self.commit_interval = config.history_commit_interval if commit_interval is None else commit_interval
+        self.lock = threading.Lock()
+        self.db = None
+        self.run = None
+        # rows waiting for the next transaction
+        self.pending = []
+        self.committed = time.monotonic()
+        # summary of the current run, written to runs with each batch
+        self.summary = {}
+
+    def connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.row_factory = sqlite3.Row
+            self.db.execute('PRAGMA journal_mode=WAL')
+            # in WAL mode a commit only has to reach the log, not the card
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.execute('PRAGMA foreign_keys=ON')
+            with self.db:
+                for statement in SCHEMA:
+                    self.db.execute(statement)
+                known = [row[1] for row in self.db.execute('PRAGMA table_info(runs)')]
+                for (column, kind) in MIGRATIONS:
+                    if column not in known:
+                        self.db.execute('ALTER TABLE runs ADD COLUMN %s %s' % (column, kind))
+        return self.db
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    def start_run(self, profile_json, name=None, started=None):
+        '''start storing a new run, ending the one before. returns its id'''
+        self.end_run()
+        with self.lock:
+            db = self.connect()
+            with db:
+                cursor = db.execute('INSERT INTO runs (profile, schedule, started) VALUES (?, ?, ?)',
+                    (name, profile_json, started or time.time()))
+            self.run = cursor.lastrowid
+            self.summary = {'samples': 0, 'max_temperature': None, 'runtime': 0, 'cost': 0}
+            log.info("storing firing %d" % self.run)
+            return self.run
+
+    def add(self, state):
+        '''buffer a state of the current run, written by flush'''
+        if self.run is None:
+            return
+        pidstats = state.get('pidstats') or {}
+        row = [self.run] + [state.get(f) for f in SAMPLE_FIELDS] + [pidstats.get(f) for f in PID_FIELDS]
+        with self.lock:
+            self.pending.append(row)
+            summary = self.summary
+            summary['samples'] += 1
+            temperature = state.get('temperature')
+            if temperature is not None and (summary['max_temperature'] is None or
+                    temperature > summary['max_temperature']):
+                summary['max_temperature'] = temperature
+            summary['runtime'] = state.get('runtime', summary['runtime'])
+            summary['cost'] = state.get('cost', summary['cost'])
+
+    def due(self):
+        return bool(self.pending) and time.monotonic() - self.committed >= self.commit_interval
+
+    def flush(self, ended=None, end_state=None):
+        '''write the buffered states and the run summary in one transaction'''
+        with self.lock:
+            if self.run is None:
+                return
+            db = self.connect()
+            (rows, self.pending) = (self.pending, [])
+            started = time.monotonic()
+            try:
+                with db:
+                    db.executemany('INSERT INTO samples VALUES (%s)' % ", ".join("?" * (len(COLUMNS) + 1)), rows)
+                    db.execute('UPDATE runs SET samples = ?, max_temperature = ?, runtime = ?, cost = ?, '
+                        'ended = coalesce(?, ended), end_state = coalesce(?, end_state) WHERE id = ?',
+                        (self.summary['samples'], self.summary['max_temperature'],
+                        self.summary['runtime'], self.summary['cost'], ended, end_state, self.run))
+            except sqlite3.Error as e:
+                log.error("could not store %d states of firing %d: %s" % (len(rows), self.run, e))
+                return
+            finally:
+                self.committed = time.monotonic()
+            log.debug("stored %d states in %.1fms" % (len(rows), (self.committed - started) * 1000))
+
+    def flush_if_due(self):
+        if self.due():
+            self.flush()
+
+    def end_run(self, end_state=None):
+        '''write what is left of the current run and close it'''
+        if self.run is None:
+            return
+        self.flush(time.time(), end_state or "IDLE")
+        with self.lock:
+            log.info("firing %d stored, %d states" % (self.run, self.summary['samples']))
+            self.run = None
+
+    def runs(self, limit=None):
+        '''metadata of the stored runs, newest first'''
+        with self.lock:
+            db = self.connect()
+            sql = ('SELECT id, profile, started, ended, end_state, samples, max_temperature, '
+                'runtime, cost, pruned FROM runs ORDER BY started DESC')
+            if limit:
+                sql += ' LIMIT %d' % int(limit)
+            return [dict(row) for row in db.execute(sql)]
+
+    def get_run(self, run):
+        '''metadata of one run including its schedule, None if unknown.
+        for the run being recorded it includes the buffered states.'''
+        with self.lock:
+            row = self.connect().execute('SELECT * FROM runs WHERE id = ?', (run,)).fetchone()
+            if row is None:
+                return None
+            current = run == self.run
+            run = dict(row)
+            if current:
+                run.update(self.summary)
+        run['schedule'] = json.loads(run['schedule']) if run['schedule'] else None
+        return run
+
+    def samples(self, run, start=None, end=None, columns=None):
+        '''rows of run with start <= runtime <= end in runtime order, as
+        lists of columns (all of COLUMNS by default). rows are read as
+        they are iterated, each query on its own connection, so a long
+        window is never all in memory and recording goes on meanwhile.
+        states that are still buffered come last.'''
+        columns = columns or COLUMNS
+        for c in columns:
+            if c not in COLUMNS:
+                raise ValueError("unknown sample column %s" % c)
+        start = float('-inf') if start is None else start
+        end = float('inf') if end is None else end
+        sql = 'SELECT %s FROM samples WHERE run = ? AND runtime BETWEEN ? AND ? ORDER BY runtime' % ", ".join(columns)
+        positions = [COLUMNS.index(c) + 1 for c in columns]
+        runtime = COLUMNS.index('runtime') + 1
+        with self.lock:
+            self.connect()
+        reader = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            # the first row fixes what the query sees, take the buffered
+            # states at the same moment so none is missed or doubled
+            with self.lock:
+                cursor = reader.execute(sql, (run, start, end))
+                first = cursor.fetchone()
+                pending = [[row[p] for p in positions] for row in self.pending
+                    if row[0] == run and start <= row[runtime] <= end]
+            if first is not None:
+                yield list(first)
+                for row in cursor:
+                    yield list(row)
+            for row in pending:
+                yield row
+        finally:
+            reader.close()
+
+    def tier(self, run, start=None, end=None, points=1000):
+        '''seconds per row of the coarsest tier that still has points
+        values between start and end (0 for every state), among the tiers
+        run still has. a rollup row holds two, its lowest and highest.
+        see compact.'''
+        meta = self.get_run(run)
+        if meta is None:
+            return None
+        start = 0 if start is None else max(start, 0)
+        end = (meta['runtime'] or 0) if end is None else end
+        span = max(end - start, 0)
+        # pruned 1: states deleted, 2: 1 minute rollups deleted too
+        tiers = ([0] + ROLLUPS)[meta['pruned']:]
+        fitting = [width for width in tiers if width == 0 or width * points <= span * 2]
+        return fitting[-1] if fitting else tiers[0]
+
+    def window(self, run, start=None, end=None, points=1000, columns=None):
+        '''(seconds per row, rows) of run between start and end at the
+        tier picked by tier. rows are lists of columns, which may be any
+        of COLUMNS, count, or the _min and _max of RANGE_COLUMNS. for a
+        single state count is 1 and min and max are the value itself.
+        the part of a firing that is not rolled up yet is aggregated on
+        the fly.'''
+        width = self.tier(run, start, end, points)
+        if width is None:
+            return (None, iter([]))
+        columns = columns or ROLLUP_COLUMNS
+        for c in columns:
+            if c not in ROLLUP_COLUMNS:
+                raise ValueError("unknown history column %s" % c)
+        if width == 0:
+            raw = [c if c in COLUMNS else c.rsplit('_', 1)[0] for c in columns if c != 'count']
+            def rows():
+                for row in self.samples(run, start, end, raw):
+                    values = iter(row)
+                    yield [1 if c == 'count' else next(values) for c in columns]
+            return (0, rows())
+        return (width, self.rollups(run, width, start, end, columns))
+
+    def rollups(self, run, width, start, end, columns):
+        start = float('-inf') if start is None else start
+        end = float('inf') if end is None else end
+        meta = self.get_run(run)
+        done = meta['rolled_up'] or 0
+        # the row that start falls in
+        low = (start // width) * width if start > float('-inf') else start
+        select = ", ".join(columns)
+        reader = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            cursor = reader.execute('SELECT %s FROM rollup_%d WHERE run = ? AND bucket >= ? '
+                'AND bucket <= ? AND bucket < ? ORDER BY bucket' % (select, width),
+                (run, low, end, done))
+            for row in cursor:
+                yield list(row)
+            if meta['pruned'] == 0 and end >= done:
+                cursor = reader.execute('SELECT %s FROM (%s) WHERE bucket <= ? ORDER BY bucket' %
+                    (select, aggregate(width)), (run, max(low, done), float('inf'), end))
+                for row in cursor:
+                    yield list(row)
+        finally:
+            reader.close()
+
+    def compact(self, now=None):
+        '''roll the states of every run up into the rollup tiers, as far
+        as the rollup rows are complete, then delete the states of runs
+        that ended more than raw_days ago and the 1 minute rollups of runs
+        that ended more than minute_days ago. runs on its own connection,
+        one short transaction per run, so recording carries on.
+        inputs
+            config.history_raw_days
+            config.history_minute_days
+        '''
+        now = time.time() if now is None else now
+        largest = ROLLUPS[-1]
+        with self.lock:
+            self.connect()
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        try:
+            runs = db.execute('SELECT id, ended, rolled_up FROM runs WHERE rolled_up IS NULL '
+                'OR ended IS NULL OR rolled_up <= runtime').fetchall()
+            rolled = 0
+            for (run, ended, done) in runs:
+                last = db.execute('SELECT max(runtime) FROM samples WHERE run = ?', (run,)).fetchone()[0]
+                if last is None:
+                    continue
+                if ended is None and run == self.run:
+                    # only rows that can not get any more states
+                    boundary = (last // largest) * largest
+                else:
+                    # finished, or cut short by a power cut
+                    boundary = (last // largest + 1) * largest
+                done = done or 0
+                if boundary <= done:
+                    continue
+                with db:
+                    for width in ROLLUPS:
+                        db.execute('INSERT OR REPLACE INTO rollup_%d (run, bucket, %s) %s' %
+                            (width, ", ".join(ROLLUP_COLUMNS), aggregate(width)), (run, done, boundary))
+                    db.execute('UPDATE runs SET rolled_up = ? WHERE id = ?', (boundary, run))
+                rolled += 1
+
+            pruned = 0
+            for (level, days, table) in ((1, config.history_raw_days, 'samples'),
+                    (2, config.history_minute_days, 'rollup_%d' % ROLLUPS[0])):
+                if days is None:
+                    continue
+                old = db.execute('SELECT id FROM runs WHERE pruned < ? AND rolled_up > runtime '
+                    'AND coalesce(ended, started) < ? AND id IS NOT ?',
+                    (level, now - days * 86400, self.run)).fetchall()
+                for (run,) in old:
+                    with db:
+                        db.execute('DELETE FROM %s WHERE run = ?' % table, (run,))
+                        db.execute('UPDATE runs SET pruned = ? WHERE id = ?', (level, run))
+                    pruned += 1
+            if rolled or pruned:
+                log.info("history compacted: %d runs rolled up, %d tiers pruned" % (rolled, pruned))
+        finally:
+            db.close()
+
+class Compactor(threading.Thread):
+    '''compacts a FiringStore in the background every interval seconds,
+    starting interval seconds after it is created so a restarted firing
+    gets going first. see FiringStore.compact
+    inputs
+        config.history_compact_interval
+    '''
+    def __init__(self, store, interval=None):
+        self.store = store
+        self.interval = config.history_compact_interval if interval is None else interval
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.store.compact()
+            except Exception as e:
+                log.error("history compaction failed: %s" % e)
@@ -0,0 +1,150 @@
+import logging,json,csv,io,zlib,hashlib
+import config
+from downsample import minmax_buckets
+from firingStore import ROLLUP_COLUMNS
+log = logging.getLogger(__name__)
+
+# content type of each format of /api/history
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# columns sent when the client does not ask for some with columns=
+DEFAULT_COLUMNS = ['runtime', 'server_time', 'count', 'temperature',
+    'temperature_min', 'temperature_max', 'target', 'heat', 'catching_up',
+    'pid_out', 'pid_p', 'pid_i', 'pid_d']
+
+def number(value, name):
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError("%s must be a number of seconds, not %s" % (name, value))
+
+class HistoryExport(object):
+    '''One response of /api/history: a window of a stored firing, read
+    from the tier FiringStore.window picks for the span and thinned out
+    on the server with minmax_buckets to about points rows, so spikes
+    survive. Rows are read, downsampled, formatted and compressed as
+    they stream out, nothing holds the whole window.
+    run is the id of a run, by default the newest. start and end are
+    seconds of runtime, by default the whole firing.
+    inputs
+        config.history_points
+        config.history_max_points
+    '''
+    def __init__(self, store, run=None, start=None, end=None, points=None,
+            columns=None, format="ndjson"):
+        self.store = store
+        if run is None:
+            newest = store.runs(limit=1)
+            if not newest:
+                raise LookupError("no firings stored yet")
+            run = newest[0]['id']
+        self.meta = store.get_run(run)
+        if self.meta is None:
+            raise LookupError("no firing %s" % run)
+        self.run = run
+        self.start = start
+        self.end = end
+        if points is None:
+            points = config.history_points
+        self.points = min(max(int(points), 2), config.history_max_points)
+        self.columns = columns or DEFAULT_COLUMNS
+        for c in self.columns:
+            if c not in ROLLUP_COLUMNS:
+                raise ValueError("unknown history column %s, use %s" % (c, ", ".join(ROLLUP_COLUMNS)))
+        if format not in FORMATS:
+            raise ValueError("unknown history format %s, use %s" % (format, ", ".join(FORMATS)))
+        self.format = format
+        self.content_type = FORMATS[format]
+        # seconds per row of the tier read, 0 for every state
+        self.tier = store.tier(run, start, end, self.points)
+
+    @classmethod
+    def from_query(cls, store, query):
+        '''a HistoryExport for the query parameters of
+        /api/history?run=3&from=21600&to=28800&points=500&format=csv'''
+        run = query.get('run')
+        if run:
+            try:
+                run = int(run)
+            except ValueError:
+                raise ValueError("run must be the number of a firing, not %s" % run)
+        points = query.get('points')
+        if points:
+            try:
+                points = int(points)
+            except ValueError:
+                raise ValueError("points must be a number, not %s" % points)
+        columns = query.get('columns')
+        return cls(store, run or None, number(query.get('from'), 'from'),
+            number(query.get('to'), 'to'), points or None,
+            [c.strip() for c in columns.split(',')] if columns else None,
+            query.get('format') or "ndjson")
+
+    def etag(self, gzip=False):
+        '''changes whenever the response would, a finished firing keeps
+        its etag for good'''
+        key = json.dumps([self.run, self.start, self.end, self.points, self.columns,
+            self.format, gzip] + [self.meta.get(k) for k in
+            ('samples', 'runtime', 'rolled_up', 'pruned', 'ended')])
+        return '"%s"' % hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def rows(self):
+        '''the downsampled rows as lists of self.columns'''
+        # the downsampling needs these whatever the client asked for
+        wanted = list(self.columns)
+        for c in ('runtime', 'temperature_min', 'temperature_max'):
+            if c not in wanted:
+                wanted.append(c)
+        (tier, rows) = self.store.window(self.run, self.start, self.end,
+            self.points, wanted)
+        start = self.start if self.start is not None else 0
+        end = self.end if self.end is not None else (self.meta['runtime'] or 0)
+        # each bucket keeps two rows
+        kept = minmax_buckets(rows, start, end, max(self.points // 2, 1),
+            x=wanted.index('runtime'), low=wanted.index('temperature_min'),
+            high=wanted.index('temperature_max'))
+        n = len(self.columns)
+        for row in kept:
+            yield row[:n]
+
+    def lines(self):
+        '''the response as lines of text'''
+        rows = self.rows()
+        if self.format == "csv":
+            out = io.StringIO()
+            writer = csv.writer(out)
+            writer.writerow(self.columns)
+            for row in rows:
+                writer.writerow(row)
+                yield out.getvalue()
+                out.seek(0)
+                out.truncate()
+            return
+        header = {"type": "run", "tier": self.tier, "from": self.start, "to": self.end,
+            "columns": self.columns}
+        header.update((k, v) for (k, v) in self.meta.items() if k != 'schedule')
+        yield json.dumps(header, separators=(',', ':')) + "\n"
+        for row in rows:
+            yield json.dumps(dict(zip(self.columns, row)), separators=(',', ':')) + "\n"
+
+    def chunks(self, gzip=False, size=16384):
+        '''the response as chunks of about size bytes, gzipped if asked'''
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+        pending = []
+        length = 0
+        for line in self.lines():
+            pending.append(line)
+            length += len(line)
+            if length >= size:
+                chunk = "".join(pending).encode('utf-8')
+                (pending, length) = ([], 0)
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+        chunk = "".join(pending).encode('utf-8')
+        if compressor:
+            chunk = compressor.compress(chunk) + compressor.flush()
+        if chunk:
+            yield chunk
@@ -0,0 +1,153 @@
+import csv,logging
+import numpy
+import config
+from thermalModel import ThermalModel
+from oven import Integrator
+log = logging.getLogger(__name__)
+
+# fitted in log space, sim_p_heat is held fixed. scaling every heat
+# capacity and the power by k and both resistances by 1/k gives exactly
+# the same temperatures, so only four of the five can come from a log.
+FITTED = ['sim_c_heat', 'sim_c_oven', 'sim_R_o_nocool', 'sim_R_ho_noair']
+
+def read_log(filename, target=None):
+    '''read a firing recorded by kiln-logger.py or kiln-tuner.py.
+    returns numpy arrays of times (seconds from the first sample),
+    temperatures and the fraction of each interval the elements were
+    on, where duty[i] applies between sample i-1 and sample i.
+
+    kiln-logger.py csv: duty is pid_out, so it has to be logged with
+    --pidstats. the heat column is no substitute: a real kiln logs 1
+    whenever the elements were on at all in a cycle, the simulator the
+    seconds they were on. raises ValueError without pid_out. rows that
+    are not RUNNING count as off.
+    kiln-tuner.py csv: elements are on until the temperature first
+    passes target, then off.
+    '''
+    times = []
+    temps = []
+    duty = []
+    heating = True
+    with open(filename) as f:
+        reader = csv.DictReader(f)
+        fields = reader.fieldnames or []
+        if 'stamp' in fields and 'pid_out' not in fields:
+            raise ValueError("%s has no pid_out column, log the firing with "
+                "kiln-logger.py --pidstats" % filename)
+        for row in reader:
+            try:
+                stamp = float(row.get('stamp') or row.get('time'))
+                temp = float(row['temperature'])
+            except (TypeError, ValueError):
+                continue  # just ignore bad values!
+
+            if 'time' in row and 'stamp' not in row:
+                # kiln-tuner.py tuning.csv
+                on = 1.0 if heating else 0.0
+                if target is not None and temp > target:
+                    heating = False
+            elif row.get('state', 'RUNNING') != 'RUNNING':
+                on = 0.0
+            else:
+                try:
+                    on = float(row['pid_out'])
+                except (TypeError, ValueError):
+                    continue
+
+            times.append(stamp)
+            temps.append(temp)
+            duty.append(min(max(on, 0.0), 1.0))
+
+    times = numpy.array(times)
+    return (times - times[0], numpy.array(temps), numpy.array(duty))
+
+def predict(params, times, temps, duty, t_env, p_heat):
+    '''simulate every parameter set (a dict of arrays) against the
+    recorded duty. returns predicted temperatures of shape (len(times), n).
+    '''
+    n = len(params['sim_c_heat'])
+    model = ThermalModel(n, t_env=t_env, c_heat=params['sim_c_heat'],
+        c_oven=params['sim_c_oven'], p_heat=p_heat, R_o=params['sim_R_o_nocool'],
+        R_ho=params['sim_R_ho_noair'], integrator=Integrator("exact"))
+    # assume the kiln was sitting at its first reading
+    model.t[:] = temps[0]
+    model.t_h[:] = temps[0]
+    out = numpy.empty((len(times), n))
+    out[0] = temps[0]
+    for i in range(1, len(times)):
+        out[i] = model.step(duty[i], times[i] - times[i - 1])
+    return out
+
+def as_params(logs):
+    '''(n, 4) array of log parameters -> dict of arrays'''
+    values = numpy.exp(numpy.atleast_2d(logs))
+    return {name: values[:, i] for (i, name) in enumerate(FITTED)}
+
+def fit(times, temps, duty, t_env=None, p_heat=None, population=128, rounds=8,
+        iterations=30, seed=None):
+    '''least squares fit of the model to a recorded firing. a cross
+    entropy search over population parameter sets at a time finds the
+    neighbourhood, then Levenberg-Marquardt with a finite difference
+    jacobian (all perturbed sets simulated in one pass) polishes it.
+    returns (dict of fitted config settings, rms error in degrees).
+    inputs
+        config.sim_t_env
+        config.kw_elements
+    '''
+    t_env = config.sim_t_env if t_env is None else t_env
+    p_heat = config.kw_elements * 1000 if p_heat is None else p_heat
+    rng = numpy.random.default_rng(seed)
+
+    def sse(logs):
+        predicted = predict(as_params(logs), times, temps, duty, t_env, p_heat)
+        return ((predicted - temps[:, None]) ** 2).sum(axis=0)
+
+    # start from config.py, up to ten times either way
+    best = numpy.log([getattr(config, name) for name in FITTED])
+    mean = best
+    sigma = numpy.full(len(FITTED), numpy.log(10) / 2)
+    best_sse = sse(best)[0]
+    for r in range(rounds):
+        logs = rng.normal(mean, sigma, size=(population, len(FITTED)))
+        logs[0] = best
+        scores = sse(logs)
+        order = numpy.argsort(scores)
+        if scores[order[0]] < best_sse:
+            (best, best_sse) = (logs[order[0]], scores[order[0]])
+        elite = logs[order[:max(population // 8, 2)]]
+        mean = elite.mean(axis=0)
+        sigma = numpy.maximum(elite.std(axis=0), 0.01)
+        log.info("search round %d: rms %.3f" % (r + 1, numpy.sqrt(best_sse / len(temps))))
+
+    h = 1e-4
+    damping = 1e-3
+    for i in range(iterations):
+        logs = numpy.vstack([best, best + h * numpy.eye(len(FITTED))])
+        predicted = predict(as_params(logs), times, temps, duty, t_env, p_heat)
+        residual = predicted[:, 0] - temps
+        jacobian = (predicted[:, 1:] - predicted[:, :1]) / h
+        jtj = jacobian.T @ jacobian
+        gradient = jacobian.T @ residual
+        improved = False
+        while damping < 1e10:
+            try:
+                step = numpy.linalg.solve(jtj + damping * numpy.diag(numpy.diag(jtj) + 1e-12), -gradient)
+            except numpy.linalg.LinAlgError:
+                damping *= 10
+                continue
+            candidate_sse = sse(best + step)[0]
+            if candidate_sse < best_sse:
+                (best, best_sse) = (best + step, candidate_sse)
+                damping = max(damping / 10, 1e-9)
+                improved = True
+                break
+            damping *= 10
+        if not improved or numpy.abs(step).max() < 1e-6:
+            break
+    rms = float(numpy.sqrt(best_sse / len(temps)))
+    log.info("least squares: rms %.3f" % rms)
+
+    fitted = {name: float(value[0]) for (name, value) in as_params(best).items()}
+    fitted['sim_t_env'] = float(t_env)
+    fitted['sim_p_heat'] = float(p_heat)
+    return (fitted, rms)
@@ -9,6 +9,17 @@ import digitalio
 import busio
 import adafruit_bitbangio as bitbangio
 import statistics
+import bisect
+import math
+import hashlib
+from checkpoint import Checkpoint
+
+try:
+    import numpy
+except ImportError:
+    # numpy is optional, Profile.sample and Integrator fall back to
+    # pure python
+    numpy = None
 
 log = logging.getLogger(__name__)
 
@@ -323,14 +334,50 @@ class Max31856(TempSensorReal):
                 raise Max31856_Error(k)
         return temp
 
+class Clock(object):
+    '''Wall clock. The oven and PID get the time and sleep through a
+    clock so a simulation can swap in a VirtualClock.
+    '''
+    def now(self):
+        return datetime.datetime.now()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+class VirtualClock(Clock):
+    '''Clock for headless simulations. Time only moves when something
+    sleeps, so a simulation runs as fast as the cpu allows and gives the
+    same result every time.
+    '''
+    def __init__(self, start=datetime.datetime(2000, 1, 1)):
+        self.current = start
+
+    def now(self):
+        return self.current
+
+    def sleep(self, seconds):
+        self.current += datetime.timedelta(seconds=seconds)
+
 class Oven(threading.Thread):
     '''parent oven class. this has all the common code
        for either a real or simulated oven'''
+
+    # subclasses may replace this before calling __init__
+    clock = Clock()
+
+    # gains found by the last relay autotune, see run_autotune
+    autotune_result = None
+
+    # False for an oven that is not the controller's, like the tuner's:
+    # it neither writes the state file nor restarts a firing from it
+    automatic_restarts = True
+
     def __init__(self):
         threading.Thread.__init__(self)
         self.daemon = True
         self.temperature = 0
         self.time_step = config.sensor_time_wait
+        self.checkpoint = Checkpoint()
         self.reset()
 
     def reset(self):
@@ -344,8 +391,10 @@ class Oven(threading.Thread):
         self.heat = 0
         self.heat_rate = 0
         self.heat_rate_temps = []
-        self.pid = PID(ki=config.pid_ki, kd=config.pid_kd, kp=config.pid_kp)
+        self.pid = PID(ki=config.pid_ki, kd=config.pid_kd, kp=config.pid_kp,
+                       clock=self.clock)
         self.catching_up = False
+        self.autotune = None
 
     @staticmethod
     def get_start_from_temperature(profile, temp):
@@ -387,7 +436,7 @@ class Oven(threading.Thread):
         self.reset()
         self.startat = startat * 60
         self.runtime = runtime
-        self.start_time = datetime.datetime.now() - datetime.timedelta(seconds=self.startat)
+        self.start_time = self.clock.now() - datetime.timedelta(seconds=self.startat)
         self.profile = profile
         self.totaltime = profile.get_duration()
         self.state = "RUNNING"
@@ -396,10 +445,62 @@ class Oven(threading.Thread):
 
     def abort_run(self):
         self.reset()
-        self.save_automatic_restart_state()
+        self.save_automatic_restart_state(force=True)
+
+    def run_autotune(self, setpoint):
+        '''heat to setpoint and tune the pid with a relay oscillation
+        around it. see RelayAutotune. the gains end up in
+        self.autotune_result and in get_state. raises ValueError, and
+        leaves the oven alone, unless it is idle and setpoint is a
+        number between the kiln's temperature now and the emergency
+        shutoff.
+        inputs
+            config.autotune_timeout
+            config.emergency_shutoff_temp
+        '''
+        if self.state != "IDLE":
+            raise ValueError("can not autotune while the kiln is %s" % self.state)
+        try:
+            setpoint = float(setpoint)
+        except (TypeError, ValueError):
+            raise ValueError("autotune temperature must be a number, not %s" % setpoint)
+        temp = self.board.temp_sensor.temperature() + config.thermocouple_offset
+        if not math.isfinite(setpoint) or setpoint <= temp:
+            raise ValueError("autotune temperature %s must be above the kiln temperature %.0f" %
+                (setpoint, temp))
+        if setpoint >= config.emergency_shutoff_temp:
+            raise ValueError("autotune temperature %s must be below emergency_shutoff_temp %s" %
+                (setpoint, config.emergency_shutoff_temp))
+        self.reset()
+        self.autotune = RelayAutotune(setpoint)
+        self.target = setpoint
+        self.totaltime = config.autotune_timeout * 60
+        self.start_time = self.clock.now()
+        self.state = "AUTOTUNE"
+        log.info("autotune started at %.0f degrees" % setpoint)
+
+    def autotune_step(self):
+        '''one time_step of a relay autotune'''
+        self.update_cost()
+        self.update_runtime()
+        temp = self.board.temp_sensor.temperature() + config.thermocouple_offset
+        self.apply_output(self.autotune.update(self.runtime, temp))
+        self.reset_if_emergency()
+        if self.autotune is None:
+            return
+        if self.autotune.done():
+            result = self.autotune.result()
+            log.info("autotune finished: pid_kp = %s, pid_ki = %s, pid_kd = %s" %
+                (result['kp'], result['ki'], result['kd']))
+            self.reset()
+            self.autotune_result = result
+            return
+        if self.runtime > self.totaltime:
+            log.error("autotune did not settle within %d minutes, giving up" % config.autotune_timeout)
+            self.abort_run()
 
     def get_start_time(self):
-        return datetime.datetime.now() - datetime.timedelta(milliseconds = self.runtime * 1000)
+        return self.clock.now() - datetime.timedelta(milliseconds = self.runtime * 1000)
 
     def kiln_must_catch_up(self):
         '''shift the whole schedule forward in time by one time_step
@@ -423,7 +524,7 @@ class Oven(threading.Thread):
 
     def update_runtime(self):
 
-        runtime_delta = datetime.datetime.now() - self.start_time
+        runtime_delta = self.clock.now() - self.start_time
         if runtime_delta.total_seconds() < 0:
             runtime_delta = datetime.timedelta(0)
 
@@ -483,12 +584,36 @@ class Oven(threading.Thread):
             'profile': self.profile.name if self.profile else None,
             'pidstats': self.pid.pidstats,
             'catching_up': self.catching_up,
+            'autotune': self.autotune.stats() if self.autotune else self.autotune_result,
         }
         return state
 
-    def save_state(self):
-        with open(config.automatic_restart_state_file, 'w', encoding='utf-8') as f:
-            json.dump(self.get_state(), f, ensure_ascii=False, indent=4)
+    def control_state(self):
+        '''everything needed to carry on a firing after a restart exactly
+        where it stopped, see resume. besides the basics of get_state it
+        holds the profile as it was running (with a hash to check it), the
+        pid integrator and last error, and the heat rate window. pidstats
+        and the like are left out, so it stays small and quick to load.
+        '''
+        state = self.get_state()
+        checkpoint = {k: state[k] for k in ('state', 'runtime', 'temperature',
+            'target', 'cost', 'heat_rate', 'totaltime', 'profile', 'catching_up')}
+        if self.profile:
+            checkpoint['schedule'] = self.profile.as_dict()
+            checkpoint['schedule_hash'] = self.profile.digest()
+        checkpoint['pid'] = [self.pid.iterm, self.pid.lastErr]
+        # flat list of runtime, temperature pairs
+        checkpoint['heat_rate_temps'] = [v for pair in self.heat_rate_temps for v in pair]
+        return checkpoint
+
+    def save_state(self, force=False):
+        '''checkpoint the state, see Checkpoint. a change of state, like
+        the start or end of a firing, is written right away.'''
+        state = self.control_state()
+        last = self.checkpoint.data
+        if last is None or last.get('state') != state['state']:
+            force = True
+        return self.checkpoint.write(state, force)
 
     def state_file_is_old(self):
         '''returns True is state files is older than 15 mins default
@@ -503,41 +628,67 @@ class Oven(threading.Thread):
                 return False
         return True
 
-    def save_automatic_restart_state(self):
+    def save_automatic_restart_state(self, force=False):
         # only save state if the feature is enabled
-        if not config.automatic_restarts == True:
+        if not config.automatic_restarts == True or not self.automatic_restarts:
             return False
-        self.save_state()
+        return self.save_state(force)
 
     def should_i_automatic_restart(self):
         # only automatic restart if the feature is enabled
-        if not config.automatic_restarts == True:
+        if not config.automatic_restarts == True or not self.automatic_restarts:
             return False
         if self.state_file_is_old():
             duplog.info("automatic restart not possible. state file does not exist or is too old.")
             return False
 
-        with open(config.automatic_restart_state_file) as infile:
-            d = json.load(infile)
-        if d["state"] != "RUNNING":
-            duplog.info("automatic restart not possible. state = %s" % (d["state"]))
+        d = self.checkpoint.read()
+        if d is None:
+            duplog.info("automatic restart not possible. state file cannot be read.")
+            return False
+        if d.get("state") != "RUNNING":
+            duplog.info("automatic restart not possible. state = %s" % (d.get("state")))
             return False
         return True
 
     def automatic_restart(self):
-        with open(config.automatic_restart_state_file) as infile: d = json.load(infile)
-        startat = d["runtime"]/60
-        filename = "%s.json" % (d["profile"])
-        profile_path = os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'storage','profiles',filename))
+        d = self.checkpoint.read()
+        profile = self.checkpointed_profile(d)
+        log.info("automatically restarting profile = %s at minute = %d" % (profile.name,d["runtime"]/60))
+        self.resume(d, profile)
+        self.clock.sleep(1)
+        self.ovenwatcher.record(profile)
 
-        log.info("automatically restarting profile = %s at minute = %d" % (profile_path,startat))
+    def checkpointed_profile(self, checkpoint):
+        '''the profile a checkpoint was running. that is the copy in the
+        checkpoint if its hash matches, else the profile file of the same
+        name, which may have been edited since.'''
+        schedule = checkpoint.get("schedule")
+        if schedule:
+            profile = Profile(json.dumps(schedule))
+            if profile.digest() == checkpoint.get("schedule_hash"):
+                return profile
+            log.error("profile in the state file does not match its hash, reading it from disk")
+        filename = "%s.json" % (checkpoint["profile"])
+        profile_path = os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'storage','profiles',filename))
         with open(profile_path) as infile:
             profile_json = json.dumps(json.load(infile))
-        profile = Profile(profile_json)
-        self.run_profile(profile, startat=startat, allow_seek=False)  # We don't want a seek on an auto restart.
-        self.cost = d["cost"]
-        time.sleep(1)
-        self.ovenwatcher.record(profile)
+        return Profile(profile_json)
+
+    def resume(self, checkpoint, profile):
+        '''carry on the firing saved by control_state. the pid picks up
+        with the same integrator and error, so the elements get the same
+        power they had before the restart instead of starting over.'''
+        # We don't want a seek on an auto restart.
+        self.run_profile(profile, startat=checkpoint["runtime"]/60, allow_seek=False)
+        self.cost = checkpoint["cost"]
+        if "pid" in checkpoint:
+            (iterm, lastErr) = checkpoint["pid"]
+            self.pid.restore(iterm, lastErr, self.time_step)
+        temps = checkpoint.get("heat_rate_temps") or []
+        self.heat_rate_temps = list(zip(temps[0::2], temps[1::2]))
+        self.heat_rate = checkpoint.get("heat_rate", 0)
+        self.catching_up = checkpoint.get("catching_up", False)
 
     def set_ovenwatcher(self,watcher):
         log.info("ovenwatcher set in oven class")
@@ -549,7 +700,7 @@ class Oven(threading.Thread):
             if self.state == "IDLE":
                 if self.should_i_automatic_restart() == True:
                     self.automatic_restart()
-                time.sleep(1)
+                self.clock.sleep(1)
                 continue
             if self.state == "PAUSED":
                 self.start_time = self.get_start_time()
@@ -560,18 +711,254 @@ class Oven(threading.Thread):
                 self.reset_if_schedule_ended()
                 continue
             if self.state == "RUNNING":
-                self.update_cost()
-                self.save_automatic_restart_state()
-                self.kiln_must_catch_up()
-                self.update_runtime()
-                self.update_target_temp()
-                self.heat_then_cool()
-                self.reset_if_emergency()
-                self.reset_if_schedule_ended()
+                self.step()
+                continue
+            if self.state == "AUTOTUNE":
+                self.autotune_step()
 
-class SimulatedOven(Oven):
+    def step(self):
+        '''one time_step of a running schedule'''
+        self.update_cost()
+        self.save_automatic_restart_state()
+        self.kiln_must_catch_up()
+        self.update_runtime()
+        self.update_target_temp()
+        self.heat_then_cool()
+        self.reset_if_emergency()
+        self.reset_if_schedule_ended()
+
+class RelayAutotune(object):
+    '''Relay feedback autotune (Astrom and Hagglund). The elements are
+    switched fully on below setpoint - hysteresis and fully off above
+    setpoint + hysteresis, which makes the kiln oscillate around the
+    setpoint. The period of that oscillation is the ultimate period Pu
+    and its amplitude gives the ultimate gain Ku. Ziegler-Nichols rules
+    turn those into gains. The first cycle, heating up from cold, is
+    ignored.
+    inputs
+        config.autotune_hysteresis
+        config.autotune_cycles
+    '''
+    window_size = 100
+
+    def __init__(self, setpoint, hysteresis=None, cycles=None):
+        self.setpoint = setpoint
+        self.hysteresis = config.autotune_hysteresis if hysteresis is None else hysteresis
+        self.cycles = config.autotune_cycles if cycles is None else cycles
+        self.heating = True
+        # (start, period, max, min) of each cycle, switch on to switch on
+        self.completed = []
+        self.cycle_start = None
+        self.high = None
+        self.low = None
+
+    def update(self, now, temp):
+        '''now in seconds, returns the element output 0 or 1'''
+        if self.high is not None:
+            self.high = max(self.high, temp)
+            self.low = min(self.low, temp)
+
+        if self.heating and temp > self.setpoint + self.hysteresis:
+            self.heating = False
+        elif not self.heating and temp < self.setpoint - self.hysteresis:
+            self.heating = True
+            if self.cycle_start is not None:
+                self.completed.append((self.cycle_start, now - self.cycle_start,
+                    self.high, self.low))
+            self.cycle_start = now
+            self.high = temp
+            self.low = temp
+
+        if self.heating:
+            return 1.0
+        return 0.0
+
+    def done(self):
+        # the first completed cycle still carries the heat up
+        return len(self.completed) > self.cycles
+
+    def stats(self):
+        return {
+            'setpoint': self.setpoint,
+            'cycles': max(len(self.completed) - 1, 0),
+            'wanted': self.cycles,
+        }
 
-    def __init__(self):
+    def result(self):
+        cycles = self.completed[1:]
+        pu = sum(c[1] for c in cycles) / len(cycles)
+        a = sum((c[2] - c[3]) / 2 for c in cycles) / len(cycles)
+        # relay swings the output from 0 to window_size
+        d = self.window_size / 2
+        ku = 4 * d / (math.pi * math.sqrt(max(a * a - self.hysteresis * self.hysteresis, 1e-6)))
+
+        # Magic Ziegler-Nicols constants ahead!
+        kp = 0.6 * ku
+        ti = pu / 2
+        td = pu / 8
+        return {
+            'ku': ku,
+            'pu': pu,
+            'amplitude': a,
+            'kp': kp,
+            # pid_ki is inverted, see config.py
+            'ki': ti / kp,
+            'kd': kp * td,
+        }
+
+INTEGRATORS = ["euler", "substep", "rk4", "exact"]
+
+def math_functions(x):
+    '''exp and sqrt that work on x, a float or a numpy array'''
+    if numpy is not None and isinstance(x, numpy.ndarray):
+        return (numpy.exp, numpy.sqrt)
+    return (math.exp, math.sqrt)
+
+def largest_abs(x):
+    if numpy is not None and isinstance(x, numpy.ndarray):
+        return float(numpy.max(numpy.abs(x))) if x.size else 0.0
+    return abs(x)
+
+class Integrator(object):
+    '''Advances the two node heater/oven model used by SimulatedOven and
+    ThermalModel by one time step with the elements delivering a fixed
+    power. Everything works on floats or on numpy arrays with one value
+    per kiln.
+
+      c_heat * dt_h/dt = power - (t_h - t) / R_ho
+      c_oven * dt/dt   = (t_h - t) / R_ho - (t - t_env) / R_o
+
+    methods
+        euler   - one explicit step, the original simulator. Results
+                  depend on the step size.
+        substep - explicit steps, split until halving the sub-step
+                  changes the result by less than the tolerance
+        rk4     - fourth order Runge-Kutta with the same error control
+        exact   - closed form solution of the linear model. The same
+                  result for any step size.
+    inputs
+        config.sim_integrator
+        config.sim_integrator_tolerance
+    '''
+    max_substeps = 4096
+
+    def __init__(self, method=None, tolerance=None):
+        self.method = method or config.sim_integrator
+        if self.method not in INTEGRATORS:
+            raise ValueError("unknown sim_integrator %s, use one of %s" %
+                (self.method, ", ".join(INTEGRATORS)))
+        self.tolerance = tolerance or config.sim_integrator_tolerance
+        # sub-steps used last time, the next step starts from here
+        self.substeps = 1
+
+    def step(self, t_h, t, power, dt, c_heat, c_oven, R_ho, R_o, t_env):
+        '''returns (t_h, t) after dt seconds'''
+        args = (power, c_heat, c_oven, R_ho, R_o, t_env)
+        if self.method == "euler":
+            return self.euler(t_h, t, dt, *args)
+        if self.method == "exact":
+            return self.exact(t_h, t, dt, *args)
+        if self.method == "substep":
+            return self.controlled(self.explicit, t_h, t, dt, args)
+        return self.controlled(self.rk4, t_h, t, dt, args)
+
+    @staticmethod
+    def euler(t_h, t, dt, power, c_heat, c_oven, R_ho, R_o, t_env):
+        # heat the element, then move heat element -> oven -> environment
+        t_h = t_h + power * dt / c_heat
+        p_ho = (t_h - t) / R_ho
+        t = t + p_ho * dt / c_oven
+        t_h = t_h - p_ho * dt / c_heat
+        p_env = (t - t_env) / R_o
+        t = t - p_env * dt / c_oven
+        return (t_h, t)
+
+    @staticmethod
+    def derivatives(t_h, t, power, c_heat, c_oven, R_ho, R_o, t_env):
+        p_ho = (t_h - t) / R_ho
+        return ((power - p_ho) / c_heat,
+                (p_ho - (t - t_env) / R_o) / c_oven)
+
+    def explicit(self, t_h, t, dt, args):
+        (d_h, d_o) = self.derivatives(t_h, t, *args)
+        return (t_h + d_h * dt, t + d_o * dt)
+
+    def rk4(self, t_h, t, dt, args):
+        (k1h, k1o) = self.derivatives(t_h, t, *args)
+        (k2h, k2o) = self.derivatives(t_h + k1h * dt / 2, t + k1o * dt / 2, *args)
+        (k3h, k3o) = self.derivatives(t_h + k2h * dt / 2, t + k2o * dt / 2, *args)
+        (k4h, k4o) = self.derivatives(t_h + k3h * dt, t + k3o * dt, *args)
+        return (t_h + (k1h + 2 * k2h + 2 * k3h + k4h) * dt / 6,
+                t + (k1o + 2 * k2o + 2 * k3o + k4o) * dt / 6)
+
+    def substeps_of(self, method, t_h, t, dt, n, args):
+        for i in range(n):
+            (t_h, t) = method(t_h, t, dt / n, args)
+        return (t_h, t)
+
+    def controlled(self, method, t_h, t, dt, args):
+        '''step doubling. compare n sub-steps with 2n and keep doubling
+        until they agree to within the tolerance. the count carries over
+        to the next call and is halved again when it is more than needed.
+        '''
+        n = self.substeps
+        coarse = self.substeps_of(method, t_h, t, dt, n, args)
+        while True:
+            fine = self.substeps_of(method, t_h, t, dt, n * 2, args)
+            error = max(largest_abs(fine[0] - coarse[0]), largest_abs(fine[1] - coarse[1]))
+            if error <= self.tolerance or n * 2 >= self.max_substeps:
+                break
+            n = n * 2
+            coarse = fine
+        if error > self.tolerance:
+            log.warning("simulation error %.3g above tolerance with %d sub-steps" % (error, n * 2))
+        if error < self.tolerance / 16 and n > 1:
+            n = n // 2
+        self.substeps = n
+        return fine
+
+    @staticmethod
+    def exact(t_h, t, dt, power, c_heat, c_oven, R_ho, R_o, t_env):
+        # the model is x' = A x + b. with power held for the whole step
+        # x(dt) = x_ss + exp(A dt) (x(0) - x_ss), where x_ss is the steady
+        # state. A is 2x2 with real, distinct, negative eigenvalues, so
+        # exp(A dt) = c0 I + c1 A.
+        a11 = -1 / (c_heat * R_ho)
+        a12 = 1 / (c_heat * R_ho)
+        a21 = 1 / (c_oven * R_ho)
+        a22 = -(1 / R_ho + 1 / R_o) / c_oven
+        b1 = power / c_heat
+        b2 = t_env / (c_oven * R_o)
+
+        det = a11 * a22 - a12 * a21
+        ss_h = (a12 * b2 - a22 * b1) / det
+        ss_o = (a21 * b1 - a11 * b2) / det
+
+        (exp, sqrt) = math_functions(a11 + a22 + b1 + t_h)
+        half = (a11 + a22) / 2
+        disc = sqrt((a11 - a22) * (a11 - a22) / 4 + a12 * a21)
+        l1 = half + disc
+        l2 = half - disc
+        e1 = exp(l1 * dt)
+        e2 = exp(l2 * dt)
+        c1 = (e1 - e2) / (l1 - l2)
+        c0 = (l1 * e2 - l2 * e1) / (l1 - l2)
+
+        d_h = t_h - ss_h
+        d_o = t - ss_o
+        return (ss_h + c0 * d_h + c1 * (a11 * d_h + a12 * d_o),
+                ss_o + c0 * d_o + c1 * (a21 * d_h + a22 * d_o))
+
+class SimulatedOven(Oven):
+    '''simulated kiln. by default it runs in its own thread on the wall
+    clock, sped up by config.sim_speedup_factor. headless ovens have no
+    thread, do not write the automatic restart file and are driven by
+    run_headless, usually with a VirtualClock.
+    '''
+    def __init__(self, clock=None, headless=False):
+        if clock:
+            self.clock = clock
+        self.headless = headless
         self.board = SimulatedBoard()
         self.t_env = config.sim_t_env
         self.c_heat = config.sim_c_heat
@@ -580,7 +967,11 @@ class SimulatedOven(Oven):
         self.R_o_nocool = config.sim_R_o_nocool
         self.R_ho_noair = config.sim_R_ho_noair
         self.R_ho = self.R_ho_noair
+        self.integrator = Integrator()
         self.speedup_factor = config.sim_speedup_factor
+        if isinstance(self.clock, VirtualClock):
+            # virtual time is simulated time, nothing to speed up
+            self.speedup_factor = 1
 
         # set temps to the temp of the surrounding environment
         self.t = config.sim_t_env  # deg C or F temp of oven
@@ -590,16 +981,46 @@ class SimulatedOven(Oven):
 
         self.start_time = self.get_start_time();
 
+        if headless:
+            return
+
         # start thread
         self.start()
         log.info("SimulatedOven started")
 
+    def save_automatic_restart_state(self, force=False):
+        if self.headless:
+            return False
+        return super().save_automatic_restart_state(force)
+
+    def run_headless(self, profile, startat=0, allow_seek=True, timeout=None):
+        '''run profile from start to finish without sleeping in real
+        time. returns the list of get_state() dicts, one per time_step,
+        just like the OvenWatcher would have recorded them. gives up if
+        the kiln has not finished after timeout simulated seconds, by
+        default ten times the length of the schedule.
+        '''
+        self.run_profile(profile, startat=startat, allow_seek=allow_seek)
+        if timeout is None:
+            timeout = self.totaltime * 10
+        started = self.clock.now()
+        trace = [self.get_state()]
+        while self.state == "RUNNING":
+            self.step()
+            if self.state != "RUNNING":
+                break
+            trace.append(self.get_state())
+            if (self.clock.now() - started).total_seconds() > timeout:
+                log.error("simulation of %s timed out after %ds" % (profile.name, timeout))
+                self.abort_run()
+        return trace
+
     # runtime is in sped up time, start_time is actual time of day
     def get_start_time(self):
-        return datetime.datetime.now() - datetime.timedelta(milliseconds = self.runtime * 1000 / self.speedup_factor)
+        return self.clock.now() - datetime.timedelta(milliseconds = self.runtime * 1000 / self.speedup_factor)
 
     def update_runtime(self):
-        runtime_delta = datetime.datetime.now() - self.start_time
+        runtime_delta = self.clock.now() - self.start_time
         if runtime_delta.total_seconds() < 0:
             runtime_delta = datetime.timedelta(0)
 
@@ -614,19 +1035,13 @@ class SimulatedOven(Oven):
         self.Q_h = self.p_heat * self.time_step * pid
 
     def temp_changes(self):
-        #temperature change of heat element by heating
-        self.t_h += self.Q_h / self.c_heat
+        (self.t_h, self.t) = self.integrator.step(self.t_h, self.t,
+            self.Q_h / self.time_step, self.time_step, self.c_heat,
+            self.c_oven, self.R_ho, self.R_o_nocool, self.t_env)
 
-        #energy flux heat_el -> oven
+        #energy flux heat_el -> oven and oven -> environment, for the logs
         self.p_ho = (self.t_h - self.t) / self.R_ho
-
-        #temperature change of oven and heating element
-        self.t += self.p_ho * self.time_step / self.c_oven
-        self.t_h -= self.p_ho * self.time_step / self.c_heat
-
-        #temperature change of oven by cooling to environment
         self.p_env = (self.t - self.t_env) / self.R_o_nocool
-        self.t -= self.p_env * self.time_step / self.c_oven
         self.temperature = self.t
         self.board.temp_sensor.simulated_temperature = self.t
 
@@ -636,28 +1051,13 @@ class SimulatedOven(Oven):
                                self.board.temp_sensor.temperature() +
                                config.thermocouple_offset, now_simulator)
 
-        heat_on = float(self.time_step * pid)
-        heat_off = float(self.time_step * (1 - pid))
-
-        self.heating_energy(pid)
-        self.temp_changes()
-
-        # self.heat is for the front end to display if the heat is on
-        self.heat = 0.0
-        if heat_on > 0:
-            self.heat = heat_on
-
-        log.info("simulation: -> %dW heater: %.0f -> %dW oven: %.0f -> %dW env" % (int(self.p_heat * pid),
-            self.t_h,
-            int(self.p_ho),
-            self.t,
-            int(self.p_env)))
+        (heat_on, heat_off) = self.apply_output(pid)
 
         time_left = self.totaltime - self.runtime
 
         try:
-            log.info("temp=%.2f, target=%.2f, error=%.2f, pid=%.2f, p=%.2f, i=%.2f, d=%.2f, heat_on=%.2f, heat_off=%.2f, run_time=%d, total_time=%d, time_left=%d" %
-                (self.pid.pidstats['ispoint'],
+            log.info("temp=%.2f, target=%.2f, error=%.2f, pid=%.2f, p=%.2f, i=%.2f, d=%.2f, heat_on=%.2f, heat_off=%.2f, run_time=%d, total_time=%d, time_left=%d",
+                self.pid.pidstats['ispoint'],
                 self.pid.pidstats['setpoint'],
                 self.pid.pidstats['err'],
                 self.pid.pidstats['pid'],
@@ -668,18 +1068,41 @@ class SimulatedOven(Oven):
                 heat_off,
                 self.runtime,
                 self.totaltime,
-                time_left))
+                time_left)
         except KeyError:
             pass
 
+    def apply_output(self, pid):
+        '''run the elements for the fraction pid of one time_step'''
+        heat_on = float(self.time_step * pid)
+        heat_off = float(self.time_step * (1 - pid))
+
+        self.heating_energy(pid)
+        self.temp_changes()
+
+        # self.heat is for the front end to display if the heat is on
+        self.heat = 0.0
+        if heat_on > 0:
+            self.heat = heat_on
+
+        # logging args are passed separately so headless runs with
+        # logging turned down do not pay for formatting
+        log.info("simulation: -> %dW heater: %.0f -> %dW oven: %.0f -> %dW env", int(self.p_heat * pid),
+            self.t_h,
+            int(self.p_ho),
+            self.t,
+            int(self.p_env))
+
         # we don't actually spend time heating & cooling during
         # a simulation, so sleep.
-        time.sleep(self.time_step / self.speedup_factor)
+        self.clock.sleep(self.time_step / self.speedup_factor)
+        return (heat_on, heat_off)
 
 
 class RealOven(Oven):
 
-    def __init__(self):
+    def __init__(self, automatic_restarts=True):
+        self.automatic_restarts = automatic_restarts
         self.board = RealBoard()
         self.output = Output()
         self.reset()
@@ -697,20 +1120,10 @@ class RealOven(Oven):
     def heat_then_cool(self):
         pid = self.pid.compute(self.target,
                                self.board.temp_sensor.temperature() +
-                               config.thermocouple_offset, datetime.datetime.now())
-
-        heat_on = float(self.time_step * pid)
-        heat_off = float(self.time_step * (1 - pid))
+                               config.thermocouple_offset, self.clock.now())
 
-        # self.heat is for the front end to display if the heat is on
-        self.heat = 0.0
-        if heat_on > 0:
-            self.heat = 1.0
+        (heat_on, heat_off) = self.apply_output(pid)
 
-        if heat_on:
-            self.output.heat(heat_on)
-        if heat_off:
-            self.output.cool(heat_off)
         time_left = self.totaltime - self.runtime
         try:
             log.info("temp=%.2f, target=%.2f, error=%.2f, pid=%.2f, p=%.2f, i=%.2f, d=%.2f, heat_on=%.2f, heat_off=%.2f, run_time=%d, total_time=%d, time_left=%d" %
@@ -729,14 +1142,99 @@ class RealOven(Oven):
         except KeyError:
             pass
 
+    def apply_output(self, pid):
+        '''run the elements for the fraction pid of one time_step'''
+        heat_on = float(self.time_step * pid)
+        heat_off = float(self.time_step * (1 - pid))
+
+        # self.heat is for the front end to display if the heat is on
+        self.heat = 0.0
+        if heat_on > 0:
+            self.heat = 1.0
+
+        if heat_on:
+            self.output.heat(heat_on)
+        if heat_off:
+            self.output.cool(heat_off)
+        return (heat_on, heat_off)
+
 class Profile():
     def __init__(self, json_data):
         obj = json.loads(json_data)
         self.name = obj["name"]
         self.data = sorted(obj["data"])
+        # profiles handed to the oven are already in config.temp_scale
+        # unless they say otherwise
+        self.temp_units = obj.get("temp_units", config.temp_scale).lower()
+        self.compile()
+
+    def compile(self):
+        '''build a segment table from the profile points so the target
+        temperature can be looked up with a bisect instead of a linear
+        scan. segment i runs from point i to point i+1 and is stored as
+        start time, start temperature and slope.
+        '''
+        self.times = [float(t) for (t, x) in self.data]
+        self.temps = [float(x) for (t, x) in self.data]
+        self.slopes = []
+        for i in range(len(self.data) - 1):
+            dt = self.times[i+1] - self.times[i]
+            if dt > 0:
+                self.slopes.append((self.temps[i+1] - self.temps[i]) / dt)
+            else:
+                # two points at the same time, a vertical step. it can be
+                # anywhere in the schedule, this segment has no width and
+                # find_segment never returns it: bisect_right skips to
+                # the segment starting after the step.
+                self.slopes.append(0.0)
+        self.duration = max(self.times)
+        # highest target reached so far at each point, never decreases.
+        # this is the index used to seek by temperature.
+        self.reach_temps = []
+        self.hash = None
+        for temp in self.temps:
+            if self.reach_temps:
+                temp = max(temp, self.reach_temps[-1])
+            self.reach_temps.append(temp)
+        # index of the last segment used, sequential lookups start here.
+        # ProfileStore hands the same Profile to every thread, so each
+        # thread keeps its own: the oven's firing is not slowed down by
+        # lookups from the web server.
+        self.cursors = threading.local()
+        # numpy copies of the table, built on first use by sample()
+        self.arrays = None
 
     def get_duration(self):
-        return max([t for (t, x) in self.data])
+        return self.duration
+
+    def as_dict(self):
+        return {"name": self.name, "data": self.data, "temp_units": self.temp_units}
+
+    def digest(self):
+        '''hash of the name, points and units, to check a saved copy'''
+        if self.hash is None:
+            text = json.dumps(self.as_dict(), sort_keys=True, separators=(',', ':'))
+            self.hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return self.hash
+
+    def find_segment(self, time):
+        '''return the index of the segment containing time. the segment
+        used by the previous call on this thread is checked first, so
+        calls with increasing times (the normal case during a firing)
+        are O(1).
+        '''
+        last = len(self.slopes) - 1
+        i = getattr(self.cursors, 'i', 0)
+        if i <= last and self.times[i] <= time:
+            if i == last or time < self.times[i+1]:
+                return i
+            if i+1 == last or time < self.times[i+2]:
+                self.cursors.i = i + 1
+                return i + 1
+        i = bisect.bisect_right(self.times, time) - 1
+        i = min(max(i, 0), last)
+        self.cursors.i = i
+        return i
 
     #  x = (y-y1)(x2-x1)/(y2-y1) + x1
     @staticmethod
@@ -747,55 +1245,100 @@ class Profile():
         return x
 
     def find_next_time_from_temperature(self, temperature):
-        time = 0 # The seek function will not do anything if this returns zero, no useful intersection was found
-        for index, point2 in enumerate(self.data):
-            if point2[1] >= temperature:
-                if index > 0: #  Zero here would be before the first segment
-                    if self.data[index - 1][1] <= temperature: # We have an intersection
-                        time = self.find_x_given_y_on_line_from_two_points(temperature, self.data[index - 1], point2)
-                        if time == 0:
-                            if self.data[index - 1][1] == point2[1]: # It's a flat segment that matches the temperature
-                                time = self.data[index - 1][0]
-                                break
-
-        return time
+        '''return the first time in the schedule at which the target
+        reaches temperature. reach_temps is the highest temperature the
+        schedule has reached by each point, so a bisect finds the first
+        point at or above temperature and the crossing is on the rising
+        segment ending at that point. returns 0 if the schedule never
+        gets that hot, in which case seek does nothing.
+        '''
+        i = bisect.bisect_left(self.reach_temps, temperature)
+        if i >= len(self.data):
+            return 0
+        if i == 0:
+            return self.data[0][0]
+        return self.find_x_given_y_on_line_from_two_points(temperature,
+            self.data[i - 1], self.data[i])
 
     def get_surrounding_points(self, time):
-        if time > self.get_duration():
+        if time > self.duration or len(self.data) < 2:
             return (None, None)
 
-        prev_point = None
-        next_point = None
-
-        for i in range(len(self.data)):
-            if time < self.data[i][0]:
-                prev_point = self.data[i-1]
-                next_point = self.data[i]
-                break
-
-        return (prev_point, next_point)
+        i = self.find_segment(time)
+        return (self.data[i], self.data[i+1])
 
     def get_target_temperature(self, time):
-        if time > self.get_duration():
+        if time > self.duration:
             return 0
+        if time <= self.times[0] or len(self.slopes) == 0:
+            return self.temps[0]
+        if time == self.duration:
+            return self.temps[-1]
 
-        (prev_point, next_point) = self.get_surrounding_points(time)
-
-        incl = float(next_point[1] - prev_point[1]) / float(next_point[0] - prev_point[0])
-        temp = prev_point[1] + (time - prev_point[0]) * incl
+        i = self.find_segment(time)
+        temp = self.temps[i] + (time - self.times[i]) * self.slopes[i]
         return temp
 
+    def sample(self, times, units=None):
+        '''evaluate the target temperature for many times at once.
+        times is any sequence or array of seconds. units is "c" or "f",
+        by default the units of the profile. as with
+        get_target_temperature, times past the end of the schedule
+        give 0. returns a numpy array if numpy is installed, else a list.
+        thermalModel.simulate_many (and so kiln-tuner.py --optimize) uses
+        it for every kiln of a step at once. SimulatedOven, and with it
+        batchSimulator, stays on get_target_temperature: catching up
+        moves the schedule while it runs, so its times are not known
+        ahead.
+        '''
+        if numpy is None:
+            return [self.convert(self.get_target_temperature(t), units)
+                if t <= self.duration else 0 for t in times]
+
+        if self.arrays is None:
+            self.arrays = (numpy.array(self.times),
+                           numpy.array(self.temps),
+                           numpy.array(self.slopes + [0.0]))
+        (starts, temps, slopes) = self.arrays
+
+        t = numpy.asarray(times, dtype=float)
+        i = numpy.searchsorted(starts, t, side='right') - 1
+        i = numpy.clip(i, 0, max(len(self.slopes) - 1, 0))
+        out = temps[i] + (t - starts[i]) * slopes[i]
+        out = numpy.where(t <= starts[0], temps[0], out)
+        out = numpy.where(t == self.duration, temps[-1], out)
+        out = self.convert(out, units)
+        return numpy.where(t > self.duration, 0.0, out)
+
+    def convert(self, temp, units=None):
+        '''convert temp from the units of this profile to units'''
+        if units is None or units.lower() == self.temp_units:
+            return temp
+        if units.lower() == "f":
+            return (temp * 9 / 5) + 32
+        return (temp - 32) * 5 / 9
+
 
 class PID():
 
-    def __init__(self, ki=1, kp=1, kd=1):
+    def __init__(self, ki=1, kp=1, kd=1, clock=None):
         self.ki = ki
         self.kp = kp
         self.kd = kd
-        self.lastNow = datetime.datetime.now()
+        self.clock = clock or Clock()
+        self.lastNow = self.clock.now()
         self.iterm = 0
         self.lastErr = 0
         self.pidstats = {}
+        # seconds the first compute after restore counts as
+        self.next_delta = None
+
+    def restore(self, iterm, lastErr, delta):
+        '''pick up where a checkpointed pid left off. however long the
+        restart took, the next compute integrates delta seconds.'''
+        self.iterm = iterm
+        self.lastErr = lastErr
+        self.next_delta = delta
 
     # FIX - this was using a really small window where the PID control
     # takes effect from -1 to 1. I changed this to various numbers and
@@ -804,6 +1347,8 @@ class PID():
     # instead of what used to be binary on/off control.
     def compute(self, setpoint, ispoint, now):
         timeDelta = (now - self.lastNow).total_seconds()
+        if self.next_delta is not None:
+            (timeDelta, self.next_delta) = (self.next_delta, None)
 
         window_size = 100
 
@@ -832,7 +1377,9 @@ class PID():
         else:
             icomp = (error * timeDelta * (1/self.ki))
             self.iterm += (error * timeDelta * (1/self.ki))
-            dErr = (error - self.lastErr) / timeDelta
+            # a virtual clock can call twice at the same instant
+            if timeDelta > 0:
+                dErr = (error - self.lastErr) / timeDelta
             output = self.kp * error + self.iterm + self.kd * dErr
             output = sorted([-1 * window_size, output, window_size])[1]
             out4logs = output
@@ -1,14 +1,30 @@
 import threading,logging,json,time,datetime
+import config
 from oven import Oven
+from firingHistory import FiringHistory
+from firingStore import FiringStore
+from broadcaster import Broadcaster
+from statusStream import Frame, Encoder
 log = logging.getLogger(__name__)
 
 class OvenWatcher(threading.Thread):
     def __init__(self,oven):
         self.last_profile = None
-        self.last_log = []
+        self.profile_json = "null"
+        # point budget -> (seq, backlog json)
+        self.backlogs = {}
+        self.history = FiringHistory()
+        # every firing on disk, see FiringStore
+        self.store = FiringStore() if config.history_db else None
         self.started = None
         self.recording = False
-        self.observers = []
+        self.broadcaster = Broadcaster()
+        # every state sent gets the next seq, see stamp
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.last_frame = None
+        # ticks between messages -> last frame sent at that rate
+        self.slow_frames = {}
         threading.Thread.__init__(self)
         self.daemon = True
         self.oven = oven
@@ -25,67 +41,137 @@ class OvenWatcher(threading.Thread):
     def run(self):
         while True:
             oven_state = self.oven.get_state()
-           
-            # record state for any new clients that join
-            if oven_state.get("state") == "RUNNING":
-                self.last_log.append(oven_state)
-            else:
-                self.recording = False
-            self.notify_all(oven_state)
+
+            # under the lock, a client that joins gets either this state
+            # in its backlog or as a message, never both or neither
+            with self.lock:
+                self.notify_all(oven_state)
+                # record state for any new clients that join
+                if oven_state.get("state") == "RUNNING":
+                    self.history.append(oven_state)
+                    # only once record has opened the run
+                    if self.store and self.recording:
+                        self.store.add(oven_state)
+                elif self.recording and oven_state.get("state") != "PAUSED":
+                    # a paused firing carries on in the same run
+                    self.recording = False
+                    if self.store:
+                        self.store.end_run(oven_state.get("state"))
+            # batched, and out of the lock so clients never wait on the disk
+            if self.store:
+                self.store.flush_if_due()
             time.sleep(self.oven.time_step)
 
-    def lastlog_subset(self,maxpts=50):
-        '''send about maxpts from lastlog by skipping unwanted data'''
-        totalpts = len(self.last_log)
-        if (totalpts <= maxpts):
-            return self.last_log
-        every_nth = int(totalpts / (maxpts - 1))
-        return self.last_log[::every_nth]
+    def points(self,maxpts=None):
+        '''point budget for a backlog, config.backlog_points by default'''
+        if not maxpts:
+            maxpts = config.backlog_points
+        return min(max(int(maxpts), 2), config.backlog_max_points)
+
+    def lastlog_subset(self,maxpts=None):
+        '''about maxpts states from the history that keep the shape of
+        the graph'''
+        return self.history.downsampled(self.points(maxpts))
+
+    def backlog_json(self,maxpts=None):
+        '''the backlog message for new observers. it is put together from
+        json that was serialized as states arrived, and kept until the
+        next state, so many clients connecting at once cost one join'''
+        points = self.points(maxpts)
+        cached = self.backlogs.get(points)
+        if cached and cached[0] == self.seq:
+            return cached[1]
+        backlog_json = '{"type": "backlog", "profile": %s, "log": %s}' % (
+            self.profile_json, self.history.downsampled_json(points))
+        self.backlogs[points] = (self.seq, backlog_json)
+        return backlog_json
 
     def record(self, profile):
         self.last_profile = profile
-        self.last_log = []
+        self.profile_json = json.dumps({
+            "name": profile.name,
+            "data": profile.data,
+            "type": "profile"
+        }) if profile else "null"
         self.started = datetime.datetime.now()
-        self.recording = True
         #we just turned on, add first state for nice graph
-        self.last_log.append(self.oven.get_state())
-
-    def add_observer(self,observer):
-        if self.last_profile:
-            p = {
-                "name": self.last_profile.name,
-                "data": self.last_profile.data, 
-                "type" : "profile"
-            }
-        else:
-            p = None
-        
-        backlog = {
-            'type': "backlog",
-            'profile': p,
-            'log': self.lastlog_subset(),
-            #'started': self.started
-        }
-        print(backlog)
-        backlog_json = json.dumps(backlog)
-        try:
-            print(backlog_json)
-            observer.send(backlog_json)
-        except:
-            log.error("Could not send backlog to new observer")
-        
-        self.observers.append(observer)
+        state = self.oven.get_state()
+        # the run is opened before run() stores anything of this firing,
+        # states from before record went with the last run or nowhere
+        with self.lock:
+            self.history.clear()
+            self.backlogs = {}
+            # a seq of its own, resume and the history need them unique
+            self.stamp(state)
+            self.history.append(state)
+            if self.store and profile:
+                self.store.start_run(self.profile_json, profile.name)
+                self.store.add(state)
+            self.recording = True
+
+    def stop_recording(self, end_state=None):
+        '''close the stored run before the oven starts something else, so
+        none of its states end up in this run while record is not called'''
+        with self.lock:
+            if self.store and self.recording:
+                self.store.end_run(end_state)
+            self.recording = False
+
+    def add_observer(self,observer,points=None,encoder=None,resume=None):
+        '''start sending states to observer. it first gets a backlog of
+        the firing so far, or with resume the states after seq resume
+        if the history still has every one of them at full resolution'''
+        with self.lock:
+            if resume is not None and 0 <= int(resume) <= self.seq:
+                # too far back to replay state by state, a backlog instead
+                states = self.history.since(int(resume))
+                if states is not None:
+                    replay = {'type': "replay", 'from': int(resume), 'log': states}
+                    self.broadcaster.add(observer, json.dumps(replay), encoder or Encoder())
+                    return
+            self.add_with_backlog(observer, points, encoder)
+
+    def add_with_backlog(self,observer,points,encoder):
+        # the backlog goes out first, then every state
+        self.broadcaster.add(observer, self.backlog_json(points), encoder or Encoder())
+
+    def remove_observer(self,observer):
+        self.broadcaster.remove(observer)
+
+    def client_stats(self):
+        return self.broadcaster.stats()
+
+    def subscribe(self,observer,topics=None,interval=0):
+        '''change what an observer gets, see statusStream.TOPICS'''
+        encoder = self.broadcaster.encoder(observer)
+        if encoder:
+            encoder.subscribe(topics, interval)
+
+    def ticks(self,encoder):
+        '''how many states apart the messages to encoder are'''
+        return max(int(round(encoder.interval / self.oven.time_step)), 1)
+
+    def stamp(self,message):
+        '''number the state and add the server time it was sent at'''
+        self.seq += 1
+        message['seq'] = self.seq
+        message['server_time'] = time.time()
 
     def notify_all(self,message):
-        message_json = json.dumps(message)
-        log.debug("sending to %d clients: %s"%(len(self.observers),message_json))
-
-        for wsock in self.observers:
-            if wsock:
-                try:
-                    wsock.send(message_json)
-                except:
-                    log.error("could not write to socket %s"%wsock)
-                    self.observers.remove(wsock)
-            else:
-                self.observers.remove(wsock)
+        # only queues the message, slow clients can not hold up the watcher.
+        # each client's encoder picks what it gets out of the frame
+        self.stamp(message)
+        self.last_frame = Frame(self.seq, message, self.last_frame)
+        self.broadcaster.broadcast(self.last_frame, lambda e: self.ticks(e) == 1)
+
+        # clients that asked for a slower rate get every n-th state,
+        # with deltas from the one they got before
+        rates = set(self.ticks(e) for e in self.broadcaster.encoders()) - set([1])
+        for n in list(self.slow_frames):
+            if n not in rates:
+                del self.slow_frames[n]
+        for n in rates:
+            if self.seq % n == 0:
+                frame = Frame(self.seq, message, self.slow_frames.get(n))
+                self.slow_frames[n] = frame
+                self.broadcaster.broadcast(frame, lambda e: self.ticks(e) == n)
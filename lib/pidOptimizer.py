@@ -0,0 +1,101 @@
+import ast,json,logging,multiprocessing
+import numpy
+import config
+from oven import Profile
+from thermalModel import ThermalModel, PIDArray, simulate_many
+log = logging.getLogger(__name__)
+
+# config.py settings that describe the simulated kiln
+MODEL_SETTINGS = [
+    'sim_t_env',
+    'sim_c_heat',
+    'sim_c_oven',
+    'sim_p_heat',
+    'sim_R_o_nocool',
+    'sim_R_ho_noair',
+]
+
+def current_model():
+    '''the thermal model described by config.py'''
+    return {name: getattr(config, name) for name in MODEL_SETTINGS}
+
+def load_model(filename):
+    '''read a config fragment of "name = value" lines, like the one
+    written by kiln-model.py, on top of the model in config.py.
+    '''
+    model = current_model()
+    with open(filename) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if '=' not in line:
+                continue
+            (name, value) = [x.strip() for x in line.split('=', 1)]
+            if name in MODEL_SETTINGS:
+                model[name] = float(ast.literal_eval(value))
+    return model
+
+def build_model(n, model):
+    return ThermalModel(n, t_env=model['sim_t_env'], c_heat=model['sim_c_heat'],
+        c_oven=model['sim_c_oven'], p_heat=model['sim_p_heat'],
+        R_o=model['sim_R_o_nocool'], R_ho=model['sim_R_ho_noair'])
+
+def score(result, overshoot_weight):
+    '''mean absolute error in degrees over the firing plus a penalty for
+    the worst overshoot. lower is better. kilns that never finished the
+    schedule get an infinite score.
+    '''
+    elapsed = numpy.maximum(result['elapsed'], 1)
+    total = result['abs_error'] / elapsed
+    total = total + overshoot_weight * numpy.maximum(result['max_overshoot'], 0)
+    return numpy.where(result['finished'], total, numpy.inf)
+
+def evaluate(run):
+    '''fire one profile with every set of gains at once. run is
+    (profile dict, kp, ki, kd, model, overshoot_weight) so it can be
+    handed to a process pool.
+    '''
+    (profile, kp, ki, kd, model, overshoot_weight) = run
+    n = len(kp)
+    profile = Profile(json.dumps(profile))
+    result = simulate_many(profile, n, model=build_model(n, model),
+        pid=PIDArray(n, kp=kp, ki=ki, kd=kd))
+    return score(result, overshoot_weight)
+
+def quiet():
+    logging.getLogger().setLevel(logging.WARNING)
+
+def optimize(profiles, model, population=256, rounds=6, keep=16, spread=10,
+             overshoot_weight=1.0, processes=None, seed=None):
+    '''search pid_kp, pid_ki and pid_kd against every profile with the
+    cross entropy method in log space. each round fires population
+    simulated kilns per profile, keeps the best keep sets of gains and
+    samples the next round around them. the search starts around the
+    gains in config.py, spread times larger or smaller.
+    returns ((kp, ki, kd), score) of the best gains found.
+    '''
+    rng = numpy.random.default_rng(seed)
+    start = numpy.log([config.pid_kp, config.pid_ki, config.pid_kd])
+    mean = start
+    sigma = numpy.full(3, numpy.log(spread) / 2)
+    best = (tuple(numpy.exp(start)), numpy.inf)
+
+    with multiprocessing.Pool(processes, initializer=quiet) as pool:
+        for r in range(rounds):
+            logs = rng.normal(mean, sigma, size=(population, 3))
+            # always re-check the best so far and where we started
+            logs[0] = numpy.log(best[0])
+            logs[1] = start
+            gains = numpy.exp(logs)
+            runs = [(p, gains[:, 0], gains[:, 1], gains[:, 2], model,
+                overshoot_weight) for p in profiles]
+            scores = sum(pool.map(evaluate, runs))
+
+            order = numpy.argsort(scores)
+            if scores[order[0]] < best[1]:
+                best = (tuple(float(g) for g in gains[order[0]]), float(scores[order[0]]))
+            elite = logs[order[:keep]]
+            mean = elite.mean(axis=0)
+            sigma = numpy.maximum(elite.std(axis=0), 0.01)
+            log.info("round %d: best score %.3f kp=%.3f ki=%.3f kd=%.3f" %
+                (r + 1, best[1], best[0][0], best[0][1], best[0][2]))
+    return best
@@ -0,0 +1,240 @@
+import threading,logging,json,os,copy
+import config
+from oven import Profile
+log = logging.getLogger(__name__)
+
+class ProfileStore(object):
+    '''Reads kiln profiles from a directory and keeps them in memory.
+    Each file is only re-read when its mtime or size changes, and the
+    json list sent to storage clients is only rebuilt when some file
+    was added, changed or deleted. Once a ProfileWatcher keeps the
+    cache up to date, reads are served from memory without looking at
+    the directory; without one every read scans.
+    inputs
+        config.temp_scale
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # filename -> {"sig": (mtime, size), "profile": dict, "compiled": Profile}
+        self.entries = {}
+        self.profiles_json = None
+        # called with (added, changed, deleted, gone) whenever a scan finds
+        # changes. the first three are filenames, gone are the names of
+        # the profiles that went with deleted or renamed files.
+        self.listeners = []
+        # True while a ProfileWatcher scans on every change
+        self.watched = False
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def signature(self, filename):
+        st = os.stat(os.path.join(self.path, filename))
+        return (st.st_mtime_ns, st.st_size)
+
+    def load(self, filename):
+        with open(os.path.join(self.path, filename), 'r') as f:
+            profile = json.load(f)
+        return normalize_temp_units([profile])[0]
+
+    def scan(self):
+        '''bring the cache up to date with the directory. returns lists
+        of the filenames that were added, changed and deleted.
+        '''
+        added = []
+        changed = []
+        deleted = []
+        gone = []
+        try:
+            filenames = sorted(os.listdir(self.path))
+        except OSError:
+            filenames = []
+
+        with self.lock:
+            for filename in filenames:
+                try:
+                    sig = self.signature(filename)
+                except OSError:
+                    # deleted between listdir and stat
+                    continue
+                entry = self.entries.get(filename)
+                if entry and entry["sig"] == sig:
+                    continue
+                try:
+                    profile = self.load(filename)
+                except (OSError, ValueError) as e:
+                    log.error("Could not read profile %s: %s" % (filename, e))
+                    profile = None
+                self.entries[filename] = {"sig": sig, "profile": profile,
+                    "compiled": None}
+                if entry:
+                    changed.append(filename)
+                    name = profile_name(entry)
+                    if name is not None and name != profile_name(self.entries[filename]):
+                        gone.append(name)
+                else:
+                    added.append(filename)
+
+            for filename in list(self.entries):
+                if filename not in filenames:
+                    name = profile_name(self.entries.pop(filename))
+                    deleted.append(filename)
+                    if name is not None:
+                        gone.append(name)
+
+            if added or changed or deleted:
+                self.profiles_json = None
+
+        if added or changed or deleted:
+            for listener in self.listeners:
+                listener(added, changed, deleted, gone)
+        return (added, changed, deleted)
+
+    def fresh(self):
+        '''scan, unless a watcher already does on every change'''
+        if not self.watched:
+            self.scan()
+
+    def cached_profiles(self):
+        # call with self.lock held. these are the cache itself, callers
+        # outside the store get copies they are free to change
+        return [e["profile"] for (f, e) in sorted(self.entries.items())
+            if e["profile"] is not None]
+
+    def get_profiles(self):
+        '''list of all parsed json profiles, sorted by filename'''
+        self.fresh()
+        with self.lock:
+            return copy.deepcopy(self.cached_profiles())
+
+    def get_profiles_json(self):
+        '''json list of all profiles, what the storage socket sends for GET'''
+        self.fresh()
+        with self.lock:
+            if self.profiles_json is None:
+                self.profiles_json = json.dumps(self.cached_profiles())
+            return self.profiles_json
+
+    def get_by_filename(self, filename):
+        '''return a copy of the parsed json profile stored in filename or None'''
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is None:
+                return None
+            return copy.deepcopy(entry["profile"])
+
+    def find_entry(self, name):
+        for (filename, entry) in sorted(self.entries.items()):
+            if entry["profile"] is not None and entry["profile"].get("name") == name:
+                return entry
+        return None
+
+    def get_profile(self, name):
+        '''return a copy of the parsed json profile with the given name or None'''
+        self.fresh()
+        with self.lock:
+            entry = self.find_entry(name)
+            if entry is None:
+                return None
+            return copy.deepcopy(entry["profile"])
+
+    def get_compiled(self, name):
+        '''return a Profile object for the given name or None. Profile
+        objects are built once per version of the file.
+        '''
+        self.fresh()
+        with self.lock:
+            entry = self.find_entry(name)
+            if entry is None:
+                return None
+            if entry["compiled"] is None:
+                entry["compiled"] = Profile(json.dumps(entry["profile"]))
+            return entry["compiled"]
+
+    def invalidate(self, filename):
+        '''force filename to be re-read by the next scan, which then
+        reports it as changed (or deleted) to the listeners'''
+        with self.lock:
+            self.mark_stale(filename)
+
+    def mark_stale(self, filename):
+        # call with self.lock held
+        if filename in self.entries:
+            self.entries[filename]["sig"] = None
+        self.profiles_json = None
+
+    def save(self, profile, force=False):
+        profile = add_temp_units(profile)
+        profile_json = json.dumps(profile)
+        filename = profile['name']+".json"
+        filepath = os.path.join(self.path, filename)
+        if not force and os.path.exists(filepath):
+            log.error("Could not write, %s already exists" % filepath)
+            return False
+        # write and mark stale under the lock, so a scan by the watcher
+        # can not pick up the new file and then report it again
+        with self.lock:
+            with open(filepath, 'w+') as f:
+                f.write(profile_json)
+            self.mark_stale(filename)
+        log.info("Wrote %s" % filepath)
+        # the next read sees it, and watchers are told right away
+        self.scan()
+        return True
+
+    def delete(self, profile):
+        filename = profile['name']+".json"
+        filepath = os.path.join(self.path, filename)
+        with self.lock:
+            os.remove(filepath)
+            self.mark_stale(filename)
+        log.info("Deleted %s" % filepath)
+        self.scan()
+        return True
+
+def profile_name(entry):
+    '''name inside the profile of a cache entry, None if unreadable'''
+    if entry["profile"] is None:
+        return None
+    return entry["profile"].get("name")
+
+def add_temp_units(profile):
+    """
+    always store the temperature in degrees c
+    this way folks can share profiles
+    """
+    if "temp_units" in profile:
+        return profile
+    profile['temp_units']="c"
+    if config.temp_scale=="c":
+        return profile
+    if config.temp_scale=="f":
+        profile=convert_to_c(profile);
+        return profile
+
+def convert_to_c(profile):
+    newdata=[]
+    for (secs,temp) in profile["data"]:
+        temp = (5/9)*(temp-32)
+        newdata.append((secs,temp))
+    profile["data"]=newdata
+    return profile
+
+def convert_to_f(profile):
+    newdata=[]
+    for (secs,temp) in profile["data"]:
+        temp = ((9/5)*temp)+32
+        newdata.append((secs,temp))
+    profile["data"]=newdata
+    return profile
+
+def normalize_temp_units(profiles):
+    normalized = []
+    for profile in profiles:
+        if "temp_units" in profile:
+            if config.temp_scale == "f" and profile["temp_units"] == "c":
+                profile = convert_to_f(profile)
+                profile["temp_units"] = "f"
+        normalized.append(profile)
+    return normalized
@@ -0,0 +1,114 @@
+import threading,logging,json,time,queue
+import config
+log = logging.getLogger(__name__)
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    # not installed or not linux, poll the directory instead
+    INotify = None
+
+class ProfileWatcher(threading.Thread):
+    '''Watches the profile directory and pushes added, changed and
+    deleted profiles to every connected storage websocket. Uses inotify
+    when inotify_simple is available, otherwise polls the directory.
+    Any scan of the ProfileStore that finds changes is pushed, so saves
+    and deletes done through the storage socket are sent out too. The
+    scan only queues the message, it goes out from the watcher's own
+    sender thread whichever thread scanned. While the watcher runs, the
+    store serves reads from its cache.
+    inputs
+        config.profile_poll_interval
+    '''
+    def __init__(self, store):
+        self.store = store
+        self.observers = []
+        self.lock = threading.Lock()
+        self.poll_interval = config.profile_poll_interval
+        self.inotify = None
+        # messages waiting for the sender thread
+        self.outbox = queue.Queue()
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.watch()
+        store.scan()
+        store.add_listener(self.changed)
+        store.watched = True
+        self.sender = threading.Thread(target=self.send_loop, daemon=True)
+        self.sender.start()
+        self.start()
+
+    def watch(self):
+        if INotify is None:
+            log.info("inotify not available, polling %s every %ds" %
+                (self.store.path, self.poll_interval))
+            return
+        try:
+            self.inotify = INotify()
+            self.inotify.add_watch(self.store.path, flags.CREATE |
+                flags.DELETE | flags.CLOSE_WRITE | flags.MOVED_TO |
+                flags.MOVED_FROM)
+            log.info("watching %s with inotify" % self.store.path)
+        except OSError as e:
+            log.error("inotify failed for %s, polling instead: %s" %
+                (self.store.path, e))
+            self.inotify = None
+
+    def run(self):
+        while True:
+            if self.inotify:
+                # block until something happens in the directory. the
+                # timeout is a safety net in case an event is missed.
+                self.inotify.read(timeout=self.poll_interval * 1000 * 10)
+            else:
+                time.sleep(self.poll_interval)
+            try:
+                self.store.scan()
+            except Exception as e:
+                log.error("profile scan failed: %s" % e)
+
+    def changed(self, added, changed, deleted, gone):
+        '''ProfileStore listener, builds the incremental message and
+        queues it for the sender'''
+        message = {
+            "type": "profiles",
+            "added": self.profiles(added),
+            "changed": self.profiles(changed),
+            # clients know profiles by name, not by file
+            "deleted": gone,
+        }
+        log.info("profiles added=%d changed=%d deleted=%d" %
+            (len(added), len(changed), len(deleted)))
+        self.outbox.put(message)
+
+    def send_loop(self):
+        while True:
+            self.notify_all(self.outbox.get())
+
+    def profiles(self, filenames):
+        profiles = []
+        for filename in filenames:
+            profile = self.store.get_by_filename(filename)
+            if profile is not None:
+                profiles.append(profile)
+        return profiles
+
+    def add_observer(self, observer):
+        with self.lock:
+            self.observers.append(observer)
+
+    def remove_observer(self, observer):
+        with self.lock:
+            if observer in self.observers:
+                self.observers.remove(observer)
+
+    def notify_all(self, message):
+        message_json = json.dumps(message)
+        with self.lock:
+            observers = list(self.observers)
+        for wsock in observers:
+            try:
+                wsock.send(message_json)
+            except:
+                log.error("could not write to socket %s" % wsock)
+                self.remove_observer(wsock)
@@ -0,0 +1,195 @@
+import threading,logging,json
+import config
+log = logging.getLogger(__name__)
+
+# versions of the /status protocol. a client picks one with
+# /status?v=N, clients that do not ask get version 1.
+#   1  every message is the whole oven state, as it always was
+#   2  a snapshot of the whole state, then only what changed:
+#      {"type": "snapshot", "v": 2, "seq": 7, "state": {...}}
+#      {"type": "delta", "v": 2, "seq": 8, "base": 7,
+#       "changed": {"runtime": 16, "pidstats": {"err": 1.5}}, "removed": []}
+#      a delta applies to the state as of seq base: first drop the
+#      removed keys, then merge changed in, where nested dicts only carry
+#      the keys that changed (a nested dict that lost keys is listed in
+#      removed and sent whole). if a client ever misses a message it is
+#      sent a new snapshot instead of a delta.
+VERSIONS = [1, 2]
+
+# fields of the oven state in each topic a client can subscribe to with
+# /status?topics=core,cost or a {"cmd": "subscribe", "topics": [...]}
+# message. clients that do not subscribe get every field.
+TOPICS = {
+    "core": ['state', 'runtime', 'temperature', 'target', 'heat',
+        'heat_rate', 'totaltime', 'profile', 'catching_up'],
+    "cost": ['cost', 'kwh_rate', 'currency_type'],
+    "pid": ['pidstats'],
+    # just the fraction of the time the elements are on, for the heat bar
+    "output": ['pidstats.out'],
+    "autotune": ['autotune'],
+}
+# in every message whatever the topics, see OvenWatcher.stamp
+ALWAYS = ['seq', 'server_time']
+
+def parse_topics(topics):
+    '''sorted tuple of known topics from a list or a comma separated
+    string, None (everything) for no topics'''
+    if not topics:
+        return None
+    if isinstance(topics, str):
+        topics = topics.split(',')
+    known = tuple(sorted(set(t.strip() for t in topics) & set(TOPICS)))
+    unknown = set(t.strip() for t in topics) - set(TOPICS)
+    if unknown:
+        log.error("unknown status topics %s, use %s" % (", ".join(sorted(unknown)),
+            ", ".join(sorted(TOPICS))))
+    return known or None
+
+def select(state, topics):
+    '''the part of state in topics. a field like pidstats.out picks
+    one key of a nested dict'''
+    if topics is None:
+        return state
+    fields = set(ALWAYS)
+    for topic in topics:
+        fields.update(TOPICS[topic])
+    selected = {k: v for (k, v) in state.items() if k in fields}
+    for field in fields:
+        if '.' not in field:
+            continue
+        (outer, inner) = field.split('.', 1)
+        if outer in fields or not isinstance(state.get(outer), dict):
+            continue
+        if inner in state[outer]:
+            selected.setdefault(outer, {})[inner] = state[outer][inner]
+    return selected
+
+def diff(old, new):
+    '''(changed, removed) turning dict old into dict new'''
+    changed = {}
+    removed = [key for key in old if key not in new]
+    for (key, value) in new.items():
+        if key not in old:
+            changed[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            (inner, gone) = diff(old[key], value)
+            if gone:
+                # simpler to replace the whole dict than to nest removals
+                removed.append(key)
+                changed[key] = value
+            elif inner:
+                changed[key] = inner
+        elif old[key] != value:
+            changed[key] = value
+    return (changed, removed)
+
+def rounded(value, digits):
+    '''value with every float rounded to digits decimals'''
+    if isinstance(value, float):
+        return round(value, digits)
+    if isinstance(value, dict):
+        return {k: rounded(v, digits) for (k, v) in value.items()}
+    if isinstance(value, list):
+        return [rounded(v, digits) for v in value]
+    return value
+
+class Frame(object):
+    '''One oven state as it goes out to status clients. Each encoding
+    of each subscription is made the first time a client needs it and
+    then shared by every client that wants the same, so a tick costs
+    one json.dumps per distinct payload, not one per client. Every
+    ClientQueue thread encodes from the same frame, so the cache is
+    filled under a lock.
+    inputs
+        config.status_compact_digits
+    '''
+    def __init__(self, seq, state, previous=None):
+        self.seq = seq
+        self.state = state
+        self.base = previous.seq if previous else None
+        self.previous_state = previous.state if previous else None
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def encode(self, kind, compact=False, topics=None):
+        key = (kind, compact, topics)
+        with self.lock:
+            if key not in self.cache:
+                self.cache[key] = self.build(kind, compact, topics)
+            return self.cache[key]
+
+    def build(self, kind, compact, topics):
+        state = select(self.state, topics)
+        if kind == "v1":
+            return json.dumps(state)
+        previous = self.previous_state
+        if previous is not None:
+            previous = select(previous, topics)
+        if compact:
+            # floats rounded, so rounding noise no longer counts as a change
+            state = rounded(state, config.status_compact_digits)
+            previous = rounded(previous, config.status_compact_digits)
+        if kind == "delta":
+            (changed, removed) = diff(previous, state)
+            message = {"type": "delta", "v": 2, "seq": self.seq,
+                "base": self.base, "changed": changed, "removed": removed}
+        else:
+            message = {"type": "snapshot", "v": 2, "seq": self.seq,
+                "state": state}
+        return json.dumps(message, separators=(',', ':'))
+
+class Encoder(object):
+    '''what one client gets from each Frame, keeps track of the last
+    frame the client was sent to decide between snapshot and delta.
+    it is called on the client's sender thread and subscribe on the
+    thread of its websocket, so both go through a lock.'''
+    def __init__(self, version=1, compact=False, topics=None, interval=0):
+        if version not in VERSIONS:
+            raise ValueError("unknown status protocol version %s" % version)
+        self.version = version
+        self.compact = compact
+        self.last = None
+        self.lock = threading.Lock()
+        self.subscribe(topics, interval)
+
+    def subscribe(self, topics=None, interval=0):
+        '''only send the fields in topics, at most every interval
+        seconds. the next message is a snapshot.'''
+        topics = parse_topics(topics)
+        try:
+            interval = max(float(interval or 0), 0)
+        except ValueError:
+            interval = 0
+        with self.lock:
+            self.topics = topics
+            self.interval = interval
+            self.last = None
+
+    @classmethod
+    def from_query(cls, query):
+        '''an Encoder for the /status?v=2&compact=1&topics=core&interval=60
+        query parameters, version 1 if the client did not ask or asked
+        for something we do not speak'''
+        try:
+            version = int(query.get('v') or 1)
+        except ValueError:
+            version = 1
+        if version not in VERSIONS:
+            log.error("status client asked for protocol version %s, using 1" % version)
+            version = 1
+        compact = query.get('compact') in ('1', 'true')
+        return cls(version, compact, query.get('topics'), query.get('interval'))
+
+    def __call__(self, frame):
+        with self.lock:
+            topics = self.topics
+            if self.version == 1:
+                kind = "v1"
+            elif self.last is not None and frame.base == self.last:
+                kind = "delta"
+            else:
+                kind = "snapshot"
+            self.last = frame.seq
+        if kind == "v1":
+            return frame.encode(kind, False, topics)
+        return frame.encode(kind, self.compact, topics)
@@ -0,0 +1,223 @@
+import csv,logging
+from array import array
+import numpy
+log = logging.getLogger(__name__)
+
+# the first order plus dead time parameters, in the order of the
+# covariance matrix returned by fit_fopdt. the gain K is R * T. fitting
+# the initial slope R instead keeps the fit well posed for a kiln that
+# is still heating in a nearly straight line when the run stops, where
+# only R and the dead time L can be seen in the data.
+FOPDT = ['y0', 'R', 'L', 'T']
+
+def read_tuning_log(filename):
+    '''read tuning.csv from kiln-tuner.py in one pass into numpy arrays
+    of times (seconds from the first sample) and temperatures. rows
+    that do not parse are skipped.
+    '''
+    times = array('d')
+    temps = array('d')
+    with open(filename, newline='') as f:
+        rows = csv.reader(f)
+        header = next(rows, [])
+        try:
+            (time_col, temp_col) = (header.index('time'), header.index('temperature'))
+        except ValueError:
+            return (numpy.zeros(0), numpy.zeros(0))
+        for row in rows:
+            try:
+                stamp = float(row[time_col])
+                temp = float(row[temp_col])
+            except (IndexError, ValueError):
+                continue  # just ignore bad values!
+            times.append(stamp)
+            temps.append(temp)
+
+    times = numpy.frombuffer(times, dtype=float)
+    temps = numpy.frombuffer(temps, dtype=float)
+    if len(times):
+        times = times - times[0]
+    return (times, temps)
+
+def smoothed(temps, width=5):
+    '''running median of width samples, a single bad reading disappears'''
+    if len(temps) < width:
+        return temps
+    half = width // 2
+    padded = numpy.concatenate([numpy.repeat(temps[:1], half), temps,
+        numpy.repeat(temps[-1:], half)])
+    return numpy.median(numpy.lib.stride_tricks.sliding_window_view(padded, width), axis=1)
+
+def heating_part(times, temps, target=None):
+    '''the elements are on at full power until the temperature first
+    passes target. without a target the heating is taken to end at the
+    hottest sample. both are judged on a running median, so a spike does
+    not end the heating early.
+    '''
+    smooth = smoothed(temps)
+    if target is not None:
+        above = numpy.flatnonzero(smooth > target)
+        if len(above):
+            end = above[0] + 1
+            return (times[:end], temps[:end])
+    end = int(numpy.argmax(smooth)) + 1
+    return (times[:end], temps[:end])
+
+def fopdt(params, times):
+    '''y0 + R * T * (1 - exp(-(t - L) / T)) after the dead time L, y0 before'''
+    (y0, R, L, T) = params
+    elapsed = numpy.maximum(times - L, 0)
+    return y0 + R * T * -numpy.expm1(-elapsed / T)
+
+def jacobian(params, times):
+    (y0, R, L, T) = params
+    elapsed = numpy.maximum(times - L, 0)
+    rise = -numpy.expm1(-elapsed / T)
+    decay = 1 - rise
+    after = times > L
+    return numpy.column_stack([
+        numpy.ones_like(times),
+        T * rise,
+        numpy.where(after, -R * decay, 0),
+        R * (rise - decay * elapsed / T),
+    ])
+
+def bins(times, temps, n):
+    '''average the samples into at most n equal count bins'''
+    if len(times) <= n:
+        return (times, temps)
+    edges = numpy.linspace(0, len(times), n + 1).astype(int)
+    counts = numpy.diff(edges)
+    return (numpy.add.reduceat(times, edges[:-1]) / counts,
+            numpy.add.reduceat(temps, edges[:-1]) / counts)
+
+def grid_search(times, temps, size=48):
+    '''best (y0, R, L, T) over a grid of dead times and time constants.
+    y0 and R enter linearly, so for every (L, T) they are solved in
+    closed form, all grid points at once.
+    '''
+    span = max(times[-1], 1e-9)
+    Ls = numpy.linspace(0, span / 2, size)
+    Ts = numpy.geomspace(span / 50, span * 50, size)
+    (L, T) = [g.ravel() for g in numpy.meshgrid(Ls, Ts)]
+
+    basis = T[:, None] * -numpy.expm1(-numpy.maximum(times[None, :] - L[:, None], 0) / T[:, None])
+    n = len(times)
+    sx = basis.sum(axis=1)
+    sxx = (basis * basis).sum(axis=1)
+    sxy = basis @ temps
+    sy = temps.sum()
+    det = n * sxx - sx * sx
+    ok = det > 1e-12
+    det = numpy.where(ok, det, 1)
+    R = (n * sxy - sx * sy) / det
+    y0 = (sy - R * sx) / n
+    residual = temps[None, :] - y0[:, None] - R[:, None] * basis
+    sse = numpy.where(ok, (residual * residual).sum(axis=1), numpy.inf)
+    best = int(numpy.argmin(sse))
+    return numpy.array([y0[best], R[best], L[best], T[best]])
+
+def fit_fopdt(times, temps, iterations=50):
+    '''least squares first order plus dead time fit to the heating
+    curve of a tuning run. a coarse grid over binned samples finds the
+    neighbourhood, then Levenberg-Marquardt on every sample polishes it.
+    returns a dict with the parameters y0, R, L, T and the gain K, the
+    rms error and r2 of the fit, and the covariance of the parameters
+    (in FOPDT order).
+    '''
+    if len(times) < 5:
+        raise ValueError("need at least 5 samples to fit, got %d" % len(times))
+    params = grid_search(*bins(times, temps, 400))
+    # past this the curve is a straight line as far as the data can tell
+    longest = max(times[-1], 1.0) * 1e4
+
+    def sse(p):
+        r = temps - fopdt(p, times)
+        return float(r @ r)
+
+    best_sse = sse(params)
+    damping = 1e-3
+    for i in range(iterations):
+        J = jacobian(params, times)
+        residual = temps - fopdt(params, times)
+        jtj = J.T @ J
+        gradient = J.T @ residual
+        improved = False
+        while damping < 1e10:
+            try:
+                step = numpy.linalg.solve(jtj + damping * numpy.diag(numpy.diag(jtj) + 1e-12), gradient)
+            except numpy.linalg.LinAlgError:
+                damping *= 10
+                continue
+            candidate = params + step
+            candidate[2] = max(candidate[2], 0.0)
+            candidate[3] = min(max(candidate[3], 1e-9), longest)
+            candidate_sse = sse(candidate)
+            if candidate_sse < best_sse:
+                (params, best_sse) = (candidate, candidate_sse)
+                damping = max(damping / 10, 1e-9)
+                improved = True
+                break
+            damping *= 10
+        if not improved or numpy.abs(step / numpy.maximum(numpy.abs(params), 1e-9)).max() < 1e-9:
+            break
+
+    n = len(times)
+    dof = max(n - len(FOPDT), 1)
+    J = jacobian(params, times)
+    try:
+        covariance = numpy.linalg.inv(J.T @ J) * best_sse / dof
+    except numpy.linalg.LinAlgError:
+        covariance = numpy.full((len(FOPDT), len(FOPDT)), numpy.inf)
+    total = ((temps - temps.mean()) ** 2).sum()
+    fit = dict(zip(FOPDT, (float(p) for p in params)))
+    fit['K'] = fit['R'] * fit['T']
+    fit['rms'] = float(numpy.sqrt(best_sse / n))
+    fit['r2'] = float(1 - best_sse / total) if total > 0 else 0.0
+    fit['covariance'] = covariance
+    fit['samples'] = n
+    log.info("fopdt fit: R=%.4f L=%.1fs T=%.1fs rms=%.3f" % (fit['R'], fit['L'], fit['T'], fit['rms']))
+    return fit
+
+def rise(fit, end):
+    '''degrees the fitted curve climbs from y0 by time end. taken from
+    the fit rather than the samples, so one bad reading does not scale
+    the gains.'''
+    return float(fopdt([fit[p] for p in FOPDT], numpy.array([end]))[0] - fit['y0'])
+
+def ziegler_nichols(fit, span):
+    '''pid gains from a fopdt fit with the Ziegler-Nichols reaction
+    curve rules, scaled like the old tangent method: the steepest slope
+    R of the fit crosses span degrees in span / R seconds, see rise. the
+    time constant does not enter, so a run that stops while the kiln is
+    still heating in a straight line tunes just as well.
+    pid_kp = 1.2 span / (R L), pid_ki = 2 R L^2 / (1.2 span) and
+    pid_kd = 0.6 span / R. returns a dict of these and their relative
+    standard errors kp_error, ki_error and kd_error, propagated from the
+    covariance of the fit with span taken as exact.
+    '''
+    (R, L) = (fit['R'], fit['L'])
+    if L <= 0 or R <= 0:
+        raise ValueError("no dead time or no heating found in the heating curve")
+    rise = span / R
+
+    # Magic Ziegler-Nicols constants ahead!
+    Kp = 1.2 * (rise / L)
+    Ti = 2 * L
+    Td = 0.5 * L
+
+    # first order error propagation of the log of each gain
+    covariance = fit['covariance']
+    def error(gradient):
+        gradient = numpy.array(gradient)
+        return float(numpy.sqrt(max(gradient @ covariance @ gradient, 0)))
+
+    return {
+        'pid_kp': Kp,
+        # pid_ki is inverted, see config.py
+        'pid_ki': Ti / Kp,
+        'pid_kd': Kp * Td,
+        'kp_error': error([0, -1 / R, -1 / L, 0]),
+        'ki_error': error([0, 1 / R, 2 / L, 0]),
+        'kd_error': error([0, -1 / R, 0, 0]),
+    }
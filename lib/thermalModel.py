@@ -0,0 +1,180 @@
+import logging
+import numpy
+import config
+from oven import Integrator
+log = logging.getLogger(__name__)
+
+def as_array(value, n):
+    '''broadcast a scalar or sequence to a float array of n kilns'''
+    return numpy.broadcast_to(numpy.asarray(value, dtype=float), (n,)).copy()
+
+class ThermalModel(object):
+    '''The two node heater/oven model of SimulatedOven for n kilns at
+    once. Every parameter may be a single value shared by all kilns or
+    an array with one value per kiln, so a parameter sweep or a Monte
+    Carlo run is one numpy expression per step instead of one python
+    thread per kiln.
+    inputs
+        config.sim_t_env
+        config.sim_c_heat
+        config.sim_c_oven
+        config.sim_p_heat
+        config.sim_R_o_nocool
+        config.sim_R_ho_noair
+    '''
+    def __init__(self, n, t_env=None, c_heat=None, c_oven=None, p_heat=None,
+                 R_o=None, R_ho=None, integrator=None):
+        self.n = n
+        self.integrator = integrator or Integrator()
+        def param(value, default):
+            return as_array(default if value is None else value, n)
+        self.t_env = param(t_env, config.sim_t_env)
+        self.c_heat = param(c_heat, config.sim_c_heat)
+        self.c_oven = param(c_oven, config.sim_c_oven)
+        self.p_heat = param(p_heat, config.sim_p_heat)
+        self.R_o = param(R_o, config.sim_R_o_nocool)
+        self.R_ho = param(R_ho, config.sim_R_ho_noair)
+
+        # every kiln starts at the temperature of its surroundings
+        self.t = self.t_env.copy()
+        self.t_h = self.t_env.copy()
+
+    def step(self, pid, time_step):
+        '''advance every kiln by time_step seconds with the elements on
+        for the fraction pid of the step, integrated the same way as
+        SimulatedOven.temp_changes.
+        '''
+        (self.t_h, self.t) = self.integrator.step(self.t_h, self.t,
+            self.p_heat * pid, time_step, self.c_heat, self.c_oven,
+            self.R_ho, self.R_o, self.t_env)
+        return self.t
+
+class PIDArray(object):
+    '''PID.compute for n kilns at once, including the pid control window
+    and low temperature throttling.
+    inputs
+        config.pid_control_window
+        config.throttle_below_temp
+        config.throttle_percent
+    '''
+    def __init__(self, n, kp=None, ki=None, kd=None):
+        self.kp = as_array(config.pid_kp if kp is None else kp, n)
+        self.ki = as_array(config.pid_ki if ki is None else ki, n)
+        self.kd = as_array(config.pid_kd if kd is None else kd, n)
+        self.iterm = numpy.zeros(n)
+        self.lastErr = numpy.zeros(n)
+
+    def compute(self, setpoint, ispoint, timeDelta):
+        window_size = 100
+        window = config.pid_control_window
+        error = setpoint - ispoint
+        inside = numpy.abs(error) <= window
+
+        self.iterm += numpy.where(inside, error * timeDelta / self.ki, 0)
+        if timeDelta > 0:
+            dErr = (error - self.lastErr) / timeDelta
+        else:
+            dErr = numpy.zeros_like(error)
+        output = self.kp * error + self.iterm + self.kd * dErr
+        output = numpy.clip(output, -window_size, window_size) / window_size
+
+        heating = 1.0
+        if config.throttle_below_temp and config.throttle_percent:
+            heating = numpy.where(setpoint <= config.throttle_below_temp,
+                config.throttle_percent / 100, 1.0)
+        output = numpy.where(error > window, heating, output)
+        output = numpy.where(error < -window, 0.0, output)
+
+        self.lastErr = error
+        # no active cooling
+        return numpy.maximum(output, 0.0)
+
+def simulate_many(profile, n, model=None, pid=None, time_step=None,
+                  max_time=None, record=False):
+    '''fire profile in n simulated kilns at once, following the same
+    steps as Oven.step on a virtual clock: cost, catch up, runtime,
+    target, pid, temperature change, emergency and end of schedule.
+    model and pid default to a ThermalModel and PIDArray built from
+    config.py. returns a dict of per kiln arrays: max_overshoot,
+    abs_error (integrated |target - temperature| in degree seconds),
+    catching_up and elapsed (seconds) and cost. with record=True it
+    also has temperature and target, arrays of shape (steps, n) that
+    are nan once a kiln has finished.
+    inputs
+        config.sensor_time_wait
+        config.kiln_must_catch_up
+        config.pid_control_window
+        config.thermocouple_offset
+        config.emergency_shutoff_temp
+        config.kwh_rate
+        config.kw_elements
+    '''
+    model = model or ThermalModel(n)
+    pid = pid or PIDArray(n)
+    time_step = time_step or config.sensor_time_wait
+    duration = profile.get_duration()
+    if max_time is None:
+        max_time = duration * 10
+    window = config.pid_control_window
+
+    runtime = numpy.zeros(n)
+    target = numpy.zeros(n)
+    heat = numpy.zeros(n)
+    running = numpy.ones(n, dtype=bool)
+    overshoot = numpy.zeros(n)
+    abs_error = numpy.zeros(n)
+    catching_up = numpy.zeros(n)
+    elapsed = numpy.zeros(n)
+    cost = numpy.zeros(n)
+    temps = []
+    targets = []
+
+    timeDelta = 0.0
+    steps = 0
+    while running.any() and steps * time_step <= max_time:
+        cost += numpy.where(running, config.kwh_rate * config.kw_elements * heat / 3600, 0)
+
+        temp = model.t + config.thermocouple_offset
+        if config.kiln_must_catch_up:
+            behind = numpy.abs(target - temp) > window
+        else:
+            behind = numpy.zeros(n, dtype=bool)
+        runtime = numpy.where(running & ~behind, runtime + timeDelta, runtime)
+        target = numpy.where(running, profile.sample(runtime), target)
+
+        out = pid.compute(target, temp, timeDelta)
+        out = numpy.where(running, out, 0.0)
+        heat = time_step * out
+        model.step(out, time_step)
+
+        # a step that ends the schedule or trips the emergency shutoff
+        # is not part of the trace of a headless run, so skip it here too
+        temp = model.t + config.thermocouple_offset
+        stop = runtime > duration
+        if not config.ignore_temp_too_high:
+            stop |= temp >= config.emergency_shutoff_temp
+        running &= ~stop
+
+        overshoot = numpy.where(running, numpy.maximum(overshoot, temp - target), overshoot)
+        abs_error += numpy.where(running, numpy.abs(target - temp) * time_step, 0)
+        catching_up += numpy.where(running & behind, time_step, 0)
+        elapsed += numpy.where(running, time_step, 0)
+        if record:
+            temps.append(numpy.where(running, temp, numpy.nan))
+            targets.append(numpy.where(running, target, numpy.nan))
+
+        timeDelta = time_step
+        steps += 1
+
+    result = {
+        'max_overshoot': overshoot,
+        'abs_error': abs_error,
+        'catching_up': catching_up,
+        'elapsed': elapsed,
+        'cost': cost,
+        'finished': ~running,
+    }
+    if record:
+        result['temperature'] = numpy.array(temps)
+        result['target'] = numpy.array(targets)
+    return result
@@ -19,11 +19,37 @@ if (window.location.protocol == 'https:') {
     protocol = 'wss:';
 }
 var host = "" + protocol + "//" + window.location.hostname + ":" + window.location.port;
-var ws_status = new WebSocket(host+"/status");
+// about one point of backlog per pixel of graph
+var ws_status = new WebSocket(host+"/status?v=2&topics=core,cost,output&points="+Math.max($(window).width(), 200));
 var ws_control = new WebSocket(host+"/control");
 var ws_config = new WebSocket(host+"/config");
 var ws_storage = new WebSocket(host+"/storage");
 
+// /status?v=2 sends a snapshot of the oven state and then only what
+// changed, see lib/statusStream.py. returns the whole state.
+var status_state = {};
+function apply_status(x) {
+    if (x.type == "snapshot") {
+        status_state = x.state;
+        return status_state;
+    }
+    if (x.type == "delta") {
+        x.removed.forEach(function(k) { delete status_state[k]; });
+        Object.keys(x.changed).forEach(function(k) {
+            var v = x.changed[k];
+            var old = status_state[k];
+            if (v && old && typeof v == "object" && typeof old == "object" && !Array.isArray(v)) {
+                status_state[k] = Object.assign({}, old, v);
+            }
+            else {
+                status_state[k] = v;
+            }
+        });
+        return status_state;
+    }
+    return x;
+}
+
 
 if(window.webkitRequestAnimationFrame) window.requestAnimationFrame = window.webkitRequestAnimationFrame;
 
@@ -503,7 +529,7 @@ $(document).ready(function()
 
         ws_status.onmessage = function(e)
         {
-            x = JSON.parse(e.data);
+            x = apply_status(JSON.parse(e.data));
             if (x.type == "backlog")
             {
                 if (x.profile)
@@ -519,8 +545,8 @@ $(document).ready(function()
 
                 $.each(x.log, function(i,v) {
                     graph.live.data.push([v.runtime, v.temperature]);
-                    graph.plot = $.plot("#graph_container", [ graph.profile, graph.live ] , getOptions());
                 });
+                graph.plot = $.plot("#graph_container", [ graph.profile, graph.live ] , getOptions());
             }
 
             if(state!="EDIT")
@@ -677,9 +703,24 @@ $(document).ready(function()
                 return;
             }
 
-            //the message is an array of profiles
-            //FIXME: this should be better, maybe a {"profiles": ...} container?
-            profiles = message;
+            if(message.type == "profiles")
+            {
+                // only the profiles that were added, changed or deleted
+                var gone = message.deleted.concat($.map(message.changed, function(p) { return p.name; }));
+                profiles = $.grep(profiles, function(p) { return $.inArray(p.name, gone) === -1; });
+                profiles = profiles.concat(message.changed, message.added);
+                profiles.sort(function(a, b) { return a.name < b.name ? -1 : (a.name > b.name ? 1 : 0); });
+
+                // do not pull the profile out from under the editor,
+                // leaving edit mode asks for the full list again
+                if(state == "EDIT") return;
+            }
+            else
+            {
+                //the message is an array of profiles
+                //FIXME: this should be better, maybe a {"profiles": ...} container?
+                profiles = message;
+            }
             //delete old options in select
             $('#e2').find('option').remove().end();
             // check if current selected value is a valid profile name
@@ -1,18 +1,56 @@
 config = "";
-all = [];
+// the firing so far, downsampled by the server, see load_history
+var firing = [];
+// states received since the history was loaded
+var recent = [];
+// the last 15 minutes of states, for the error averages and the table
+var live = [];
 var table = "";
+// about one point per pixel
+var history_points = Math.max(window.innerWidth, 200);
 
 var protocol = 'ws:';
 if (window.location.protocol == 'https:') {
   protocol = 'wss:';
   }
 var host = "" + protocol + "//" + window.location.hostname + ":" + window.location.port;
-var ws_status = new WebSocket(host+"/status");
+var ws_status = new WebSocket(host+"/status?v=2&topics=core,pid");
 var ws_config = new WebSocket(host+"/config");
 
+// /status?v=2 sends a snapshot of the oven state and then only what
+// changed, see lib/statusStream.py. returns the whole state.
+var status_state = {};
+function apply_status(x) {
+  if (x.type == "snapshot") {
+    status_state = x.state;
+    return status_state;
+    }
+  if (x.type == "delta") {
+    x.removed.forEach(function(k) { delete status_state[k]; });
+    Object.keys(x.changed).forEach(function(k) {
+      var v = x.changed[k];
+      var old = status_state[k];
+      if (v && old && typeof v == "object" && typeof old == "object" && !Array.isArray(v)) {
+        status_state[k] = Object.assign({}, old, v);
+        }
+      else {
+        status_state[k] = v;
+        }
+      });
+    return status_state;
+    }
+  return x;
+}
+
 ws_status.onmessage = function(e) {
-  x = JSON.parse(e.data);
+  x = apply_status(JSON.parse(e.data));
+  if (x.type == "backlog") {
+    return;
+    }
   if (x.pidstats) {
+    // the changes below are for display, keep the received state as it was
+    x = Object.assign({}, x);
+    x.pidstats = Object.assign({}, x.pidstats);
     x.pidstats["datetime"]=unix_to_yymmdd_hhmmss(x.pidstats.time);
     x.pidstats.err = x.pidstats.err*-1;
     x.pidstats.out = x.pidstats.out*100;
@@ -20,17 +58,25 @@ ws_status.onmessage = function(e) {
     if (x.catching_up == true) {
       x.pidstats.catchingup = x.pidstats.ispoint;
       }
-    all.push(x.pidstats);
+    if (x.state == "RUNNING") {
+      recent.push(x.pidstats);
+      }
+    live.push(x.pidstats);
+    var oldest = x.pidstats.time - 15*60;
+    while (live.length && live[0].time < oldest) {
+      live.shift();
+      }
     }
   var str = JSON.stringify(x, null, 2);
   document.getElementById("state").innerHTML = "<pre>"+str+"</pre>"
   table.replaceData(latest(20));
+  var all = firing.concat(recent);
   drawall(all);
 
   document.getElementById("error-current").innerHTML = rnd(x.pidstats.err);
-  document.getElementById("error-1min").innerHTML = rnd(average("err",1,all));
-  document.getElementById("error-5min").innerHTML = rnd(average("err",5,all));
-  document.getElementById("error-15min").innerHTML = rnd(average("err",15,all));
+  document.getElementById("error-1min").innerHTML = rnd(average("err",1,live));
+  document.getElementById("error-5min").innerHTML = rnd(average("err",5,live));
+  document.getElementById("error-15min").innerHTML = rnd(average("err",15,live));
   
   document.getElementById("temp").innerHTML = rnd(x.pidstats.ispoint);
   document.getElementById("target").innerHTML = rnd(x.pidstats.setpoint);
@@ -49,7 +95,61 @@ ws_config.onmessage = function(e) {
   //console.log(e);
   };
 
-create_table(all);
+create_table(live);
+load_history();
+// cheap when nothing changed, the server answers 304
+setInterval(load_history, 60000);
+
+//---------------------------------------------------------------------------
+// the firing so far from /api/history, downsampled on the server to about
+// history_points rows that keep the shape of the curves. rows are turned
+// into the pidstats the websocket sends.
+function load_history() {
+fetch("/api/history?points=" + history_points).then(function(response) {
+  if (!response.ok) {
+    throw new Error("no stored firing");
+    }
+  return response.text();
+  }).then(function(text) {
+  var rows = [];
+  text.split("\n").forEach(function(line) {
+    if (line == "") {
+      return;
+      }
+    var row = JSON.parse(line);
+    if (row.type == "run") {
+      return;
+      }
+    rows.push(history_row(row));
+    });
+  firing = rows;
+  var last = rows.length ? rows[rows.length - 1].time : 0;
+  recent = recent.filter(function(r) { return r.time > last; });
+  }).catch(function(e) {
+  // nothing stored, keep what came over the websocket
+  });
+}
+
+//---------------------------------------------------------------------------
+function history_row(row) {
+var r = {
+  time: row.server_time,
+  datetime: unix_to_yymmdd_hhmmss(row.server_time),
+  setpoint: row.target,
+  ispoint: row.temperature,
+  err: row.temperature - row.target,
+  p: row.pid_p,
+  i: row.pid_i,
+  d: row.pid_d,
+  out: row.pid_out*100,
+  // the fraction of the time catching up for a rolled up row
+  catching_up: row.catching_up,
+  };
+if (row.catching_up >= 0.5) {
+  r.catchingup = row.temperature;
+  }
+return r;
+}
 
 //---------------------------------------------------------------------------
 function rnd(number) {
@@ -60,9 +160,15 @@ function average(field,minutes,data) {
 if(data[0]!=null) {
   var t = data[data.length - 1].time;
   var oldest = t-(60*minutes);
-  var q = "SELECT AVG("+ field + ") from ? where time>=" + oldest.toString();
-  var avg = alasql(q,[data]);
-  return avg[0]["AVG(err)"];
+  var sum = 0;
+  var count = 0;
+  data.forEach(function(row) {
+    if (row.time >= oldest) {
+      sum += row[field];
+      count++;
+      }
+    });
+  return sum/count;
   }
 return 0;
 }
@@ -80,7 +186,7 @@ draw_d(data);
 //---------------------------------------------------------------------------
 function draw_heat(data) {
 var traces=[];
-var rows = alasql('SELECT datetime, out from ?',[data]);
+var rows = data;
 var title = 'Heating Percent';
 
 var trace = {
@@ -98,13 +204,13 @@ var layout = {
   title: title,
   showlegend: true,
   };
-Plotly.newPlot(spot, traces, layout, {displayModeBar: false});
+Plotly.react(spot, traces, layout, {displayModeBar: false});
 }
 
 //---------------------------------------------------------------------------
 function draw_p(data) {
 var traces=[];
-var rows = alasql('SELECT datetime, p from ?',[data]);
+var rows = data;
 var title = 'Proportional';
 
 var trace = {
@@ -122,13 +228,13 @@ var layout = {
   title: title,
   showlegend: true,
   };
-Plotly.newPlot(spot, traces, layout, {displayModeBar: false});
+Plotly.react(spot, traces, layout, {displayModeBar: false});
 }
 
 //---------------------------------------------------------------------------
 function draw_i(data) {
 var traces=[];
-var rows = alasql('SELECT datetime, i from ?',[data]);
+var rows = data;
 var title = 'Integral';
 
 var trace = {
@@ -146,13 +252,13 @@ var layout = {
   title: title,
   showlegend: true,
   };
-Plotly.newPlot(spot, traces, layout, {displayModeBar: false});
+Plotly.react(spot, traces, layout, {displayModeBar: false});
 }
 
 //---------------------------------------------------------------------------
 function draw_d(data) {
 var traces=[];
-var rows = alasql('SELECT datetime, d from ?',[data]);
+var rows = data;
 var title = 'Derivative';
 
 var trace = {
@@ -170,14 +276,14 @@ var layout = {
   title: title,
   showlegend: true,
   };
-Plotly.newPlot(spot, traces, layout, {displayModeBar: false});
+Plotly.react(spot, traces, layout, {displayModeBar: false});
 }
 
 
 //---------------------------------------------------------------------------
 function draw_error(data) {
 var traces=[];
-var rows = alasql('SELECT datetime, err from ?',[data]);
+var rows = data;
 var title = 'Error';
 
 var trace = {
@@ -196,13 +302,13 @@ var layout = {
   showlegend: true,
   //xaxis : { tickformat:'%b' },
   };
-Plotly.newPlot(spot, traces, layout, {displayModeBar: false});
+Plotly.react(spot, traces, layout, {displayModeBar: false});
 }
 
 //---------------------------------------------------------------------------
 function draw_temps(data) {
 var traces=[];
-var rows = alasql('SELECT datetime, ispoint, setpoint, catchingup from ?',[data]);
+var rows = data;
 var title = 'Temperature and Target';
 
 var trace = {
@@ -241,7 +347,7 @@ var layout = {
   showlegend: true,
   //xaxis : { tickformat:'%b' },
   };
-Plotly.newPlot(spot, traces, layout, {displayModeBar: false});
+Plotly.react(spot, traces, layout, {displayModeBar: false});
 }
 
 //---------------------------------------------------------------------------
@@ -259,21 +365,20 @@ return newd.toISOString().replace("T"," ").substring(0, 19);
 }
 //---------------------------------------------------------------------------
 function latest(n) {
-//sql = "select * from ? order by time desc limit " + n;
-sql = "select * from ? order by time desc";
-results = alasql(sql,[all]);
-return results;
+return live.slice(-n).reverse();
 }
 
 //---------------------------------------------------------------------------
 function percent_catching_up(data) {
-var sql = "select sum(timeDelta) as slip from ? where catching_up=true";
-var a = alasql(sql,[data]);
-a = a[0]["slip"];
-sql = "select sum(timeDelta) as [all] from ?";
-var b = alasql(sql,[data]);
-b = b[0]["all"];
-return a/b*100;
+// rows are not evenly spaced, weigh each by the time since the one before
+var slip = 0;
+var all = 0;
+for (var n = 1; n < data.length; n++) {
+  var dt = data[n].time - data[n-1].time;
+  slip += dt * Number(data[n].catching_up);
+  all += dt;
+  }
+return slip/all*100;
 }
 //---------------------------------------------------------------------------
 function create_table(data) {
@@ -297,6 +402,7 @@ table = new Tabulator("#state-table", {
 
 //---------------------------------------------------------------------------
 function csv_string() {
-table.download("csv", "kiln-state.csv");
+// the whole firing from the server, not just what is in the table
+window.location = "/api/history?format=csv&points=10000";
 }
 